@@ -3,25 +3,15 @@ See emabot/backtests/ for list of strats
 """
 import sys
 import argparse
-from decimal import Decimal
+from typing import TYPE_CHECKING
 from tabulate import tabulate
-import numpy as np
-from tinydb import TinyDB, Query
-from tinydb.storages import JSONStorage
-from tinydb_serialization import SerializationMiddleware
-from tinydb_serialization import Serializer
 from .util import huf, import_class
-from .backtests.base import Stats
+from .results import ResultsStore, DEFAULT_DB, dataset_fingerprint, default_pair
 
-
-class DecimalSerializer(Serializer):
-    OBJ_CLASS = Decimal
-
-    def encode(self, obj):
-        return str(obj)
-
-    def decode(self, s):
-        return float(s)
+# The strategies (numpy, pandas, talib) are imported by the backtest itself, `backtest results`
+# doesn't load them (see importtime.py)
+if TYPE_CHECKING:
+    from .backtests.base import Stats
 
 def backtest(
         emaA: int = 2,
@@ -32,10 +22,16 @@ def backtest(
         c2c: bool = False,
         dump_ohlc: bool = False,
         progress_bar: bool = True,
-        strategy: str = 'emabot.backtests.ema.Ema') -> Stats:
+        vectorized: bool = True,
+        df=None,
+        ledger: str = 'decimal',
+        memory_budget: int = None,
+        strategy: str = 'emabot.backtests.ema.Ema') -> 'Stats':
 
     backtest_cls = import_class(strategy)
-    backtester = backtest_cls(csv_file, debug=debug, progress_bar=progress_bar)
+    backtester = backtest_cls(
+        csv_file, debug=debug, progress_bar=progress_bar, vectorized=vectorized, df=df,
+        ledger=ledger, c2c=c2c, memory_budget=memory_budget)
     backtester.init(emaA=emaA, emaB=emaB, resample=resample)
     if dump_ohlc:
         print('Dumping OHLC:')
@@ -48,7 +44,31 @@ def backtest(
             print('NOTICE: Early exit because ctrl-c')
     return backtester.stats
 
+def summarize(stats: 'Stats') -> dict:
+    """Total, monthly mean and monthly median figures for a finished backtest"""
+    monthly = stats.monthly()
+    return {
+        'fee_total':monthly['fee'].sum(),
+        'net_profit_total':monthly['net_profit'].sum(),
+        'net_profit_mean':monthly['net_profit'].mean(),
+        'net_profit_median':monthly['net_profit'].median(),
+        'percent_total':monthly['percent'].sum(),
+        'percent_mean':monthly['percent'].mean(),
+        'percent_median':monthly['percent'].median(),
+        'wins':stats.wins,
+        'losses':stats.losses,
+    }
+
 def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+        from .sweep import main as sweep_main
+        sweep_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'results':
+        from .results import main as results_main
+        results_main(sys.argv[2:])
+        return
+    from .backtests.ledger import LEDGERS
     parser = argparse.ArgumentParser()
     parser.add_argument('--csv-file',
         help='Path to OHLC CSV file', dest='csv_file', required=True)
@@ -72,19 +92,25 @@ def main() -> None:
         help='Coin-to-coin (higher precision)', dest='c2c', action='store_true', required=False)
     parser.add_argument('--no-progress-bar',
         help='Disable progress bar', dest='no_progress_bar', action='store_true', required=False)
+    parser.add_argument('--ledger',
+        help='Wallet arithmetic: decimal (reference), float or fixed (default:decimal)',
+        dest='ledger', required=False, default='decimal', choices=LEDGERS)
+    parser.add_argument('--no-vectorize',
+        help='Use the row-by-row reference loop instead of vectorized signals',
+        dest='no_vectorize', action='store_true', required=False)
+    parser.add_argument('--memory-budget',
+        help='Run out-of-core, loading about this many MB of rows at a time', dest='memory_budget',
+        required=False, default=None, type=int)
+    parser.add_argument('--db',
+        help='Results database (default:{})'.format(DEFAULT_DB), dest='db', required=False,
+        default=DEFAULT_DB)
+    parser.add_argument('--pair',
+        help='Name results are stored under (default:CSV file name)', dest='pair',
+        required=False, default=None)
     args = parser.parse_args()
     print('ARGS: emaA={} emaB={} resample={} c2c={} strategy={}'.format(
         args.ema_a, args.ema_b, args.resample, args.c2c, args.strategy))
 
-    # Create a TinyDB table to store results in
-    table_name = '{}-{}-{}-{}-{}'.format(
-        args.ema_a, args.ema_b, args.resample, args.strategy.split('.')[-1],
-        args.csv_file.split('.csv')[0])
-    serialization = SerializationMiddleware(JSONStorage)
-    serialization.register_serializer(DecimalSerializer(), 'TinyDecimal')
-    db = TinyDB('backtests/db.json', storage=serialization)
-    table = db.table(table_name)
-
     sys.stdout.flush() # make sure ARGS outputs before tqdm
     stats = backtest(
         emaA=args.ema_a, emaB=args.ema_b, resample=args.resample,
@@ -93,38 +119,29 @@ def main() -> None:
         dump_ohlc=args.dump_ohlc,
         strategy=args.strategy,
         progress_bar=True if not args.no_progress_bar else False,
+        vectorized=not args.no_vectorize,
+        ledger=args.ledger,
+        memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
     )
     if args.dump_ohlc:
         return
-    fee_total = sum([sum(i) for i in stats.per_day['fee'].values()])
-    percent_total = sum([sum(i) for i in stats.per_day['percent'].values()])
-    net_profit_total = sum([sum(i) for i in stats.per_day['net_profit'].values()])
-    percent_mean = np.mean([sum(i) for i in stats.per_day['percent'].values()])
-    net_profit_mean = np.mean([sum(i) for i in stats.per_day['net_profit'].values()])
-    percent_median = np.median([sum(i) for i in stats.per_day['percent'].values()])
-    net_profit_median = np.median([sum(i) for i in stats.per_day['net_profit'].values()])
+    summary = summarize(stats)
     day_results = []
     print('Sell log:')
-    print(tabulate(stats.sell_log, tablefmt='fancy_grid', headers=[
+    sell_log = [(timestamp, huf(bought), huf(price), huf(profit), huf(percent), huf(wallet))
+        for (timestamp, bought, price, profit, percent, wallet) in stats.sell_log]
+    print(tabulate(sell_log, tablefmt='fancy_grid', headers=[
         'Date', 'Buy Price', 'Sell Price', 'Net Profit', 'Percent', 'Wallet']))
     print('Month breakdown (percent):')
-    for timestamp in stats.per_day['fee'].keys():
-        if args.c2c:
-            day_results.append((
-                timestamp,
-                '{:,.8f}'.format(sum(stats.per_day['percent'][timestamp])),
-                '{:,.8f}'.format(np.mean(stats.per_day['percent'][timestamp])),
-                '{:,.8f}'.format(np.median(stats.per_day['percent'][timestamp])),
-                len(stats.per_day['percent'][timestamp]),
-            ))
-        else:
-            day_results.append((
-                timestamp,
-                '{:,.2f}'.format(sum(stats.per_day['percent'][timestamp])),
-                '{:,.2f}'.format(np.mean(stats.per_day['percent'][timestamp])),
-                '{:,.2f}'.format(np.median(stats.per_day['percent'][timestamp])),
-                len(stats.per_day['percent'][timestamp]),
-            ))
+    number_format = '{:,.8f}' if args.c2c else '{:,.2f}'
+    for (timestamp, month) in stats.monthly().iterrows():
+        day_results.append((
+            timestamp,
+            number_format.format(month['percent']),
+            number_format.format(month['percent_mean']),
+            number_format.format(month['percent_median']),
+            int(month['transactions']),
+        ))
 
     print(tabulate(day_results, tablefmt='fancy_grid', headers=[
         'Date',
@@ -132,25 +149,27 @@ def main() -> None:
         'Transactions',
         ])
     )
-    db_results = {
-        'fee_total':fee_total,
-        'net_profit_total':net_profit_total,
-        'net_profit_mean':net_profit_mean,
-        'net_profit_median':net_profit_median,
-        'percent_total':percent_total,
-        'percent_mean':percent_mean,
-        'percent_median':percent_median,
-        'wins':stats.wins,
-        'losses':stats.losses,
-        'day_results':day_results,
-    }
-    table.insert(db_results)
+    store = ResultsStore(args.db)
+    store.insert(dict(
+        summary,
+        csv_file=args.csv_file,
+        pair=args.pair or default_pair(args.csv_file),
+        strategy=args.strategy,
+        ema_a=args.ema_a,
+        ema_b=args.ema_b,
+        resample=args.resample,
+        ledger=args.ledger,
+        dataset=dataset_fingerprint(args.csv_file),
+        wallet=stats.wallet,
+        day_results=day_results,
+    ))
+    store.close()
     results = {
-        'Monthly Mean Percent':[huf(percent_mean)],
-        'Monthly Median Percent':[huf(percent_median)],
+        'Monthly Mean Percent':[huf(summary['percent_mean'])],
+        'Monthly Median Percent':[huf(summary['percent_median'])],
         'Wins':[stats.wins],
         'Losses':[stats.losses],
-        'Total Net Profit':[huf(net_profit_total)],
+        'Total Net Profit':[huf(summary['net_profit_total'])],
     }
     print('Results:')
     print(tabulate(results, tablefmt='fancy_grid', headers='keys'))
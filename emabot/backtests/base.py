@@ -6,52 +6,302 @@ from tqdm import tqdm
 import numpy as np
 import pandas as pd
 import pandas_ta as ta
-from ..util import huf, pdiff
+from .. import ohlc
+from . import indicators
+from .ledger import make_ledger
 
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 FEE = Decimal(0.6/100)
+# Rough bytes per 1m row while a chunk is processed (index, columns and temporaries)
+ROW_BYTES = 256
+MIN_CHUNK_ROWS = 1440
 
 class Stats:
-    wallet: Decimal = Decimal('1000.00')
-    losses: int = 0
-    wins: int = 0
-    per_day: dict = {
-        'fee':{}, 'net_profit':{}, 'percent':{}
-    }
-    sell_log: list = []
+    """Per-backtest results: wallet, win/loss counts and a columnar log of every sell"""
+    TRADE_DTYPE = np.dtype([
+        ('timestamp', 'datetime64[ns]'), ('buy', 'f8'), ('sell', 'f8'), ('fee', 'f8'),
+        ('profit', 'f8'), ('percent', 'f8'), ('wallet', 'f8'),
+    ])
+
+    def __init__(self, wallet: Decimal = Decimal('1000.00'), capacity: int = 1024):
+        self.wallet = wallet
+        self.losses = 0
+        self.wins = 0
+        self._trades = np.zeros(capacity, dtype=self.TRADE_DTYPE)
+        self._count = 0
+
+    def _reserve(self, count: int) -> None:
+        if self._count + count > len(self._trades):
+            size = max(len(self._trades) * 2, self._count + count)
+            grown = np.zeros(size, dtype=self.TRADE_DTYPE)
+            grown[:self._count] = self._trades[:self._count]
+            self._trades = grown
+
+    def add(self, timestamp, buy, sell, fee, profit, percent, wallet) -> None:
+        self._reserve(1)
+        self._trades[self._count] = (
+            np.datetime64(timestamp, 'ns'), buy, sell, fee, profit, percent, wallet)
+        self._count += 1
+        if profit > 0:
+            self.wins += 1
+        else:
+            self.losses += 1
+
+    def extend(self, timestamp, buy, sell, fee, profit, percent, wallet) -> None:
+        """add() for arrays of sells"""
+        count = len(timestamp)
+        self._reserve(count)
+        rows = self._trades[self._count:self._count + count]
+        rows['timestamp'] = timestamp
+        for (name, values) in (('buy', buy), ('sell', sell), ('fee', fee), ('profit', profit),
+                ('percent', percent), ('wallet', wallet)):
+            rows[name] = values
+        self._count += count
+        wins = int(np.count_nonzero(np.asarray(profit) > 0))
+        self.wins += wins
+        self.losses += count - wins
+
+    @property
+    def trades(self) -> np.ndarray:
+        return self._trades[:self._count]
+
+    @property
+    def sell_log(self) -> list:
+        """(date, buy price, sell price, net profit, percent, wallet) per sell"""
+        trades = self.trades
+        return list(zip(pd.to_datetime(trades['timestamp']), trades['buy'].tolist(),
+            trades['sell'].tolist(), trades['profit'].tolist(), trades['percent'].tolist(),
+            trades['wallet'].tolist()))
+
+    def monthly(self) -> pd.DataFrame:
+        """Per year-month fee/net profit/percent aggregates, oldest month first"""
+        trades = self.trades
+        df = pd.DataFrame({
+            'fee':trades['fee'], 'net_profit':trades['profit'], 'percent':trades['percent'],
+        }, index=pd.to_datetime(trades['timestamp']).strftime('%Y-%m'))
+        grouped = df.groupby(level=0, sort=True)
+        result = grouped.sum()
+        result['percent_mean'] = grouped['percent'].mean()
+        result['percent_median'] = grouped['percent'].median()
+        result['transactions'] = grouped.size()
+        return result
+
+def load_dataframe(csv_file: str, columns: tuple = None, float_dtype=None) -> pd.DataFrame:
+    """Read csv file using pandas and convert and set index to timestamp col
+
+    Expects form:
+        "timestamp","low","high","open","close","volume"
+
+    Only columns (all by default) are loaded, prices as float_dtype (default float64).
+    """
+    return _index_frame(ohlc.read_csv(csv_file, usecols=columns, float_dtype=float_dtype))
+
+def _index_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df.timestamp = pd.to_datetime(df.timestamp, unit='s')
+    df = df.set_index("timestamp")
+    df.dropna(axis='rows', how='any', inplace=True)
+    return df
+
+def transitions(entries, exits, holding: bool = False) -> np.ndarray:
+    """Return the row indexes where a long-only position flips, starting flat (or holding).
+
+    Starting flat, even positions in the result are buys and odd positions are sells (the other
+    way around when holding). This matches the
+    "if not self.buys and entry: buy / elif self.buys and exit: sell" rule used by the strategies.
+    """
+    entries = np.asarray(entries, dtype=bool)
+    exits = np.asarray(exits, dtype=bool)
+    if np.any(entries & exits):
+        raise ValueError('entry and exit signals overlap; use the row loop for this strategy')
+    # marks[0] is the position before the first row
+    marks = np.zeros(len(entries) + 1, dtype=np.int8)
+    marks[0] = 1 if holding else 0
+    marks[1:][entries] = 1
+    marks[1:][exits] = -1
+    # Forward fill the last non-zero mark to get the held/not-held state for every row
+    last = np.where(marks != 0, np.arange(len(marks)), 0)
+    np.maximum.accumulate(last, out=last)
+    position = (marks[last] == 1).astype(np.int8)
+    return np.flatnonzero(np.diff(position))
 
 class BacktestBase(ABC):
-    def __init__(self, csv_file: str, progress_bar: bool = True, debug: bool = False):
+    # Columns the strategy reads (None loads all) and the dtype of the price columns
+    COLUMNS = None
+    FLOAT_DTYPE = None
+
+    def __init__(self, csv_file: str, progress_bar: bool = True, debug: bool = False,
+            vectorized: bool = True, df: pd.DataFrame = None, ledger: str = 'decimal',
+            c2c: bool = False, memory_budget: int = None):
         self._csv_file = csv_file
         self._progress_bar = progress_bar
         self._debug = debug
-        self._df = self._get_dataframe()
+        self._vectorized = vectorized
+        self._memory_budget = memory_budget
+        self._init_kwargs = {}
+        if df is None and memory_budget and self._chunkable():
+            # Out-of-core: run() loads the data a chunk at a time
+            self._df = None
+        else:
+            if df is None and memory_budget:
+                print('NOTICE: {} can not run in chunks, loading all data'.format(
+                    type(self).__name__))
+            # A preloaded dataframe can be shared between runs (strategies must not modify it in
+            # place)
+            self._df = df if df is not None else self._get_dataframe()
         self._last_timestamp = None
         self.buys = []
         self.fee = FEE
         self.stats = Stats()
+        self.ledger = make_ledger(ledger, self.stats.wallet, self.fee, c2c=c2c)
+        self.stats.wallet = self.ledger.value(self.ledger.wallet)
 
-    @abstractmethod
     def init(self, *args, **kwargs) -> None:
-        """Setup any extra initialization here (e.g. apply ema to dataframe)"""
-        pass
+        """Setup any extra initialization here (e.g. apply ema to dataframe)
+
+        By default the indicators() columns are added to the dataframe and forward filled.
+        """
+        self._init_kwargs = kwargs
+        if self._df is None:
+            # Chunked run, see _run_chunked()
+            return
+        self._df = self._df.drop(columns=['open','high','low','volume'], errors='ignore')
+        for (name, values) in self.indicators(**kwargs).items():
+            self._df[name] = values
+        self._df.fillna(method='ffill', inplace=True)
+        self._df.dropna(axis='rows', how='any', inplace=True)
+
+    def indicators(self, **kwargs) -> dict:
+        """Return {column: Series indexed by resample bin} for the default init()
+
+        Strategies that only need these columns can run out-of-core (memory_budget).
+        """
+        raise NotImplementedError('{} must implement init() or indicators()'.format(
+            type(self).__name__))
+
+    def _chunkable(self) -> bool:
+        return (type(self).indicators is not BacktestBase.indicators
+            and self._csv_file is not None and ohlc.is_cacheable(self._csv_file))
 
     @abstractmethod
     def backtest(self, timestamp, row) -> None:
         """Each row is fed into here for applying a backtest strategy on a stream of data"""
         pass
 
+    def signals(self) -> tuple:
+        """Optionally return (entries, exits) boolean arrays aligned with self._df.
+
+        Strategies that can express their buy/sell rules as whole-column comparisons implement
+        this to enable the vectorized engine. Return None to fall back to backtest() per row.
+        """
+        return None
+
     def run(self) -> None:
         """Run the backtest"""
-        for (timestamp, row) in self._next_row():
+        if self._df is None:
+            self._run_chunked()
+            return
+        self._run_frame(self._progress_bar)
+
+    def _run_frame(self, progress_bar: bool) -> None:
+        """Backtest the rows in self._df, continuing from the current position and wallet"""
+        if self._vectorized:
+            signals = self.signals()
+            if signals is not None:
+                self._run_vectorized(*signals)
+                return
+        for (timestamp, row) in self._next_row(progress_bar):
             self.backtest(timestamp, row)
             if self.stats.wallet < 1:
                 break
 
-    def _next_row(self) -> tuple:
-        """Generate from self._df.iterrows()"""
+    def _run_chunked(self) -> None:
+        """Walk the dataset in time ordered chunks of about memory_budget bytes.
+
+        The indicators are computed once over the resample bins (small) and expanded onto each
+        chunk's rows. The forward fill carries the last value of every column over chunk
+        boundaries and the open position stays in self.buys, so the result is identical to
+        the in-memory run.
+        """
+        indicators = self.indicators(**self._init_kwargs)
+        carry = {name:np.nan for name in indicators}
+        starts = self._chunk_starts()
         if self._progress_bar:
+            starts = tqdm(starts)
+        for start in starts:
+            if self.stats.wallet < 1:
+                break
+            df = self._read_chunk(start)
+            df = df.drop(columns=['open','high','low','volume'], errors='ignore')
+            for (name, values) in indicators.items():
+                column = values.reindex(df.index).ffill().fillna(carry[name])
+                if len(column):
+                    carry[name] = column.iloc[-1]
+                df[name] = column
+            df.dropna(axis='rows', how='any', inplace=True)
+            self._df = df
+            self._run_frame(False)
+        self._df = None
+
+    def _chunk_starts(self) -> range:
+        chunk_rows = max(MIN_CHUNK_ROWS, self._memory_budget // ROW_BYTES)
+        return range(0, ohlc.row_count(self._csv_file), chunk_rows)
+
+    def _read_chunk(self, start: int) -> pd.DataFrame:
+        """Indexed, NaN-free rows of the chunk starting at row start"""
+        stop = start + self._chunk_starts().step
+        return _index_frame(ohlc.read_rows(self._csv_file, start, stop,
+            usecols=self.COLUMNS, float_dtype=self.FLOAT_DTYPE))
+
+    def _run_vectorized(self, entries, exits) -> None:
+        """Find position transitions with array ops and only visit the rows that trade.
+
+        Trades are replayed through do_buy()/do_sell() so the sell log and Stats are identical to
+        the row loop. Ledgers that support it settle all trades at once with array ops instead.
+        """
+        close = self._df['close'].values
+        index = self._df.index
+        holding = bool(self.buys)
+        flips = transitions(entries, exits, holding)
+        if self.ledger.vectorized:
+            self._settle_vectorized(close, index, flips)
+            return
+        for (n, i) in enumerate(flips, 1 if holding else 0):
+            self._last_timestamp = index[i]
+            price = close[i].item()
+            if n % 2 == 0:
+                self.do_buy(price)
+            else:
+                self.do_sell(price, 0)
+                if self.stats.wallet < 1:
+                    break
+
+    def _settle_vectorized(self, close: np.ndarray, index: pd.DatetimeIndex,
+            flips: np.ndarray) -> None:
+        if self.buys:
+            # Bought in an earlier chunk, the first flip sells it
+            bought_all = np.concatenate([[self.buys.pop()], close[flips[1::2]]])
+            sells = flips[0::2]
+        else:
+            bought_all = close[flips[0::2]]
+            sells = flips[1::2]
+        bought = bought_all[:len(sells)]
+        sold = close[sells]
+        (fee, percent, profit, wallet) = self.ledger.sell_many(bought, sold)
+        settled = len(fee)
+        self.stats.extend(index.values[sells[:settled]], bought[:settled], sold[:settled], fee,
+            profit, percent, wallet)
+        if settled:
+            self._last_timestamp = index[sells[settled - 1]]
+            self.stats.wallet = wallet[-1].item()
+        broke = settled and wallet[-1] < 1
+        if settled == len(sells) and not broke and len(bought_all) > len(sells):
+            # Still holding at the end of the data
+            self.buys.append(self.ledger.price(bought_all[-1].item()))
+
+    def _next_row(self, progress_bar: bool = False) -> tuple:
+        """Generate from self._df.iterrows()"""
+        if progress_bar:
             progress_bar = tqdm(total=len(self._df))
             for (timestamp, row) in self._df.iterrows():
                 progress_bar.update(1)
@@ -62,44 +312,44 @@ class BacktestBase(ABC):
                 self._last_timestamp = timestamp
                 yield timestamp, row
 
-    def _get_dataframe(self) -> pd.DataFrame:
-        """Read csv file using pandas and convert and set index to timestamp col
+    def _resample_close(self, rule: str) -> pd.Series:
+        """Close per resample bin, same as self._df.resample(rule).ohlc()['close']['close']
 
-        Expects form:
-            "timestamp","low","high","open","close","volume"
+        Served from the dataset's resample pyramid when the CSV is cached.
         """
-        df = pd.read_csv(self._csv_file)
-        df.timestamp = pd.to_datetime(df.timestamp, unit='s')
-        df = df.set_index("timestamp")
-        df.dropna(axis='rows', how='any', inplace=True)
-        return df
+        if self._csv_file and ohlc.is_cacheable(self._csv_file):
+            try:
+                return ohlc.resample_close(self._csv_file, rule)
+            except OSError:
+                pass
+        if self._df is None:
+            # Chunked run: only the close column of each chunk is kept
+            close = pd.concat([self._read_chunk(start)['close'] for start in self._chunk_starts()])
+        else:
+            close = self._df['close']
+        return close.resample(rule).last()
+
+    def _indicator(self, name: str, rule: str, *params):
+        """talib.<name> over the resampled close, memoized per dataset (see indicators.py)"""
+        close = self._resample_close(rule)
+        return indicators.indicator(name, close, rule, *params, csv_file=self._csv_file)
+
+    def _get_dataframe(self) -> pd.DataFrame:
+        """Read csv file using pandas and convert and set index to timestamp col"""
+        return load_dataframe(self._csv_file, self.COLUMNS, self.FLOAT_DTYPE)
 
     def do_buy(self, price: Decimal):
-        self.buys.append(price)
-        size = self.stats.wallet / price
+        self.buys.append(self.ledger.price(price))
 
     def do_sell(self, price: Decimal, buy_index: int):
-        fee = self.stats.wallet * self.fee
+        price = self.ledger.price(price)
         bought = self.buys[buy_index]
-        percent = pdiff(bought, price)
-        profit = self.stats.wallet * ((percent/100)-FEE)
-        self.stats.wallet = self.stats.wallet + profit
-        timestamp = self._last_timestamp
-        self.stats.sell_log.append(
-            (timestamp, huf(bought), huf(price), huf(profit), huf(percent), huf(self.stats.wallet))
-        )
+        (fee, percent, profit, wallet) = self.ledger.sell(bought, price)
         del(self.buys[buy_index])
-        if profit > 0:
-            self.stats.wins += 1
-        else:
-            self.stats.losses += 1
-        year_month_day = str(timestamp).rsplit('-', 1)[0]
-        if not year_month_day in self.stats.per_day['fee']:
-            self.stats.per_day['fee'][year_month_day] = []
-        if not year_month_day in self.stats.per_day['percent']:
-            self.stats.per_day['percent'][year_month_day] = []
-        if not year_month_day in self.stats.per_day['net_profit']:
-            self.stats.per_day['net_profit'][year_month_day] = []
-        self.stats.per_day['fee'][year_month_day].append(fee)
-        self.stats.per_day['percent'][year_month_day].append(percent)
-        self.stats.per_day['net_profit'][year_month_day].append(profit)
+        self._record_sell(self.ledger.value(bought), self.ledger.value(price),
+            fee, percent, profit, wallet)
+
+    def _record_sell(self, bought, price, fee, percent, profit, wallet) -> None:
+        """Add a sell to the stats (values in report units, formatting happens at report time)"""
+        self.stats.wallet = wallet
+        self.stats.add(self._last_timestamp, bought, price, fee, profit, percent, wallet)
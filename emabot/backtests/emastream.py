@@ -1,13 +1,16 @@
 from decimal import Decimal
 import talib
+import numpy as np
 import pandas as pd
 import pandas_ta as ta
 from .base import BacktestBase
 pd.options.mode.chained_assignment = None
 
 class EmaStream(BacktestBase):
+    COLUMNS = ('timestamp', 'close')
+
     def init(self, *args, **kwargs):
-        self._df = self._df.drop(columns=['open','high','low','volume'])
+        self._df = self._df.drop(columns=['open','high','low','volume'], errors='ignore')
         #idf = self._df.resample(kwargs['resample']).ohlc()
         #self._df['emaA'] = ta.ema(idf['close']['close'], length=kwargs['emaA'])
         #self._df['emaB'] = ta.ema(idf['close']['close'], length=kwargs['emaB'])
@@ -18,6 +21,65 @@ class EmaStream(BacktestBase):
         self._resample = kwargs['resample']
         self._ticks = 0
 
+    def _stream_ema(self, period: int, rows: np.ndarray, bins: np.ndarray,
+            label_ok: np.ndarray, open_ok: np.ndarray) -> np.ndarray:
+        """The EMA backtest() ends up with at each decision row, without the prefix recompute
+
+        backtest() assigns each bin's EMA to the row stamped with the bin label and forward fills.
+        So a row sees the open bin's EMA (its partial close folded into the previous closed bin's
+        EMA) if the open bin's label row is already in the prefix, else the last closed bin with
+        a label row and a non-NaN EMA.
+
+        The open bin's step is computed here while backtest() gets it from talib, which may round
+        it differently in the last bit (see decider.EmaState). Decisions are the same unless emaA
+        and emaB are within an ulp or so of each other; tests/test_backtests.py checks the sell
+        log against backtest().
+        """
+        closed = self._indicator('EMA', self._resample, period).values
+        close = self._df['close'].values[rows]
+        # EMA of the open bin, talib's formula
+        k = 2.0 / (period + 1)
+        prev = closed[np.maximum(bins - 1, 0)]
+        partial = np.where(bins >= period, ((close - prev) * k) + prev, np.nan)
+        seeding = np.flatnonzero(bins == period - 1)
+        if len(seeding):
+            # The open bin completes the SMA seed
+            total = 0.0
+            for c in self._resample_close(self._resample).values[:period - 1].tolist():
+                total += c
+            for i in seeding:
+                partial[i] = (total + close[i]) / period
+        # Index of the last closed bin carried forward by the ffill, per bin
+        last = np.where(label_ok & ~np.isnan(closed), np.arange(len(closed)), -1)
+        np.maximum.accumulate(last, out=last)
+        before = np.where(bins >= 1, last[np.maximum(bins - 1, 0)], -1)
+        carried = np.where(before >= 0, closed[np.maximum(before, 0)], np.nan)
+        return np.where(open_ok & ~np.isnan(partial), partial, carried)
+
+    def signals(self):
+        """Vectorized equivalent of backtest(): O(n) instead of a resample per decision"""
+        n = len(self._df)
+        index = self._df.index.values
+        counts = pd.Series(np.ones(n), index=self._df.index).resample(self._resample).count()
+        labels = counts.index.values
+        bin_of_row = np.repeat(np.arange(len(counts)), counts.values)
+        # Decisions are made on every 60th row
+        rows = np.arange(59, n, 60)
+        bins = bin_of_row[rows]
+        # Bins whose label has a row of its own (only those get an EMA assigned before the ffill)
+        label_pos = np.searchsorted(index, labels)
+        label_ok = np.zeros(len(labels), dtype=bool)
+        inside = label_pos < n
+        label_ok[inside] = index[label_pos[inside]] == labels[inside]
+        open_ok = label_ok[bins] & (label_pos[bins] <= rows)
+        emaA = self._stream_ema(self._emaA, rows, bins, label_ok, open_ok)
+        emaB = self._stream_ema(self._emaB, rows, bins, label_ok, open_ok)
+        entries = np.zeros(n, dtype=bool)
+        exits = np.zeros(n, dtype=bool)
+        entries[rows] = emaA > emaB
+        exits[rows] = emaB > emaA
+        return entries, exits
+
     def backtest(self, timestamp, row):
         self._ticks += 1
         if self._ticks % 60 != 0:
@@ -0,0 +1,123 @@
+"""Memoized talib indicators for backtests.
+
+Results are keyed by dataset fingerprint, indicator name, parameters and resample rule. They are
+kept in an in-process LRU and in an on-disk store next to the dataset (<csv>.cache/indicators/)
+that is trimmed to DISK_BYTES, least recently used first. The store is only scanned for that
+on the first write of the process and whenever the running size total goes over DISK_BYTES.
+"""
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import talib
+from .. import ohlc
+
+MEMORY_ENTRIES = 256
+DISK_BYTES = 512 * 1024 * 1024
+
+_memory = OrderedDict()
+# Bytes per disk store: scanned once per process, then this process' writes are added
+_store_bytes = {}
+# Lookups served from memory/disk and computed, per process (reported by backtest sweep)
+counts = {'memory':0, 'disk':0, 'computed':0}
+
+
+def _key(fingerprint: str, name: str, rule: str, params: tuple) -> str:
+    data = json.dumps([fingerprint, name, rule, list(params)])
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def _remember(key: str, values: np.ndarray) -> None:
+    _memory[key] = values
+    _memory.move_to_end(key)
+    while len(_memory) > MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+
+def _load(store: str, key: str) -> np.ndarray:
+    path = os.path.join(store, key + '.npy')
+    try:
+        values = np.load(path)
+        # mtime doubles as last-used time for eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return values
+
+def _save(store: str, key: str, values: np.ndarray) -> None:
+    os.makedirs(store, exist_ok=True)
+    path = os.path.join(store, key + '.npy')
+    tmp = '{}.tmp.{}.npy'.format(path, os.getpid())
+    np.save(tmp, values)
+    size = os.path.getsize(tmp)
+    os.replace(tmp, path)
+    total = _store_bytes.get(store)
+    if total is not None:
+        total += size
+    if total is None or total > DISK_BYTES:
+        # Rescan, this also picks up what other processes (sweep workers) wrote meanwhile. Trim
+        # to below the limit so a full store isn't scanned again on the next write.
+        total = evict(store, DISK_BYTES * 9 // 10)
+    _store_bytes[store] = total
+
+def evict(store: str, max_bytes: int = None) -> int:
+    """Remove least recently used entries until the store is at most max_bytes, return its size"""
+    if max_bytes is None:
+        max_bytes = DISK_BYTES
+    entries = []
+    for entry in os.scandir(store):
+        if entry.name.endswith('.npy') and '.tmp.' not in entry.name:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for (_, size, _) in entries)
+    for (_, size, path) in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    return total
+
+def indicator(name: str, close: pd.Series, rule: str, *params, csv_file: str = None):
+    """Return talib.<name>(close, *params), memoized when csv_file is a cacheable dataset.
+
+    close must be the resampled close of csv_file for rule. Multi-output indicators (e.g.
+    STOCHRSI) return a tuple of Series like talib does.
+    """
+    func = getattr(talib, name)
+    fingerprint = None
+    if csv_file and ohlc.is_cacheable(csv_file):
+        try:
+            fingerprint = ohlc.fingerprint(csv_file)
+        except OSError:
+            pass
+    if fingerprint is None:
+        return func(close, *params)
+    key = _key(fingerprint, name, rule, params)
+    store = os.path.join(ohlc.cache_dir(csv_file), 'indicators')
+    values = _memory.get(key)
+    if values is not None:
+        counts['memory'] += 1
+    else:
+        values = _load(store, key)
+        if values is not None:
+            counts['disk'] += 1
+    if values is None:
+        counts['computed'] += 1
+        result = func(close, *params)
+        outputs = result if isinstance(result, tuple) else (result,)
+        values = np.vstack([np.asarray(o, dtype=np.float64) for o in outputs])
+        try:
+            _save(store, key, values)
+        except OSError:
+            pass
+    # Shared between callers through the LRU
+    values.setflags(write=False)
+    _remember(key, values)
+    series = tuple(pd.Series(v, index=close.index) for v in values)
+    return series if len(series) > 1 else series[0]
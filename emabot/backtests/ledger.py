@@ -0,0 +1,108 @@
+"""Wallet arithmetic backends for backtests.
+
+decimal: Decimal math, the reference results.
+float:   float64 math, the fast path: trades are settled with NumPy arrays in the vectorized
+         engine.
+fixed:   integers scaled by 10**digits (2 digits, or 8 with --c2c), every value rounded to the
+         scale like an exchange account. Not a fast path: the wallet is rounded down after every
+         sell, so trades are settled one at a time in Python ints (wallet * price also overflows
+         int64 at 8 digits), about as fast as Decimal.
+
+sell() returns (fee, percent, profit, wallet) in report units (Decimal for decimal, float
+otherwise). Formatting happens at report time.
+"""
+from decimal import Decimal
+from fractions import Fraction
+import numpy as np
+from ..util import pdiff
+
+LEDGERS = ('decimal', 'float', 'fixed')
+
+
+class DecimalLedger:
+    vectorized = False
+
+    def __init__(self, wallet, fee):
+        self.wallet = Decimal(wallet)
+        self.fee = Decimal(fee)
+
+    def price(self, price):
+        return price if isinstance(price, Decimal) else Decimal(price)
+
+    def value(self, amount):
+        return amount
+
+    def sell(self, bought, price) -> tuple:
+        fee = self.wallet * self.fee
+        percent = pdiff(bought, price)
+        profit = self.wallet * ((percent/100)-self.fee)
+        self.wallet = self.wallet + profit
+        return (fee, percent, profit, self.wallet)
+
+
+class FloatLedger:
+    vectorized = True
+
+    def __init__(self, wallet, fee):
+        self.wallet = float(wallet)
+        self.fee = float(fee)
+
+    def price(self, price):
+        return float(price)
+
+    def value(self, amount):
+        return amount
+
+    def sell(self, bought, price) -> tuple:
+        fee = self.wallet * self.fee
+        percent = ((price - bought) / bought) * 100.0
+        factor = (percent / 100.0) - self.fee
+        profit = self.wallet * factor
+        self.wallet = self.wallet * (1.0 + factor)
+        return (fee, percent, profit, self.wallet)
+
+    def sell_many(self, bought: np.ndarray, price: np.ndarray) -> tuple:
+        """sell() for a whole sequence of trades, stopping after the wallet drops below 1"""
+        percent = ((price - bought) / bought) * 100.0
+        factor = (percent / 100.0) - self.fee
+        # Sequential products, same rounding as calling sell() in a loop
+        wallets = np.multiply.accumulate(np.concatenate([[self.wallet], 1.0 + factor]))
+        broke = np.flatnonzero(wallets[1:] < 1)
+        end = broke[0] + 1 if len(broke) else len(factor)
+        before = wallets[:end]
+        self.wallet = wallets[end]
+        return (before * self.fee, percent[:end], before * factor[:end], wallets[1:end + 1])
+
+
+class FixedLedger:
+    vectorized = False
+
+    def __init__(self, wallet, fee, digits: int = 2):
+        self.scale = 10 ** digits
+        self.wallet = self.price(wallet)
+        fee = Fraction(Decimal(fee))
+        self.fee_num = fee.numerator
+        self.fee_den = fee.denominator
+
+    def price(self, price) -> int:
+        return int(round(Decimal(price) * self.scale))
+
+    def value(self, amount: int) -> float:
+        return amount / self.scale
+
+    def sell(self, bought: int, price: int) -> tuple:
+        fee = self.wallet * self.fee_num // self.fee_den
+        percent = (price - bought) * 100 * self.scale // bought
+        profit = self.wallet * (price - bought) // bought - fee
+        self.wallet += profit
+        return (self.value(fee), self.value(percent), self.value(profit), self.value(self.wallet))
+
+
+def make_ledger(name: str, wallet, fee, c2c: bool = False):
+    if name == 'decimal':
+        return DecimalLedger(wallet, fee)
+    if name == 'float':
+        return FloatLedger(wallet, fee)
+    if name == 'fixed':
+        return FixedLedger(wallet, fee, digits=8 if c2c else 2)
+    raise ValueError('Unknown ledger: {} (choose from {})'.format(name, ', '.join(LEDGERS)))
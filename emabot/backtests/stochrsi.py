@@ -1,22 +1,37 @@
 from decimal import Decimal
-import talib
 import pandas as pd
 import pandas_ta as ta
 from ..util import huf
 from .base import BacktestBase
 
-class StochRsi(BacktestBase):
+class StochRsiBase(BacktestBase):
+    """STOCHRSI fastk/fastd columns and loops, the strategies only define entry() and exit()
+
+    entry() and exit() get floats from backtest() and arrays from signals(), so comparisons are
+    combined with & and | rather than and/or.
+    """
+    COLUMNS = ('timestamp', 'close')
+
     def init(self, *args, **kwargs):
-        self._df = self._df.drop(columns=['open','high','low','volume'])
-        idf = self._df.resample(kwargs['resample']).ohlc()
-        fastk, fastd = talib.STOCHRSI(idf['close']['close'])
-        self._df['fastk'] = fastk
-        self._df['fastd'] = fastd
-        self._df.fillna(method='ffill', inplace=True)
-        self._df.dropna(axis='rows', how='any', inplace=True)
+        super().init(*args, **kwargs)
         self._prev_fastk = 0.0
         self._prev_fastd = 0.0
 
+    def indicators(self, **kwargs):
+        fastk, fastd = self._indicator('STOCHRSI', kwargs['resample'])
+        return {'fastk':fastk, 'fastd':fastd}
+
+    def entry(self, fastk, fastd):
+        raise NotImplementedError
+
+    def exit(self, fastk, fastd):
+        raise NotImplementedError
+
+    def signals(self):
+        fastk = self._df['fastk'].values
+        fastd = self._df['fastd'].values
+        return self.entry(fastk, fastd), self.exit(fastk, fastd)
+
     def backtest(self, timestamp, row):
         close = row['close'].item()
         fastk = row['fastk'].item()
@@ -26,85 +41,35 @@ class StochRsi(BacktestBase):
             self._prev_fastk = fastk
             self._prev_fastd = fastd
         price = Decimal(close)
-        if not self.buys and fastk > 50 and fastd < fastk:
+        if not self.buys and self.entry(fastk, fastd):
             self.do_buy(price)
-        elif self.buys and fastk < 50 and fastd > fastk:
+        elif self.buys and self.exit(fastk, fastd):
             self.do_sell(price, 0)
 
-class StochRsi2(BacktestBase):
-    def init(self, *args, **kwargs):
-        self._df = self._df.drop(columns=['open','high','low','volume'])
-        idf = self._df.resample(kwargs['resample']).ohlc()
-        fastk, fastd = talib.STOCHRSI(idf['close']['close'])
-        self._df['fastk'] = fastk
-        self._df['fastd'] = fastd
-        self._df.fillna(method='ffill', inplace=True)
-        self._df.dropna(axis='rows', how='any', inplace=True)
-        self._prev_fastk = 0.0
-        self._prev_fastd = 0.0
+class StochRsi(StochRsiBase):
+    def entry(self, fastk, fastd):
+        return (fastk > 50) & (fastd < fastk)
 
-    def backtest(self, timestamp, row):
-        close = row['close'].item()
-        fastk = row['fastk'].item()
-        fastd = row['fastd'].item()
-        if self._prev_fastk != fastk or self._prev_fastd != fastd:
-            #print(timestamp, huf(fastk), huf(fastd), self.stats.wallet)
-            self._prev_fastk = fastk
-            self._prev_fastd = fastd
-        price = Decimal(close)
-        if not self.buys and fastk > 50:
-            self.do_buy(price)
-        elif self.buys and fastk < 50:
-            self.do_sell(price, 0)
+    def exit(self, fastk, fastd):
+        return (fastk < 50) & (fastd > fastk)
 
-class StochRsi3(BacktestBase):
-    def init(self, *args, **kwargs):
-        self._df = self._df.drop(columns=['open','high','low','volume'])
-        idf = self._df.resample(kwargs['resample']).ohlc()
-        fastk, fastd = talib.STOCHRSI(idf['close']['close'])
-        self._df['fastk'] = fastk
-        self._df['fastd'] = fastd
-        self._df.fillna(method='ffill', inplace=True)
-        self._df.dropna(axis='rows', how='any', inplace=True)
-        self._prev_fastk = 0.0
-        self._prev_fastd = 0.0
+class StochRsi2(StochRsiBase):
+    def entry(self, fastk, fastd):
+        return fastk > 50
 
-    def backtest(self, timestamp, row):
-        close = row['close'].item()
-        fastk = row['fastk'].item()
-        fastd = row['fastd'].item()
-        if self._prev_fastk != fastk or self._prev_fastd != fastd:
-            #print(timestamp, huf(fastk), huf(fastd), self.stats.wallet)
-            self._prev_fastk = fastk
-            self._prev_fastd = fastd
-        price = Decimal(close)
-        if not self.buys and fastd > 50:
-            self.do_buy(price)
-        elif self.buys and fastd <  50:
-            self.do_sell(price, 0)
+    def exit(self, fastk, fastd):
+        return fastk < 50
 
-class StochRsi4(BacktestBase):
-    def init(self, *args, **kwargs):
-        self._df = self._df.drop(columns=['open','high','low','volume'])
-        idf = self._df.resample(kwargs['resample']).ohlc()
-        fastk, fastd = talib.STOCHRSI(idf['close']['close'])
-        self._df['fastk'] = fastk
-        self._df['fastd'] = fastd
-        self._df.fillna(method='ffill', inplace=True)
-        self._df.dropna(axis='rows', how='any', inplace=True)
-        self._prev_fastk = 0.0
-        self._prev_fastd = 0.0
+class StochRsi3(StochRsiBase):
+    def entry(self, fastk, fastd):
+        return fastd > 50
 
-    def backtest(self, timestamp, row):
-        close = row['close'].item()
-        fastk = row['fastk'].item()
-        fastd = row['fastd'].item()
-        if self._prev_fastk != fastk or self._prev_fastd != fastd:
-            #print(timestamp, huf(fastk), huf(fastd), self.stats.wallet)
-            self._prev_fastk = fastk
-            self._prev_fastd = fastd
-        price = Decimal(close)
-        if not self.buys and fastk > 70 and fastd < fastk:
-            self.do_buy(price)
-        elif self.buys and fastk < 70 and fastd > fastk:
-            self.do_sell(price, 0)
+    def exit(self, fastk, fastd):
+        return fastd < 50
+
+class StochRsi4(StochRsiBase):
+    def entry(self, fastk, fastd):
+        return (fastk > 70) & (fastd < fastk)
+
+    def exit(self, fastk, fastd):
+        return (fastk < 70) & (fastd > fastk)
@@ -1,19 +1,23 @@
 from decimal import Decimal
-import talib
 import pandas as pd
 import pandas_ta as ta
 from .base import BacktestBase
 
 class Trima(BacktestBase):
-    def init(self, *args, **kwargs):
-        self._df = self._df.drop(columns=['open','high','low','volume'])
-        idf = self._df.resample(kwargs['resample']).ohlc()
+    COLUMNS = ('timestamp', 'close')
+
+    def indicators(self, **kwargs):
         #self._df['emaA'] = ta.ema(idf['close']['close'], length=kwargs['emaA'])
         #self._df['emaB'] = ta.ema(idf['close']['close'], length=kwargs['emaB'])
-        self._df['emaA'] = talib.TRIMA(idf['close']['close'], kwargs['emaA'])
-        self._df['emaB'] = talib.TRIMA(idf['close']['close'], kwargs['emaB'])
-        self._df.fillna(method='ffill', inplace=True)
-        self._df.dropna(axis='rows', how='any', inplace=True)
+        return {
+            'emaA':self._indicator('TRIMA', kwargs['resample'], kwargs['emaA']),
+            'emaB':self._indicator('TRIMA', kwargs['resample'], kwargs['emaB']),
+        }
+
+    def signals(self):
+        emaA = self._df['emaA'].values
+        emaB = self._df['emaB'].values
+        return emaA > emaB, emaB > emaA
 
     def backtest(self, timestamp, row):
         close = row['close'].item()
@@ -11,32 +11,39 @@ import argparse
 from datetime import datetime
 from decimal import Decimal
 import logging
-import smtplib
-import yaml
-import cbpro
-import numpy as np
-import talib
-import pandas as pd
-import pandas_ta as ta
-from .history import generate_historical_csv
-
-pd.set_option('display.max_rows', None)
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from .util import load_config, TtlCache
+from .orders import SettlementWatcher, SettlementTimeout
+from .exchange import Exchange, HistoryError
+from . import monitorlog
+from .journal import Journal
+
+# pandas, talib, the history and decider modules (and cbpro, see exchange.py) are imported by the
+# code that needs them: --monitor runs every 30 minutes and only reads the ticker (importtime.py)
+if TYPE_CHECKING:
+    import pandas as pd
+
 os.environ['TZ'] = 'UTC'
 time.tzset()
-TODAY = str(datetime.now()).split(' ')[0]
-
-warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 logger = logging.getLogger('emabot')
 
+# Seconds the ticker (per pair) and fees (per API key) are shared by the bots of a process
+API_TTL = 5
+API_CACHE = TtlCache(API_TTL)
+
 
 class TradingDisabledError(Exception):
     """Trading is disabled for currency"""
 
-def _api_response_check(response: dict, exception_to_raise: Exception) -> None:
-    """Check the coinbase API response for 'message' (an error)"""
-    if 'message' in response:
-        raise exception_to_raise(response['message'])
+def _settled(buy: dict) -> bool:
+    """The buy settled and no sell is pending (a dryrun doesn't resume orders)"""
+    return bool(buy['settled']) and 'sell_response' not in buy
+
+def today() -> str:
+    """YYYY-MM-DD, per call since a daemon outlives the day (and the year)"""
+    return str(datetime.now()).split(' ')[0]
 
 def truncate(x, n: int) -> str:
     """Truncate to N decimals, return as string"""
@@ -66,6 +73,68 @@ def pchange_f(x1, x2) -> float:
     x2 = float(x2)
     return truncate_f(((x2 - x1) / x1) * 100., 1)
 
+def load_pandas():
+    """pandas, set up for the deciders on first use"""
+    import pandas as pd
+    pd.set_option('display.max_rows', None)
+    warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+    return pd
+
+def decider_frame(csv_path: str, cur_price: float = None) -> 'pd.DataFrame':
+    """Timestamp indexed close prices of a history file, optionally with the current price"""
+    from . import ohlc
+    pd = load_pandas()
+    # Only timestamp and close are used, don't load the other columns
+    df = ohlc.read_csv(csv_path, usecols=['timestamp', 'close'])
+    if cur_price:
+        # Add the current price to the tail end for a more accurate calculation
+        # timestamp       close
+        df.loc[len(df.index)] = [
+            int(time.time()),
+            float(cur_price),
+        ]
+    df.timestamp = pd.to_datetime(df.timestamp, unit='s')
+    return df.set_index("timestamp")
+
+def decider_bins(csv_path: str, resample: str, cur_price: float = None,
+        frame: 'pd.DataFrame' = None) -> tuple:
+    """Resampled closes and the last close used by backtest_decider()
+
+    A frame from decider_frame() can be passed in to resample one history several ways.
+    """
+    from . import ohlc
+    load_pandas()
+    if cur_price or not ohlc.is_cacheable(csv_path):
+        if frame is None:
+            frame = decider_frame(csv_path, cur_price)
+        # Resample needs to be done for further stabalization of EMA, otherwise it will vary per run
+        bins = frame.resample(resample).ohlc()['close']['close']
+        close = frame['close'].tail(1).item()
+    else:
+        # Same bins as above, served from the history cache's resample pyramid
+        bins = ohlc.resample_close(csv_path, resample)
+        close = ohlc.read_columns(csv_path)['close'][-1].item()
+    return (bins, close)
+
+def ema_decision(emaA: 'pd.Series', emaB: 'pd.Series', close: float,
+        debug: bool = False) -> dict:
+    """Decision from the EMAs of the resampled closes"""
+    from .decider import cross_decision
+    # don't need this anymore since EMA calc was moved outside of storing within df
+    #df.fillna(method='ffill', inplace=True)
+    #df.dropna(axis='rows', how='any', inplace=True)
+    # Decision time
+    # Take the 2nd to last item (assuming cronjob is scheduled properly)
+    if debug:
+        print(emaA.tail(20))
+        print(emaB.tail(20))
+    prev_emaA = emaA.tail(3).head(1).item()
+    prev_emaB = emaB.tail(3).head(1).item()
+    emaA = emaA.tail(2).head(1).item()
+    emaB = emaB.tail(2).head(1).item()
+    last_decision = cross_decision(prev_emaA, prev_emaB, emaA, emaB)
+    return {'emaA':emaA, 'emaB':emaB, 'decision':last_decision, 'close':close}
+
 def backtest_decider(
         emaA: int = 2,
         emaB: int = 3,
@@ -74,63 +143,24 @@ def backtest_decider(
         csv_path: str = None,
         debug: bool = False) -> str:
     """Main buy/sell logic
-        1) Read CSV OHLC file
+        1) Read CSV OHLC file (only the timestamp and close columns)
         2) Convert timestamp to datetime index column
-        3) Drop all columns except timestamp and close
+        3) Drop all columns except timestamp and close (not loaded in the first place)
         4) Resample OHLC
         5) Calculate EMAs
         6) Fill NaNs (pandas ffill)
         7) Drop NaN rows as a mistake guard
         8) Compare the last dataframe's EMAs to make decision
     """
-    df = pd.read_csv(csv_path)
-    if cur_price:
-        # Add the current price to the tail end for a more accurate calculation
-        # timestamp       low      high      open     close    volume
-        df.loc[len(df.index)] = [
-            int(time.time()),
-            float(cur_price),
-            float(cur_price),
-            float(cur_price),
-            float(cur_price), 2.0
-        ]
-    df.timestamp = pd.to_datetime(df.timestamp, unit='s')
-    df = df.set_index("timestamp")
-    df = df.drop(columns=['open','high','low','volume'])
-    # Resample needs to be done for further stabalization of EMA, otherwise it will vary per run
-    idf = df.resample(resample).ohlc()
+    import talib
+    (bins, close) = decider_bins(csv_path, resample, cur_price=cur_price)
     # explicitly use talib because pandas_ta sometimes doesn't work right and provides an
     # unstable EMA (as far as testing could tell)
     # It is important to note that this can differ from backtests since those are calculated in
     # one call for the entire dataset. It is even more _important_ to note that 'resample' needs
     # to match the timing of the cronjob. Example: 1D should run once per day at 00, or 12h should
     # run twice per day at 00 and 12
-    emaA = talib.EMA(idf['close']['close'], emaA)
-    emaB = talib.EMA(idf['close']['close'], emaB)
-    # don't need this anymore since EMA calc was moved outside of storing within df
-    #df.fillna(method='ffill', inplace=True)
-    #df.dropna(axis='rows', how='any', inplace=True)
-    # Decision time
-    last_decision = 'noop'
-    close = df['close'].tail(1).item()
-    # Take the 2nd to last item (assuming cronjob is scheduled properly)
-    if debug:
-        print(emaA.tail(20))
-        print(emaB.tail(20))
-    prev_emaA = emaA.tail(3).head(1).item()
-    prev_emaB = emaB.tail(3).head(1).item()
-    emaA = emaA.tail(2).head(1).item()
-    emaB = emaB.tail(2).head(1).item()
-    if emaA > emaB:
-        # This gaurds against buying not on the cross-over.
-        # If you buy after the cross-over, it could be towards the end or anywhere in between,
-        # causing issues with the actual transaction, making it invalid (likely a loss)
-        # Make sure the previous comparison is not the same as the current.
-        if prev_emaA < prev_emaB:
-            last_decision = 'buy'
-    elif emaB > emaA:
-        last_decision = 'sell'
-    return {'emaA':emaA, 'emaB':emaB, 'decision':last_decision, 'close':close}
+    return ema_decision(talib.EMA(bins, emaA), talib.EMA(bins, emaB), close, debug=debug)
 
 class EmaBot:
     """Main code for running the bot"""
@@ -139,7 +169,8 @@ class EmaBot:
             dryrun: bool = False,
             force_sell: bool = False,
             monitor: bool = False,
-            debug: bool = False):
+            debug: bool = False,
+            exchange: Exchange = None):
         self.config_path = config_path
         self.debug = debug
         self.force_sell = force_sell
@@ -156,8 +187,16 @@ class EmaBot:
         self.log_dir = None
         self.hist_file = None
         self.buy_path = None
+        self.journal = None
+        self.notifier = None
+        self._log_fd = None
+        self.auth_client = None
+        # Rate limits, retries and the connection pool, shared by the bots of a fleet
+        self.exchange = exchange if exchange is not None else Exchange()
+        # Shared by the bots of a fleet, created on the first order otherwise
+        self.watcher = None
         self.decision = {'emaA':0.0, 'emaB':0.0, 'decision':'noop'}
-        if self.debug:
+        if self.debug and not logger.handlers:
             logger.setLevel(logging.DEBUG)
             console_handler = logging.StreamHandler()
             console_handler.setLevel(logging.DEBUG)
@@ -169,12 +208,7 @@ class EmaBot:
 
     def configure(self) -> None:
         """Configure from yaml file"""
-        with open(self.config_path) as config_stream:
-            tmp = list(yaml.safe_load_all(config_stream))
-        config = {}
-        for i in tmp:
-            for k,v in i.items():
-                config[k] = v
+        config = load_config(self.config_path)
         missing = []
         if not 'general' in config:
             raise Exception('Missing config section "general"')
@@ -199,6 +233,8 @@ class EmaBot:
         self.log_dir = re.sub(r'/$', '', self.config['general']['log_dir'])
         self.hist_file = self.config['general']['hist_file']
         self.buy_path = self.data_dir+'/'+self.name+'-buy.pickle'
+        self.decider_path = '{}/{}-{}-{}-{}.decider'.format(
+            self.data_dir, self.pair, self.resample, self.ema_a, self.ema_b)
         self.monitor_alert_change = self.config['general']['monitor_alert_change']
         self.email_enabled = self.config['general']['send_email']
         self.mail_host = None
@@ -208,45 +244,43 @@ class EmaBot:
             self.mail_host = self.config['email']['mail_host']
             self.mail_to = self.config['email']['mail_to'].split(',')
             self.mail_from = self.config['email']['mail_from']
+        # Typed events for stats, the text log is for people
+        self.journal = Journal('{}/{}-events.jsonl'.format(self.log_dir, self.name),
+            name=self.name, pair=self.pair, dryrun=self.dryrun)
 
     def logit(self, msg) -> None:
         """Logger with some customizations.
         TODO: Maybe convert to logging module"""
-        path = '{}/{}-{}.log'.format(self.log_dir, self.name, TODAY.split('-')[0])
+        path = '{}/{}-{}.log'.format(self.log_dir, self.name, today().split('-')[0])
         msg = '{} {}'.format(datetime.now(), msg.strip())
         if self.dryrun:
             msg = 'dryrun '+msg
         if not msg.startswith(self.pair):
             msg = '{} {}'.format(self.pair, msg)
         print(msg)
-        with open(path, 'a') as fd:
-            fd.write('{}\n'.format(msg))
+        if self._log_fd is None or self._log_fd.name != path:
+            # Kept open (line buffered) instead of reopened for every message
+            if self._log_fd is not None:
+                self._log_fd.close()
+            self._log_fd = open(path, 'a', buffering=1)
+        self._log_fd.write('{}\n'.format(msg))
 
-    def send_email(self, subject: str, msg: str) -> None:
-        """Send an email
+    def send_email(self, subject: str, msg: str, digest: str = None) -> None:
+        """Queue an email, delivered in the background (see notify.py)
         TODO: Add auth, currently setup to relay locally or relay-by-IP"""
-        for email in self.mail_to:
-            if not email.strip():
-                continue
-            headers = "From: %s\r\nTo: %s\r\nSubject: %s %s\r\n\r\n" % (
-                self.mail_from, email, self.pair, subject)
-            if not msg:
-                msg2 = subject
-            else:
-                msg2 = msg
-            msg2 = headers + msg2
-            server = smtplib.SMTP(self.mail_host)
-            server.sendmail(self.mail_from, email, msg2)
-            server.quit()
+        if self.notifier is None:
+            # smtplib and the delivery thread only when there is something to send
+            from .notify import default_notifier
+            self.notifier = default_notifier()
+        self.notifier.send(self.mail_host, self.mail_from, self.mail_to,
+            '{} {}'.format(self.pair, subject), msg, digest=digest)
 
     def cb_auth(self) -> None:
         """Authenticate to coinbase api"""
-        self.auth_client = cbpro.AuthenticatedClient(
-            self.key, self.b64secret, self.passphrase)
+        self.auth_client = self.exchange.auth_client(self.key, self.b64secret, self.passphrase)
 
     def get_wallet(self) -> Decimal:
-        accounts = self.auth_client.get_accounts()
-        _api_response_check(accounts, Exception)
+        accounts = self.exchange.call('accounts', self.auth_client.get_accounts, private=True)
         for account in accounts:
             if account['currency'] == self.currency:
                 wallet = Decimal(account['available'])
@@ -257,9 +291,12 @@ class EmaBot:
         return wallet
 
     def get_fees(self) -> tuple:
-        """Get the current account fees for maker/taker"""
-        fees = self.auth_client._send_message('get', '/fees')
-        _api_response_check(fees, Exception)
+        """Get the current account fees for maker/taker (cached for API_TTL seconds)"""
+        return API_CACHE.get(('fees', self.key), self._get_fees)
+
+    def _get_fees(self) -> tuple:
+        fees = self.exchange.call('fees', self.auth_client._send_message, 'get', '/fees',
+            private=True)
         maker_fee = Decimal('0.0')
         taker_fee = Decimal('0.0')
         usd_volume = Decimal('0.0')
@@ -272,50 +309,84 @@ class EmaBot:
         return (maker_fee, taker_fee, usd_volume)
 
     def get_price(self) -> Decimal:
-        """Get current pair price"""
-        ticker = self.auth_client.get_product_ticker(product_id=self.pair)
-        _api_response_check(ticker, Exception)
+        """Get current pair price (cached for API_TTL seconds)"""
+        return API_CACHE.get(('ticker', self.pair), self._get_price)
+
+    def _get_price(self) -> Decimal:
+        # Public endpoint, read without an authenticated client (--monitor doesn't build one)
+        ticker = self.exchange.get('ticker', '/products/{}/ticker'.format(self.pair))
         price = Decimal(ticker['price'])
         return price
 
     def get_order(self, order_id: str) -> dict:
         """Get an order by id"""
-        order = self.auth_client.get_order(order_id)
-        _api_response_check(order, Exception)
+        order = self.exchange.call('order', self.auth_client.get_order, order_id, private=True)
         return order
 
+    def wait_settled(self, order_id: str) -> dict:
+        """Block until the order settles (polled by the settlement watcher)"""
+        if self.watcher is None:
+            self.watcher = SettlementWatcher()
+        try:
+            return self.watcher.watch(order_id, self.get_order).result()
+        except SettlementTimeout as err:
+            self.logit('settlement_timeout={}'.format(err))
+            self.journal.record('settlement_timeout', sync=True, order_id=order_id, error=str(err))
+            if self.email_enabled:
+                self.send_email('SETTLEMENT-TIMEOUT: order={}'.format(order_id), str(err))
+            raise
+
     def buy_market(self, funds: float) -> dict:
         funds = truncate(funds, 2) #str(round(Decimal(funds), 2))
-        response = self.auth_client.place_market_order(
+        response = self.exchange.call('place_order', self.auth_client.place_market_order,
             product_id=self.pair,
             side='buy',
             funds=funds,
+            private=True,
+            idempotent=False,
         )
-        _api_response_check(response, Exception)
         return response
 
     def sell_market(self, size: float) -> dict:
         # TODO: Get precisions from api for the self.pair
         fixed_size = truncate(size, 8) #str(round(Decimal(size), 8))
-        response = self.auth_client.place_market_order(
+        response = self.exchange.call('place_order', self.auth_client.place_market_order,
             product_id=self.pair,
             side='sell',
             size=fixed_size,
+            private=True,
+            idempotent=False,
         )
-        _api_response_check(response, Exception)
         return response
 
-    def _run_setup(self):
-        generate_historical_csv(self.hist_file, pair=self.pair, days_ago=522)
-        wallet = self.get_wallet()
-        fees = self.get_fees()
-        price = self.get_price()
+    def _run_setup(self, history: bool = True, decide: bool = False):
+        """Wallet, fees and price are read concurrently, while the history is downloaded and
+        (decide=True) the decider runs"""
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            wallet = pool.submit(self.get_wallet)
+            fees = pool.submit(self.get_fees)
+            price = pool.submit(self.get_price)
+            if history:
+                from .history import generate_historical_csv
+                generate_historical_csv(self.hist_file, pair=self.pair, days_ago=522,
+                    exchange=self.exchange)
+            if decide:
+                self.decide()
+            (wallet, fees, price) = (wallet.result(), fees.result(), price.result())
         buy = None
         pc = None
+        if os.path.exists(self.buy_path+'.tmp') and not os.path.exists(self.buy_path):
+            # An unsettled buy saved by an older version (or a run killed while saving)
+            os.rename(self.buy_path+'.tmp', self.buy_path)
         if os.path.exists(self.buy_path):
             with open(self.buy_path, 'rb') as fd:
                 buy = pickle.load(fd)
-                pc = pchange(buy['real_price'], price)
+            if not self.dryrun and not _settled(buy):
+                buy = self._resume(buy)
+                # The order changed the balance read above
+                wallet = self.get_wallet()
+        if buy:
+            pc = pchange(buy['real_price'], price)
         self.logit('>\n  bought_at={}\n  wallet={}\n  current_fees={}\n  price={}\n  percent_change={}'.format(
             buy['real_price'] if buy and 'real_price' in buy else "-",
             wallet, [str(i) for i in fees], price, pc))
@@ -324,33 +395,52 @@ class EmaBot:
     def _run_buy(self, price, wallet) -> None:
         self.logit('action=buy price={}'.format(price))
         if self.dryrun:
-            sys.exit(0)
+            return
         response = self.buy_market(wallet)
         self.logit('buy_response={}'.format(response))
+        self.journal.record('order', sync=True, side='buy', order_id=response['id'], price=price,
+            funds=wallet)
+        info = {
+            'wallet':wallet,
+            'date':today(),
+            'real_price':price,
+            'response':response,
+            'settled':False,
+            'buy_epoch':time.time()
+        }
+        # Saved before waiting, if the order doesn't settle in time the next run resumes it
+        self._save_buy(info)
+        self._bought(info, self.wait_settled(response['id']))
+
+    def _bought(self, info: dict, order: dict) -> None:
+        info['settled'] = order
+        self.logit('buy_settled={}'.format(order))
+        self._record_settled('buy', order)
+        self._save_buy(info)
+        if self.email_enabled:
+            self.send_email('BOUGHT: price={} decision={}'.format(
+                info['real_price'], self.decision), '')
+
+    def _save_buy(self, info: dict) -> None:
         with open(self.buy_path+'.tmp', 'wb') as fd:
-            info = {
-                'wallet':wallet,
-                'date':TODAY,
-                'real_price':price,
-                'response':response,
-                'settled':False,
-                'buy_epoch':time.time()
-            }
             pickle.dump(info, fd)
-        while 1:
-            time.sleep(5)
-            order = self.get_order(response['id'])
-            settled = order['settled']
-            status = order['status']
-            if settled:
-                info['settled'] = order
-                self.logit('buy_settled={}'.format(order))
-                with open(self.buy_path+'.tmp', 'wb') as fd:
-                    pickle.dump(info, fd)
-                os.rename(self.buy_path+'.tmp', self.buy_path)
-                if self.email_enabled:
-                    self.send_email('BOUGHT: price={} decision={}'.format(price, self.decision), '')
-                break
+        os.rename(self.buy_path+'.tmp', self.buy_path)
+
+    def _resume(self, buy: dict) -> dict:
+        """Wait for the order a previous run placed but didn't see settle (SettlementTimeout
+        again leaves it to the next run), return the position or None once it is sold"""
+        if 'sell_response' in buy:
+            self.logit('resume: sell order={}'.format(buy['sell_response']['id']))
+            self._sold(buy, self.wait_settled(buy['sell_response']['id']))
+            return None
+        self.logit('resume: buy order={}'.format(buy['response']['id']))
+        self._bought(buy, self.wait_settled(buy['response']['id']))
+        return buy
+
+    def _record_settled(self, side: str, order: dict) -> None:
+        self.journal.record('settled', sync=True, side=side, order_id=order['id'],
+            filled_size=order.get('filled_size'), executed_value=order.get('executed_value'),
+            fill_fees=order.get('fill_fees'), status=order.get('status'))
 
     def _run_sell(self, buy, price):
         size = buy['settled']['filled_size']
@@ -361,59 +451,94 @@ class EmaBot:
             print('if_sold_now: {} -> {} {:.2f} {:.2f}% change'.format(
                 buy['real_price'], price, u_after - u_before, pchange_f(buy['real_price'], price)
             ))
-            sys.exit(0)
+            return
         response = self.sell_market(size)
         self.logit('sell_response={}'.format(response))
-        while 1:
-            time.sleep(5)
-            order = self.get_order(response['id'])
-            settled = order['settled']
-            status = order['status']
-            if settled:
-                self.logit('sell_settled={}'.format(order))
-                os.rename(self.buy_path, self.buy_path+'.prev')
-                profit = Decimal(order['executed_value']) - Decimal(buy['settled']['executed_value'])
-                self.logit('profit: buy_price={} -> sold_price={} profit={:.2f} ({:.2f}%)'.format(
-                    buy['real_price'], price, profit, pchange(buy['real_price'], price)
-                ))
-                if self.email_enabled:
-                    self.send_email('SOLD: price={} profit={} decision={}'.format(
-                        price, profit, self.decision), '')
-                    monitor_path = self.buy_path+'.monitor'
-                    os.rename(monitor_path, monitor_path+'.prev')
-                break
+        self.journal.record('order', sync=True, side='sell', order_id=response['id'], price=price,
+            size=size)
+        # Saved before waiting, if the order doesn't settle in time the next run resumes it
+        buy['sell_response'] = response
+        buy['sell_price'] = price
+        self._save_buy(buy)
+        self._sold(buy, self.wait_settled(response['id']))
+
+    def _sold(self, buy: dict, order: dict) -> None:
+        price = buy['sell_price']
+        self.logit('sell_settled={}'.format(order))
+        self._record_settled('sell', order)
+        os.rename(self.buy_path, self.buy_path+'.prev')
+        profit = Decimal(order['executed_value']) - Decimal(buy['settled']['executed_value'])
+        self.logit('profit: buy_price={} -> sold_price={} profit={:.2f} ({:.2f}%)'.format(
+            buy['real_price'], price, profit, pchange(buy['real_price'], price)
+        ))
+        self.journal.record('profit', sync=True, buy_price=buy['real_price'], sell_price=price,
+            profit=profit, percent_change=pchange(buy['real_price'], price))
+        if self.email_enabled:
+            self.send_email('SOLD: price={} profit={} decision={}'.format(
+                price, profit, self.decision), '')
+            monitor_path = self.buy_path+'.monitor'
+            os.rename(monitor_path, monitor_path+'.prev')
 
 
     def run(self) -> None:
-        self.cb_auth()
         if self.monitor:
             return self._monitor()
-        wallet, fees, price, buy = self._run_setup()
-
-        ###################################################################
-        # buy/sell phase is here
-        ###################################################################
-        self.decision = backtest_decider(
-            emaA=self.ema_a,
-            emaB=self.ema_b,
-            csv_path=self.hist_file,
-            resample=self.resample,
-            debug=self.debug,
-            # this should not matter unless a not so sane resmaple size is used
-            #cur_price=price
-        )
+        self.cb_auth()
+        wallet, fees, price, buy = self._run_setup(decide=True)
+        self.trade(wallet, price, buy)
+        logger.debug('api latency:\n%s', self.exchange.report())
+
+    def decide(self) -> dict:
+        """Run the decider on the history file"""
+        from . import ohlc
+        load_pandas()
+        if ohlc.is_cacheable(self.hist_file):
+            # Only folds in the bins that closed since the last run
+            from .decider import IncrementalDecider
+            self.decision = IncrementalDecider(
+                self.hist_file, self.decider_path, self.ema_a, self.ema_b, self.resample,
+            ).decide(debug=self.debug)
+        else:
+            self.decision = backtest_decider(
+                emaA=self.ema_a,
+                emaB=self.ema_b,
+                csv_path=self.hist_file,
+                resample=self.resample,
+                debug=self.debug,
+                # this should not matter unless a not so sane resmaple size is used
+                #cur_price=price
+            )
+        return self.decision
+
+    def trade(self, wallet, price, buy) -> None:
+        """Buy/sell phase, acting on self.decision"""
         self.logit('backtest_decider={}'.format(self.decision))
         logger.debug('decider=%s price=%s', self.decision, price)
         if not buy and self.decision['decision'] == 'buy':
+            action = 'buy'
+        elif buy and _settled(buy) and (self.decision['decision'] == 'sell' or self.force_sell):
+            action = 'sell'
+        else:
+            action = 'noop'
+        self.journal.record('decision', emaA=self.decision['emaA'], emaB=self.decision['emaB'],
+            decision=self.decision['decision'], close=self.decision.get('close'), price=price,
+            action=action)
+        try:
+            self._trade(action, wallet, price, buy)
+        finally:
+            self.journal.flush()
+
+    def _trade(self, action, wallet, price, buy) -> None:
+        if action == 'buy':
             self._run_buy(price, wallet)
         # SELL logic
-        elif buy and (self.decision['decision'] == 'sell' or self.force_sell):
+        elif action == 'sell':
             if self.force_sell:
                 self.logit('WARNING: Selling because force_sell=True')
             self._run_sell(buy, price)
         else:
             self.logit('action=NOOP')
-            if buy and self.dryrun:
+            if buy and _settled(buy) and self.dryrun:
                 u_before = float(buy['real_price']) * float(buy['settled']['filled_size'])
                 u_after = float(price) * float(buy['settled']['filled_size'])
                 print('if_sold_now: {} -> {} {:.2f} {:.2f}% change'.format(
@@ -428,10 +553,8 @@ class EmaBot:
         if not os.path.exists(self.buy_path):
             return
         monitor_path = self.buy_path+'.monitor'
-        monitor_history = []
-        if os.path.exists(monitor_path):
-            with open(monitor_path, 'rb') as fd:
-                monitor_history = pickle.load(fd)
+        # Count and running max of the previous ticks, without reading them
+        monitor_stats = monitorlog.read_header(monitor_path)
         price = self.get_price()
         with open(self.buy_path, 'rb') as fd:
             buy = pickle.load(fd)
@@ -440,19 +563,17 @@ class EmaBot:
         if self.debug:
             logger.debug('MONITOR: duration=%sh percent_change=%s%%  previous=',
                 duration_hours, pc)
-            for m in monitor_history[::-1]:
+            for (_, m) in monitorlog.read(monitor_path, last=48)[::-1]:
                 logger.debug('    %.2f%%', m)
-        if len(monitor_history) > 1:
-            mmax = max(monitor_history)
-            mmin = min(monitor_history)
+        if monitor_stats['count'] > 1:
+            mmax = monitor_stats['max']
             diff = pc - mmax
             if diff <= self.monitor_alert_change:
                 if self.email_enabled:
-                    self.send_email('MONITOR-WARNING: diff={:.2f}'.format(diff), '')
+                    self.send_email('MONITOR-WARNING: diff={:.2f}'.format(diff), '',
+                        digest='MONITOR-WARNING')
             logger.debug('MONITOR: diff=%s', diff)
-        monitor_history.append(pc)
-        with open(monitor_path, 'wb') as fd:
-            pickle.dump(monitor_history, fd)
+        monitorlog.append(monitor_path, int(time.time()), pc)
 
 def main() -> None:
     parser = argparse.ArgumentParser()
@@ -460,16 +581,61 @@ def main() -> None:
     parser.add_argument('--debug', help='Debug output', action='store_true')
     parser.add_argument('--force-sell', help='Force sell of holdings tracked in the buy cache',
             dest='force_sell', action='store_true')
-    parser.add_argument('--config', help='Config file path', dest='config_path', required=True)
+    configs = parser.add_mutually_exclusive_group(required=True)
+    configs.add_argument('--config', help='Config file path', dest='config_path')
+    configs.add_argument('--configs',
+        help='Run every *.yml config in this directory in one process', dest='config_dir')
     parser.add_argument('--monitor', help='Monitor buy state/percent change', action='store_true')
+    parser.add_argument('--jobs',
+        help='Portfolios handled at the same time with --configs (default:8)', dest='jobs',
+        default=8, type=int)
+    parser.add_argument('--daemon',
+        help='Keep running and decide right after each resample bin closes (no cronjob)',
+        action='store_true')
+    parser.add_argument('--settle',
+        help='Seconds to wait after a bin closes with --daemon (default:120)', dest='settle',
+        default=120, type=float)
     args = parser.parse_args()
+    if args.daemon and args.monitor:
+        parser.error('--daemon does not support --monitor')
+    if args.daemon:
+        from .fleet import Fleet, FleetError
+        from .daemon import Daemon
+        try:
+            fleet = Fleet(
+                args.config_dir or args.config_path,
+                dryrun=args.dryrun,
+                debug=args.debug,
+                force_sell=args.force_sell,
+                jobs=args.jobs)
+            Daemon(fleet, settle=args.settle).run()
+        except FleetError as err:
+            sys.exit(str(err))
+        return
+    if args.config_dir:
+        from .fleet import Fleet, FleetError
+        fleet = Fleet(
+            args.config_dir,
+            dryrun=args.dryrun,
+            debug=args.debug,
+            monitor=args.monitor,
+            force_sell=args.force_sell,
+            jobs=args.jobs)
+        try:
+            fleet.run()
+        except FleetError as err:
+            sys.exit(str(err))
+        return
     ema_bot = EmaBot(
         args.config_path,
         dryrun=args.dryrun,
         debug=args.debug,
         monitor=args.monitor,
         force_sell=args.force_sell)
-    ema_bot.run()
+    try:
+        ema_bot.run()
+    except HistoryError as err:
+        sys.exit('API_ERROR: {}'.format(err))
 
 if __name__ == '__main__':
     main()
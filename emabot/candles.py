@@ -0,0 +1,205 @@
+"""Fixed-width binary candle store (*.candles), an alternative to the quoted history CSV.
+
+Layout: a HEADER_DTYPE header followed by CANDLE_DTYPE records (int64 timestamp, float64
+low/high/open/close/volume, the CSV's column order). There is one record per interval from the
+header's start, minutes without a candle are NaN records, so the record of a timestamp is found
+by offset arithmetic and readers np.memmap the file without parsing or copying.
+
+Convert existing history: python -m emabot.candles csv/btc-history-1m-ohlc.csv.gz csv/btc.candles
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+SUFFIX = '.candles'
+MAGIC = b'EMACNDL1'
+VERSION = 1
+INTERVAL = 60
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'), ('version', '<i8'), ('start', '<i8'), ('interval', '<i8'),
+    ('reserved', '<i8', (4,))])
+CANDLE_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('low', '<f8'), ('high', '<f8'), ('open', '<f8'), ('close', '<f8'),
+    ('volume', '<f8')])
+COLUMNS = CANDLE_DTYPE.names
+
+
+def is_candle_file(path: str) -> bool:
+    return path.endswith(SUFFIX)
+
+def read_header(path: str) -> np.void:
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) != 1 or header[0]['magic'] != MAGIC or header[0]['version'] != VERSION:
+        raise ValueError('{} is not a candle store'.format(path))
+    return header[0]
+
+def count(path: str) -> int:
+    """Number of complete records"""
+    return (os.path.getsize(path) - HEADER_DTYPE.itemsize) // CANDLE_DTYPE.itemsize
+
+def read(path: str, rows: int = None) -> np.ndarray:
+    """Read-only memmap of the records (the first rows records when given)"""
+    read_header(path)
+    if rows is None:
+        rows = count(path)
+    if rows == 0:
+        return np.empty(0, dtype=CANDLE_DTYPE)
+    return np.memmap(path, dtype=CANDLE_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize,
+        shape=(rows,))
+
+def index_of(header: np.void, timestamp: int) -> int:
+    """Record number of timestamp, O(1) because of the fixed cadence"""
+    return (int(timestamp) - int(header['start'])) // int(header['interval'])
+
+def lookup(path: str, timestamp: int) -> np.void:
+    """The record of timestamp (NaN values if there was no candle), IndexError if outside"""
+    header = read_header(path)
+    i = index_of(header, timestamp)
+    if i < 0 or i >= count(path):
+        raise IndexError('{} not in {}'.format(timestamp, path))
+    with open(path, 'rb') as fd:
+        fd.seek(HEADER_DTYPE.itemsize + i * CANDLE_DTYPE.itemsize)
+        return np.frombuffer(fd.read(CANDLE_DTYPE.itemsize), dtype=CANDLE_DTYPE)[0]
+
+def first_last(path: str) -> tuple:
+    """(first timestamp, last timestamp, records) without reading the records in between"""
+    header = read_header(path)
+    rows = count(path)
+    if rows == 0:
+        return (None, None, 0)
+    start = int(header['start'])
+    return (start, start + (rows - 1) * int(header['interval']), rows)
+
+def _gap_records(first: int, last: int) -> np.ndarray:
+    """NaN records for timestamps first..last"""
+    records = np.empty(max(0, (last - first) // INTERVAL + 1), dtype=CANDLE_DTYPE)
+    records['timestamp'] = np.arange(first, last + 1, INTERVAL)[:len(records)]
+    for column in COLUMNS[1:]:
+        records[column] = np.nan
+    return records
+
+
+class CandleWriter:
+    """Append candles (timestamp, low, high, open, close, volume) in timestamp order.
+
+    mode 'w' starts a new store, 'a' appends to an existing one. Candles at or before the last
+    record are skipped, missing minutes are written as NaN records.
+    """
+    def __init__(self, path: str, mode: str = 'a'):
+        self.path = path
+        self.start = None
+        self.next = None
+        if mode == 'a' and os.path.exists(path) and os.path.getsize(path):
+            (start, last, rows) = first_last(path)
+            self.start = start
+            self.next = None if last is None else last + INTERVAL
+            self.fd = open(path, 'r+b')
+            # Drop a partially written record
+            self.fd.truncate(HEADER_DTYPE.itemsize + rows * CANDLE_DTYPE.itemsize)
+            self.fd.seek(0, os.SEEK_END)
+        else:
+            self.fd = open(path, 'wb')
+
+    def _write_header(self, start: int) -> None:
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['start'] = start
+        header['interval'] = INTERVAL
+        self.fd.seek(0)
+        self.fd.write(header.tobytes())
+        self.start = start
+
+    def write_many(self, candles) -> None:
+        records = np.asarray([tuple(c) for c in candles], dtype=CANDLE_DTYPE) \
+            if not isinstance(candles, np.ndarray) else candles.astype(CANDLE_DTYPE, copy=False)
+        if not len(records):
+            return
+        if self.next is not None:
+            records = records[records['timestamp'] >= self.next]
+        if not len(records):
+            return
+        timestamps = records['timestamp']
+        if np.any(np.diff(timestamps) <= 0):
+            raise ValueError('candles must be in increasing timestamp order')
+        if np.any((timestamps - timestamps[0]) % INTERVAL):
+            raise ValueError('candle timestamps must be {}s apart'.format(INTERVAL))
+        if self.start is None:
+            self._write_header(int(timestamps[0]))
+            self.next = int(timestamps[0])
+        elif (int(timestamps[0]) - self.start) % INTERVAL:
+            raise ValueError('candle timestamps must be {}s apart'.format(INTERVAL))
+        # Dense records: one per interval from self.next up to the last candle
+        dense = _gap_records(self.next, int(timestamps[-1]))
+        dense[(timestamps - self.next) // INTERVAL] = records
+        self.fd.write(dense.tobytes())
+        self.next = int(timestamps[-1]) + INTERVAL
+
+    def write(self, candle) -> None:
+        self.write_many([candle])
+
+    def close(self) -> None:
+        self.fd.close()
+
+def write_at(path: str, candles) -> int:
+    """Overwrite the records of candles that fall inside the store (e.g. gap repairs)
+
+    Bumps the header's generation (reserved[0]) so caches see a rewrite, not an append.
+    """
+    header = read_header(path)
+    rows = count(path)
+    written = 0
+    with open(path, 'r+b') as fd:
+        header['reserved'][0] += 1
+        fd.write(np.array([header], dtype=HEADER_DTYPE).tobytes())
+        for candle in candles:
+            i = index_of(header, candle[0])
+            if 0 <= i < rows:
+                fd.seek(HEADER_DTYPE.itemsize + i * CANDLE_DTYPE.itemsize)
+                fd.write(np.array([tuple(candle)], dtype=CANDLE_DTYPE).tobytes())
+                written += 1
+    return written
+
+def gaps(path: str) -> list:
+    """[first missing, last missing] timestamps of the NaN record runs"""
+    records = read(path)
+    missing = np.isnan(records['close'])
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], missing, [False]]).astype(np.int8)))
+    return [[int(records['timestamp'][a]), int(records['timestamp'][b - 1])]
+        for (a, b) in zip(edges[::2], edges[1::2])]
+
+def convert(csv_path: str, out_path: str, chunksize: int = 1000000) -> int:
+    """Write a history CSV (optionally .gz) to a candle store, returns the records written"""
+    tmp = '{}.tmp.{}'.format(out_path, os.getpid())
+    writer = CandleWriter(tmp, 'w')
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            chunk = chunk.dropna(subset=['timestamp'])
+            records = np.empty(len(chunk), dtype=CANDLE_DTYPE)
+            for column in COLUMNS:
+                records[column] = chunk[column].values
+            # Same as the history writer: skip rows at or before the last one
+            keep = records['timestamp'] > np.maximum.accumulate(
+                np.concatenate([[np.iinfo(np.int64).min], records['timestamp'][:-1]]))
+            writer.write_many(records[keep])
+    finally:
+        writer.close()
+    os.replace(tmp, out_path)
+    return count(out_path)
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(prog='python -m emabot.candles')
+    parser.add_argument('csv_file', help='History CSV to convert (.csv or .csv.gz)')
+    parser.add_argument('out_file', nargs='?', default=None,
+        help='Candle store to write (default:CSV name with {})'.format(SUFFIX))
+    args = parser.parse_args(argv)
+    out_file = args.out_file
+    if out_file is None:
+        out_file = args.csv_file.split('.csv')[0] + SUFFIX
+    rows = convert(args.csv_file, out_file)
+    (first, last, _) = first_last(out_file)
+    print('{}: {} records, {} to {}'.format(out_file, rows, first, last))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Long-running bot loop that decides right after each resample bin closes
+
+Cron starts a cold process per tick and needs its minute matched to the resample value by hand.
+The daemon keeps the fleet (history cache, resampled bins and EMA state) in memory, sleeps until
+the next resample boundary plus a settle delay, appends only the candles that closed since the
+previous decision and runs the bots whose bin just closed.
+"""
+import os
+import sys
+import time
+from datetime import datetime
+from pandas.tseries.frequencies import to_offset
+from .fleet import Fleet, FleetError
+from .history import first_last
+
+# Seconds to wait after a bin closes, so the exchange has published its last candle
+SETTLE = 120
+
+
+def resample_seconds(resample: str) -> float:
+    """Length of a fixed resample rule (1h, 4h, 12h, 1D...) in seconds"""
+    try:
+        return to_offset(resample).nanos / 1e9
+    except ValueError as err:
+        raise ValueError('resample {} is not a fixed period: {}'.format(resample, err)) from err
+
+def next_boundary(now: float, resample: str, origin: float = 0) -> float:
+    """First resample boundary after now, in epoch seconds
+
+    Bins are counted from origin like pandas resample does from its default origin='start_day'
+    (midnight of the first row, see history_origin()). Any midnight gives the same boundaries
+    for rules that divide a day.
+    """
+    step = resample_seconds(resample)
+    return origin + ((now - origin) // step + 1) * step
+
+def history_origin(hist_file: str) -> float:
+    """Midnight (UTC) of the first candle of a history file, 0 while there is none"""
+    if not os.path.exists(hist_file):
+        return 0
+    first = first_last(hist_file)
+    return first[0] // 86400 * 86400 if first else 0
+
+
+class Daemon:
+    """Runs the bots of a fleet forever, each one settle seconds after its resample bin closes
+
+    clock and sleep can be replaced (e.g. by a fake clock) to drive the schedule in tests.
+    """
+    def __init__(self,
+            fleet: Fleet,
+            settle: float = SETTLE,
+            clock=time.time,
+            sleep=time.sleep):
+        self.fleet = fleet
+        self.settle = settle
+        self.clock = clock
+        self.sleep = sleep
+        for bot in fleet.bots:
+            # Fail at startup, not at the first tick
+            resample_seconds(bot.resample)
+
+    def due(self, now: float) -> tuple:
+        """(when, bots) of the next decision after now"""
+        schedule = {}
+        for bot in self.fleet.bots:
+            origin = 0
+            if 86400 % resample_seconds(bot.resample):
+                # e.g. 2D or 7h, the bins depend on where the history starts
+                origin = history_origin(bot.hist_file)
+            when = next_boundary(now - self.settle, bot.resample, origin) + self.settle
+            schedule.setdefault(when, []).append(bot)
+        when = min(schedule)
+        return (when, schedule[when])
+
+    def tick(self, bots: list) -> None:
+        try:
+            self.fleet.run(bots)
+        except FleetError as err:
+            # Failing bots or history sync, logged; retried at the next boundary
+            print('{} {}'.format(datetime.now(), err), file=sys.stderr)
+        except Exception as err: # pylint: disable=broad-except
+            # Keep the schedule going whatever failed
+            print('{} tick failed: {}: {}'.format(datetime.now(), type(err).__name__, err),
+                file=sys.stderr)
+
+    def run(self, ticks: int = None) -> None:
+        """Decide at every boundary, forever or for a number of ticks"""
+        done = 0
+        while ticks is None or done < ticks:
+            (when, bots) = self.due(self.clock())
+            # sleep() can return early (signals, clock changes), never decide before the boundary
+            delay = when - self.clock()
+            while delay > 0:
+                self.sleep(delay)
+                delay = when - self.clock()
+            self.tick(bots)
+            done += 1
@@ -0,0 +1,260 @@
+"""
+Shared access to the Coinbase Pro API
+
+Every request of a process (bot API calls, history downloads) can go through one Exchange: one
+keep-alive connection pool, one token bucket per API class (public/private), jittered retries of
+transient errors and a latency histogram per endpoint.
+
+requests and cbpro are imported by the first client that is built. Public reads (e.g. the
+ticker) go through get() on urllib, so `emabot --monitor` loads neither (see importtime.py).
+"""
+import json
+import time
+import random
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import cbpro
+
+API_URL = 'https://api.pro.coinbase.com'
+# Public endpoints allow 3 requests per second, bursts up to 6
+RATE = 3.0
+BURST = 6
+# Private (authenticated) endpoints allow 5 requests per second, bursts up to 10
+PRIVATE_RATE = 5.0
+PRIVATE_BURST = 10
+POOL_SIZE = 16
+RETRIES = 14
+# Retry delays are drawn from [0, min(BACKOFF_CAP, BACKOFF * 2 ** attempt)]
+BACKOFF = 0.5
+BACKOFF_CAP = 10.0
+# Error messages worth retrying, the API answers them with a JSON 'message'
+TRANSIENT = ('rate limit', 'internal server error', 'service unavailable', 'timeout')
+# Latency histogram bucket upper bounds in milliseconds
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+
+class ApiError(Exception):
+    """The API answered with an error message"""
+
+
+class HistoryError(Exception):
+    """history.py gave up downloading candles (catchable without importing pandas)"""
+
+
+class TokenBucket:
+    """Thread safe token bucket: acquire() blocks until a request may be sent"""
+    def __init__(self, rate: float, burst: int = 1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class LatencyHistogram:
+    """Thread safe request latency counts per BUCKETS bound"""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        msec = seconds * 1000.0
+        i = 0
+        while msec > BUCKETS[i]:
+            i += 1
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += msec
+            self.max = max(self.max, msec)
+            if error:
+                self.errors += 1
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound (ms) of the bucket holding the pct percentile"""
+        with self.lock:
+            rank = pct / 100.0 * self.count
+            seen = 0
+            for (bound, count) in zip(BUCKETS, self.counts):
+                seen += count
+                if count and seen >= rank:
+                    return round(min(bound, self.max), 1)
+        return 0.0
+
+    def summary(self) -> dict:
+        return {
+            'count':self.count,
+            'errors':self.errors,
+            'mean_ms':round(self.total / self.count, 1) if self.count else 0.0,
+            'p50_ms':self.percentile(50),
+            'p95_ms':self.percentile(95),
+            'p99_ms':self.percentile(99),
+            'max_ms':round(self.max, 1),
+        }
+
+
+def make_session(pool_size=POOL_SIZE):
+    """Keep-alive session, safe to share between threads and clients"""
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def _urlopen_json(url: str, params: dict = None):
+    """Decoded JSON of a GET request, including the body of an error status"""
+    from http.client import HTTPException
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+    from urllib.request import Request, urlopen
+    if params:
+        url = '{}?{}'.format(url, urlencode(params))
+    request = Request(url, headers={'User-Agent':'emabot'})
+    try:
+        with urlopen(request, timeout=30) as response:
+            return json.loads(response.read())
+    except HTTPError as err:
+        with err:
+            return json.loads(err.read())
+    except HTTPException as err:
+        # e.g. IncompleteRead, retried by call() like the OSErrors
+        raise ConnectionError('{}: {!r}'.format(url, err)) from err
+
+def _transient(message) -> bool:
+    message = str(message).lower()
+    return any(i in message for i in TRANSIENT)
+
+
+class Exchange:
+    """Retrying, rate limited and timed API access for every client of a process
+
+    Clients from public_client()/auth_client() share the connection pool (request auth is per
+    call, so accounts can share it), created with the first client. Requests go through call(),
+    or get() for public GETs without a client.
+    """
+    def __init__(self,
+            api_url: str = API_URL,
+            rate: float = RATE,
+            burst: int = BURST,
+            private_rate: float = PRIVATE_RATE,
+            private_burst: int = PRIVATE_BURST,
+            pool_size: int = POOL_SIZE,
+            retries: int = RETRIES,
+            sleep=time.sleep):
+        # pylint: disable=too-many-arguments
+        self.api_url = api_url
+        self.limiters = {
+            False:TokenBucket(rate, burst, sleep=sleep),
+            True:TokenBucket(private_rate, private_burst, sleep=sleep),
+        }
+        self.pool_size = pool_size
+        self._session = None
+        self.retries = retries
+        self.sleep = sleep
+        self.latency = {}
+        self.lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self.lock:
+            if self._session is None:
+                self._session = make_session(self.pool_size)
+            return self._session
+
+    def public_client(self) -> 'cbpro.PublicClient':
+        import cbpro
+        client = cbpro.PublicClient(api_url=self.api_url)
+        client.session = self.session
+        return client
+
+    def auth_client(self, key: str, b64secret: str,
+            passphrase: str) -> 'cbpro.AuthenticatedClient':
+        import cbpro
+        client = cbpro.AuthenticatedClient(key, b64secret, passphrase, api_url=self.api_url)
+        client.session = self.session
+        return client
+
+    def get(self, endpoint: str, path: str, **params):
+        """call() a public GET (e.g. /products/ETH-USD/ticker) without a cbpro client
+
+        Error statuses are decoded like cbpro does, so call() raises ApiError with the 'message'.
+        """
+        return self.call(endpoint, _urlopen_json, self.api_url + path, params)
+
+    def histogram(self, endpoint: str) -> LatencyHistogram:
+        with self.lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = LatencyHistogram()
+            return self.latency[endpoint]
+
+    def backoff(self, attempt: int) -> None:
+        self.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF * 2 ** attempt)))
+
+    def call(self, endpoint: str, func, *args, private: bool = False, idempotent: bool = True,
+            **kwargs):
+        """func(*args, **kwargs) behind the rate limit, retrying transient errors
+
+        endpoint names the latency histogram. Requests that are not idempotent (placing orders)
+        are only retried when the API rejected them (rate limit), never after a network error
+        since the request may have been executed.
+        """
+        histogram = self.histogram(endpoint)
+        error = None
+        for attempt in range(self.retries):
+            self.limiters[private].acquire()
+            start = time.monotonic()
+            try:
+                response = func(*args, **kwargs)
+            except (ValueError, OSError) as err:
+                # JSONDecodeError is a ValueError, requests and urllib errors are OSErrors
+                histogram.record(time.monotonic() - start, error=True)
+                if not idempotent:
+                    raise
+                error = err
+                self.backoff(attempt)
+                continue
+            failed = isinstance(response, dict) and 'message' in response
+            histogram.record(time.monotonic() - start, error=failed)
+            if not failed:
+                return response
+            error = response['message']
+            if not _transient(error) or not (idempotent or 'rate limit' in str(error).lower()):
+                raise ApiError(error)
+            self.backoff(attempt)
+        raise ApiError('{} failed after {} attempts: {}'.format(endpoint, self.retries, error))
+
+    def report(self) -> str:
+        """One line per endpoint: count, errors and latency percentiles"""
+        with self.lock:
+            endpoints = sorted(self.latency)
+        lines = []
+        for endpoint in endpoints:
+            stats = self.latency[endpoint].summary()
+            lines.append('{} {}'.format(endpoint, ' '.join(
+                '{}={}'.format(k, v) for (k, v) in stats.items())))
+        return '\n'.join(lines)
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
@@ -0,0 +1,166 @@
+"""
+Run every bot config in a directory in one process
+"""
+import os
+import glob
+from concurrent.futures import ThreadPoolExecutor
+from .bot import EmaBot, decider_frame, decider_bins, ema_decision, load_pandas
+from .exchange import API_URL, Exchange, HistoryError
+from .orders import SettlementWatcher
+
+# Portfolios whose API work (wallet, fees, price, orders) runs at the same time
+JOBS = 8
+
+
+class FleetError(Exception):
+    """One or more bots of the fleet failed"""
+
+
+class Fleet:
+    """All the bots configured in config_dir (*.yml, or a single config file), run as one pass"""
+    def __init__(self,
+            config_dir: str,
+            dryrun: bool = False,
+            force_sell: bool = False,
+            monitor: bool = False,
+            debug: bool = False,
+            jobs: int = JOBS,
+            api_url: str = API_URL):
+        if os.path.isfile(config_dir):
+            self.config_paths = [config_dir]
+        else:
+            self.config_paths = sorted(glob.glob(os.path.join(config_dir, '*.yml')))
+        if not self.config_paths:
+            raise FleetError('No *.yml configs found in {}'.format(config_dir))
+        self.debug = debug
+        self.monitor = monitor
+        self.jobs = jobs
+        # One rate limit and connection pool for the history downloads and every portfolio
+        self.exchange = Exchange(api_url)
+        self.bots = [
+            EmaBot(path, dryrun=dryrun, debug=debug, monitor=monitor, force_sell=force_sell,
+                exchange=self.exchange)
+            for path in self.config_paths]
+        # One thread polls the orders of every portfolio
+        self.watcher = SettlementWatcher()
+        for bot in self.bots:
+            bot.watcher = self.watcher
+        # Incremental decider state, kept in memory between runs by a long-running process
+        self.deciders = {}
+        self.failed = {}
+
+    def _each(self, func, bots) -> list:
+        """Call func(bot) concurrently, returning [(bot, result)] for the bots that succeeded
+
+        A failing bot is logged and left out of the following phases, the others carry on.
+        """
+        def call(bot):
+            try:
+                return (bot, func(bot), None)
+            except Exception as err: # pylint: disable=broad-except
+                return (bot, None, err)
+
+        done = []
+        with ThreadPoolExecutor(max_workers=max(1, min(self.jobs, len(bots)))) as pool:
+            for (bot, result, err) in pool.map(call, bots):
+                if err is not None:
+                    self._fail(bot, err)
+                else:
+                    done.append((bot, result))
+        return done
+
+    @staticmethod
+    def _setup(bot: EmaBot) -> tuple:
+        if bot.auth_client is None:
+            bot.cb_auth()
+        return bot._run_setup(history=False) # pylint: disable=protected-access
+
+    @staticmethod
+    def _trade(bot: EmaBot, wallet, fees, price, buy) -> None:
+        # pylint: disable=unused-argument
+        bot.trade(wallet, price, buy)
+
+    def _fail(self, bot: EmaBot, err: Exception) -> None:
+        bot.logit('ERROR: {}: {}'.format(type(err).__name__, err))
+        self.failed[bot.config_path] = err
+
+    def _decider(self, bot: EmaBot) -> dict:
+        """Catch the bot's incremental decider up with its history and decide"""
+        decider = self.deciders.get(bot.decider_path)
+        if decider is None:
+            from .decider import IncrementalDecider
+            decider = IncrementalDecider(
+                bot.hist_file, bot.decider_path, bot.ema_a, bot.ema_b, bot.resample)
+            decider.load()
+            self.deciders[bot.decider_path] = decider
+        decider.update()
+        decider.save()
+        return decider.decision(debug=self.debug)
+
+    def decide(self, bots: list) -> list:
+        """Compute every bot's decision, reading each history file once, return the decided bots
+
+        Bots that share a history file share its frame, resampled closes and EMAs; bots with the
+        same pair/resample/emaA/emaB share the persisted incremental decider state.
+        """
+        # Not needed by --monitor, imported here (see importtime.py)
+        import talib
+        from . import ohlc
+        load_pandas()
+        frames = {}
+        bins = {}
+        emas = {}
+        decisions = {}
+        decided = []
+        for bot in bots:
+            try:
+                if ohlc.is_cacheable(bot.hist_file):
+                    if bot.decider_path not in decisions:
+                        decisions[bot.decider_path] = self._decider(bot)
+                    bot.decision = dict(decisions[bot.decider_path])
+                else:
+                    if bot.hist_file not in frames:
+                        frames[bot.hist_file] = decider_frame(bot.hist_file)
+                    key = (bot.hist_file, bot.resample)
+                    if key not in bins:
+                        bins[key] = decider_bins(
+                            bot.hist_file, bot.resample, frame=frames[bot.hist_file])
+                    for period in (bot.ema_a, bot.ema_b):
+                        if key+(period,) not in emas:
+                            emas[key+(period,)] = talib.EMA(bins[key][0], period)
+                    bot.decision = ema_decision(
+                        emas[key+(bot.ema_a,)], emas[key+(bot.ema_b,)], bins[key][1],
+                        debug=self.debug)
+            except Exception as err: # pylint: disable=broad-except
+                self._fail(bot, err)
+                continue
+            decided.append(bot)
+        return decided
+
+    def run(self, bots: list = None) -> None:
+        """Run bots (default: all of them) once"""
+        if bots is None:
+            bots = self.bots
+        self.failed = {}
+        if self.monitor:
+            self._each(lambda bot: bot.run(), bots)
+        else:
+            from .history import sync, sync_targets
+            # Each pair is downloaded once, under one rate limit
+            try:
+                sync(sync_targets([bot.config_path for bot in bots]), debug=self.debug,
+                    exchange=self.exchange)
+            except HistoryError as err:
+                raise FleetError('history sync failed: {}'.format(err)) from err
+            # The decisions are computed while the API reads are in flight
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                setups = pool.submit(self._each, self._setup, bots)
+                decided = self.decide(bots)
+                setups = dict(setups.result())
+            decided = [bot for bot in decided if bot in setups]
+            self._each(lambda bot: self._trade(bot, *setups[bot]), decided)
+        if self.debug:
+            print(self.exchange.report())
+        if self.failed:
+            raise FleetError('{} of {} bots failed: {}'.format(
+                len(self.failed), len(bots), ', '.join(self.failed)))
@@ -1,116 +1,489 @@
 import sys
 import os
 import time
+import argparse
 import datetime
 from datetime import timedelta
 import json
-import cbpro
+import bisect
+import shutil
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .util import load_config
+from .exchange import API_URL, RATE, BURST, ApiError, Exchange, HistoryError
+from . import candles
 
 os.environ['TZ'] = 'UTC'
 time.tzset()
 
 SIZE = 60
+JOBS = 4
+GAP_VERSION = 1
+
 
 def date2str(dtobj_or_str):
     """Convert date to str"""
     return str(dtobj_or_str).replace(' ', 'T').split('.')[0]+'Z'
 
-def generate_historical_csv(outfile, pair='BTC-USD', days_ago=522, debug=False):
+def parse_timestamp(line):
+    return float(line.split(',')[0].replace('"', ''))
+
+def read_head(path, count):
+    """First count non-empty lines"""
+    lines = []
+    with open(path) as fd:
+        for line in fd:
+            if line.strip():
+                lines.append(line.strip())
+                if len(lines) >= count:
+                    break
+    return lines
+
+def read_tail(path, block=4096):
+    """Last non-empty line, found by seeking back from the end of the file"""
+    with open(path, 'rb') as fd:
+        end = fd.seek(0, os.SEEK_END)
+        data = b''
+        while end > 0:
+            start = max(0, end - block)
+            fd.seek(start)
+            data = fd.read(end - start) + data
+            end = start
+            stripped = data.rstrip()
+            if b'\n' in stripped or start == 0:
+                return stripped.rsplit(b'\n', 1)[-1].decode()
+    return ''
+
+def gap_index_path(outfile):
+    return outfile + '.gaps'
+
+def _read_gap_index(outfile):
+    try:
+        with open(gap_index_path(outfile)) as fd:
+            index = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != GAP_VERSION:
+        return None
+    return index
+
+def _write_gap_index(outfile, index):
+    path = gap_index_path(outfile)
+    tmp = '{}.tmp.{}'.format(path, os.getpid())
+    with open(tmp, 'w') as fd:
+        json.dump(index, fd)
+    os.replace(tmp, path)
+
+def _merge_ranges(ranges):
+    merged = []
+    for (start, end) in sorted(ranges):
+        if merged and start <= merged[-1][1] + SIZE:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def update_gap_index(outfile):
+    """Bring the gap index (<outfile>.gaps) up to date and return it.
+
+    The index holds the missing minute ranges [first missing, last missing] and the byte offset
+    it has scanned up to. Appended rows are scanned from that offset; if the file was rewritten
+    (the row before the offset changed) it is scanned again from the top. Candle stores hold
+    NaN records for missing minutes, their gaps are simply read off the store.
+    """
+    index = _read_gap_index(outfile)
+    if candles.is_candle_file(outfile):
+        index = {'version':GAP_VERSION, 'gaps':candles.gaps(outfile),
+            'empty':index['empty'] if index else []}
+        _write_gap_index(outfile, index)
+        return index
+    size = os.path.getsize(outfile)
+    empty = index['empty'] if index else []
+    if index and index['size'] <= size and index['size'] > 0:
+        with open(outfile, 'rb') as fd:
+            fd.seek(max(0, index['size'] - 256))
+            tail = fd.read(index['size'] - fd.tell()).rstrip().rsplit(b'\n', 1)[-1]
+        if index['last'] is None or tail.decode(errors='replace') != index['last_line']:
+            index = None
+    else:
+        index = None
+    if index is None:
+        index = {'version':GAP_VERSION, 'size':0, 'last':None, 'last_line':None, 'gaps':[],
+            'empty':empty}
+    with open(outfile, 'rb') as fd:
+        if index['size'] == 0:
+            index['size'] = len(fd.readline()) # header
+        else:
+            fd.seek(index['size'])
+        last = index['last']
+        for line in fd:
+            if not line.endswith(b'\n'):
+                # Partial last line, still being written
+                break
+            index['size'] += len(line)
+            if not line.strip():
+                continue
+            tstamp = parse_timestamp(line.decode())
+            if last is not None and tstamp - last > SIZE:
+                index['gaps'].append([last + SIZE, tstamp - SIZE])
+            last = tstamp
+            index['last_line'] = line.rstrip().decode()
+        index['last'] = last
+    _write_gap_index(outfile, index)
+    return index
+
+def find_gaps(index):
+    """Gaps not yet confirmed empty by a repair"""
+    empty = index['empty']
+    gaps = []
+    for (start, end) in index['gaps']:
+        if not any(a <= start and end <= b for (a, b) in empty):
+            gaps.append((start, end))
+    return gaps
+
+def first_last(outfile):
+    """(first, last) timestamps of a history file with more than 10 rows, None otherwise"""
+    if candles.is_candle_file(outfile):
+        if os.path.getsize(outfile) < candles.HEADER_DTYPE.itemsize:
+            return None
+        (first, last, rows) = candles.first_last(outfile)
+        return (float(first), float(last)) if rows > 10 else None
+    head = read_head(outfile, 11)
+    if len(head) <= 10:
+        return None
+    return (parse_timestamp(head[1]), parse_timestamp(read_tail(outfile)))
+
+
+class CsvWriter:
+    """Writes candles as quoted CSV lines, mode 'w' starts a new file with the header"""
+    def __init__(self, path, mode='a'):
+        self.fd = open(path, mode)
+        if mode == 'w':
+            self.fd.write('"timestamp","low","high","open","close","volume"\n')
+
+    def write(self, candle):
+        self.fd.write(_format_row(candle))
+
+    def close(self):
+        self.fd.close()
+
+def open_writer(outfile, mode='a'):
+    """Candle writer for the history file format (*.candles or CSV)"""
+    if candles.is_candle_file(outfile):
+        return candles.CandleWriter(outfile, mode)
+    return CsvWriter(outfile, mode)
+
+def generate_historical_csv(outfile, pair='BTC-USD', days_ago=522, debug=False, jobs=JOBS,
+        rate=RATE, burst=BURST, api_url=API_URL, exchange=None):
     """Generate CSV file from coinbase get_product_historic_rates.
-    Append to existing file if it exists.
+    Append to existing file if it exists. Writes a binary candle store instead when outfile
+    ends with .candles.
+
+    The 4 hour windows are fetched by `jobs` threads sharing a rate limit of `rate` requests per
+    second (bursts up to `burst`) and written in timestamp order. Pass an Exchange to share its
+    rate limit and connection pool with other downloads and bots (see sync()).
+
+    Raises HistoryError when the API keeps failing; the candles written up to then are kept.
     """
-    # pylint: disable=too-many-locals
-    public_client = cbpro.PublicClient()
+    # pylint: disable=too-many-locals,too-many-arguments
     last_date = None
     first_date = None
-    prev_data = []
+    prev_data = None
     if os.path.exists(outfile):
         if debug:
             print('reading prev file')
-        prev_data = open(outfile).read().strip().split('\n')
-    if len(prev_data) > 10:
-        if debug:
-            print('prev_data length:', len(prev_data))
-        first_date = float(prev_data[1].split(',')[0].replace('"', ''))
-        last_date = float(prev_data[-1].split(',')[0].replace('"', ''))
+        # Only the first and last rows, not the whole file
+        prev_data = first_last(outfile)
+    if prev_data:
+        (first_date, last_date) = prev_data
         diff_first = int((time.time() - first_date) / 86400) + 86400
-        diff_last = int((time.time() - last_date) / 86400)
         # if days_ago is > what the file had, rewrite everything
         if days_ago > diff_first:
             print('rewriting entire file since days_ago > diff_first: {} > {}'.format(days_ago, diff_first))
             start_date = datetime.datetime.now() - timedelta(days=days_ago)
             next_date = start_date # + timedelta(minutes=SIZE)
             last_date = None
-            out_fd = open(outfile, 'w')
-            out_fd.write('"timestamp","low","high","open","close","volume"\n')
+            out_fd = open_writer(outfile, 'w')
         else:
             if debug:
                 print('appending to file')
-            start_date = datetime.datetime.now() - timedelta(days=diff_last+1)
+            # Only the windows from the last stored candle on (older rows would be skipped)
+            start_date = datetime.datetime.fromtimestamp(last_date)
             next_date = start_date #  + timedelta(minutes=SIZE)
-            out_fd = open(outfile, 'a')
-        end_date = datetime.datetime.now()+timedelta(days=1)
+            out_fd = open_writer(outfile, 'a')
+            end_date = datetime.datetime.now()
+        if last_date is None:
+            end_date = datetime.datetime.now()+timedelta(days=1)
     else:
         if debug:
             print('truncate file, new data')
         start_date = datetime.datetime.now() - timedelta(days=days_ago)
         end_date = datetime.datetime.now()+timedelta(days=1)
         next_date = start_date # + timedelta(minutes=SIZE)
-        out_fd = open(outfile, 'w')
-        out_fd.write('"timestamp","low","high","open","close","volume"\n')
+        out_fd = open_writer(outfile, 'w')
 
     if debug:
         print('start_date:', start_date, 'next_date:', end_date)
-    misses = 0
+    windows = []
+    next_date = start_date
     while next_date < end_date:
-        start_str = date2str(next_date)
-        end_str = date2str(next_date+timedelta(hours=4))
-        stats = None
-        error = False
-        if debug:
-            print('start_str:', start_str, 'end_str:', end_str)
-        for attempt in range(14):
-            try:
-                stats = public_client.get_product_historic_rates(
-                    pair,
-                    granularity=SIZE,
-                    start=date2str(next_date),
-                    end=date2str(next_date+timedelta(hours=4)))
-                error = False
-                if debug:
-                    print('stats length:', len(stats))
-                break
-            except json.decoder.JSONDecodeError as e:
-                print(e)
-                error = True
-                time.sleep(10)
-        if error:
-            print('API_ERROR: history API failed after many retries')
-            sys.exit(1)
-        if 'message' in stats:
-            print('API_ERROR:', stats['message'])
-            sys.exit(1)
+        windows.append((date2str(next_date), date2str(next_date+timedelta(hours=4))))
         next_date = next_date + timedelta(hours=4)
-        # stats are from newest to oldest, so reverse it
-        stats.reverse()
-        if len(stats) < 1:
-            misses += 1
-            if misses > 10:
-                print('stats len < 1 {} times. stopping.'.format(misses))
-                break
-        for i in stats:
-            (tstamp, low, high, x_open, x_close, x_volume) = i
-            if last_date and last_date >= tstamp:
-                #print('skip: {} > {}'.format(last_date, tstamp))
+    owned = exchange is None
+    if owned:
+        exchange = Exchange(api_url, rate=rate, burst=burst, pool_size=jobs)
+    misses = 0
+    try:
+        for stats in fetch_windows(pair, windows, exchange, jobs=jobs, debug=debug):
+            # stats are from newest to oldest, put them in timestamp order
+            stats.sort(key=lambda candle: candle[0])
+            if len(stats) < 1:
+                misses += 1
+                if misses > 10:
+                    print('stats len < 1 {} times. stopping.'.format(misses))
+                    break
+            for i in stats:
+                (tstamp, low, high, x_open, x_close, x_volume) = i
+                if last_date and last_date >= tstamp:
+                    #print('skip: {} > {}'.format(last_date, tstamp))
+                    continue
+                out_fd.write((tstamp, low, high, x_open, x_close, x_volume))
+                last_date = tstamp
+    finally:
+        out_fd.close()
+        if owned:
+            exchange.close()
+    update_gap_index(outfile)
+
+def repair_gaps(outfile, pair='BTC-USD', debug=False, jobs=JOBS, rate=RATE, burst=BURST,
+        api_url=API_URL, exchange=None) -> int:
+    """Refetch the windows of the missing minute ranges in the gap index and merge them in.
+
+    Only the gaps are downloaded; the CSV is then rewritten locally in one streaming pass (a
+    candle store is patched in place).
+    Gaps the exchange has no candles for are remembered so they are not fetched again.
+    Returns the number of rows added, raises HistoryError when the API keeps failing.
+    """
+    # pylint: disable=too-many-locals,too-many-arguments
+    index = update_gap_index(outfile)
+    gaps = find_gaps(index)
+    if not gaps:
+        return 0
+    windows = []
+    for (start, end) in gaps:
+        # end is the last missing minute, windows hold up to 240 candles
+        for window_start in range(int(start), int(end) + SIZE, 240 * SIZE):
+            window_end = min(window_start + 239 * SIZE, int(end))
+            windows.append((date2str(datetime.datetime.utcfromtimestamp(window_start)),
+                date2str(datetime.datetime.utcfromtimestamp(window_end))))
+    if debug:
+        print('gaps:', len(gaps), 'windows:', len(windows))
+    owned = exchange is None
+    if owned:
+        exchange = Exchange(api_url, rate=rate, burst=burst, pool_size=jobs)
+    fetched = []
+    try:
+        for stats in fetch_windows(pair, windows, exchange, jobs=jobs, debug=debug):
+            fetched.extend(stats)
+    finally:
+        if owned:
+            exchange.close()
+    # Keep candles inside the gaps only, once each, in timestamp order
+    starts = [start for (start, _) in gaps]
+    found = {}
+    for candle in fetched:
+        i = bisect.bisect_right(starts, candle[0]) - 1
+        if i >= 0 and candle[0] <= gaps[i][1]:
+            found[candle[0]] = candle
+    added = [found[tstamp] for tstamp in sorted(found)]
+    if added and candles.is_candle_file(outfile):
+        candles.write_at(outfile, added)
+    elif added:
+        _merge_rows(outfile, added)
+    index = update_gap_index(outfile)
+    # What is still missing inside the fetched gaps is not available from the exchange
+    requested = [list(gap) for gap in gaps]
+    index['empty'] = _merge_ranges(index['empty'] + [gap for gap in index['gaps']
+        if any(a <= gap[0] and gap[1] <= b for (a, b) in requested)])
+    _write_gap_index(outfile, index)
+    return len(added)
+
+def _merge_rows(outfile, added):
+    """Insert sorted candles into the sorted CSV, atomically"""
+    tmp = '{}.tmp.{}'.format(outfile, os.getpid())
+    with open(outfile) as in_fd, open(tmp, 'w') as out_fd:
+        out_fd.write(in_fd.readline())
+        i = 0
+        for line in in_fd:
+            if not line.strip():
                 continue
-            out_fd.write('"{}","{}","{}","{}","{}","{}"\n'.format(
-                tstamp, low, high, x_open, x_close, x_volume))
-            last_date = tstamp
-        time.sleep(2.0)
-    out_fd.close()
+            tstamp = parse_timestamp(line)
+            while i < len(added) and added[i][0] < tstamp:
+                out_fd.write(_format_row(added[i]))
+                i += 1
+            if i < len(added) and added[i][0] == tstamp:
+                i += 1
+            out_fd.write(line)
+        for candle in added[i:]:
+            out_fd.write(_format_row(candle))
+    os.replace(tmp, outfile)
+
+def _format_row(candle):
+    return '"{}","{}","{}","{}","{}","{}"\n'.format(*candle)
+
+def fetch_window(exchange, client, pair, start, end, debug=False):
+    """Candles for one window (newest first), retried by the exchange on transient errors"""
+    try:
+        stats = exchange.call('candles', client.get_product_historic_rates,
+            pair, granularity=SIZE, start=start, end=end)
+    except ApiError as e:
+        raise HistoryError(str(e)) from e
+    if debug:
+        print('start_str:', start, 'end_str:', end, 'stats length:', len(stats))
+    return stats
+
+def fetch_windows(pair, windows, exchange, jobs=JOBS, debug=False):
+    """Yield the candles of each (start, end) window in the order of windows.
+
+    Windows are fetched concurrently by a pool of jobs threads, each with its own PublicClient
+    on the exchange's connection pool. Out of order responses are held back until all earlier
+    windows have been yielded; at most jobs * 4 windows are in flight.
+    """
+    local = threading.local()
+
+    def fetch(window):
+        if not hasattr(local, 'client'):
+            local.client = exchange.public_client()
+        return fetch_window(exchange, local.client, pair, window[0], window[1], debug=debug)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        windows = iter(windows)
+        try:
+            for window in itertools.islice(windows, jobs * 4):
+                pending.append(pool.submit(fetch, window))
+            while pending:
+                stats = pending.popleft().result()
+                for window in itertools.islice(windows, 1):
+                    pending.append(pool.submit(fetch, window))
+                yield stats
+        finally:
+            for future in pending:
+                future.cancel()
+
+def sync_targets(items):
+    """Map pair -> CSV files from PAIR[=CSV] items and bot config files"""
+    targets = {}
+    for item in items:
+        if os.path.isfile(item):
+            general = load_config(item)['general']
+            (pair, hist_file) = (general['pair'], general['hist_file'])
+        else:
+            (pair, _, hist_file) = item.partition('=')
+            if not hist_file:
+                hist_file = 'csv/{}-history-1m-ohlc.csv'.format(pair.lower())
+        files = targets.setdefault(pair, [])
+        if hist_file not in files:
+            files.append(hist_file)
+    return targets
+
+def sync(targets, days_ago=522, debug=False, jobs=JOBS, rate=RATE, burst=BURST,
+        api_url=API_URL, exchange=None):
+    """Refresh the history of several pairs in one pass.
+
+    Each pair is downloaded once, into its first CSV file, and copied to the others. All pairs
+    share one rate limit and one keep-alive connection pool (exchange, e.g. the one of a fleet
+    of bots, or a new one).
+    """
+    # pylint: disable=too-many-arguments
+    owned = exchange is None
+    if owned:
+        exchange = Exchange(api_url, rate=rate, burst=burst,
+            pool_size=jobs * max(1, len(targets)))
+
+    def sync_pair(pair):
+        (outfile, *copies) = targets[pair]
+        generate_historical_csv(outfile, pair=pair, days_ago=days_ago, debug=debug, jobs=jobs,
+            exchange=exchange)
+        for path in copies:
+            for (src, dst) in ((outfile, path), (gap_index_path(outfile), gap_index_path(path))):
+                tmp = '{}.tmp.{}'.format(dst, os.getpid())
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, dst)
+        return pair
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(targets))) as pool:
+            for pair in pool.map(sync_pair, targets):
+                print('synced:', pair, ', '.join(targets[pair]))
+    finally:
+        if owned:
+            exchange.close()
+        if debug:
+            print(exchange.report())
+
+def sync_main(argv=None):
+    parser = argparse.ArgumentParser(prog='history sync')
+    parser.add_argument('items', nargs='+',
+        help='Bot config files and/or pairs, optionally with a CSV path: BTC-USD=csv/btc.csv')
+    parser.add_argument('--days-ago',
+        help='Days of history (default:522)', dest='days_ago', default=522, type=int)
+    parser.add_argument('--jobs',
+        help='Concurrent requests per pair (default:{})'.format(JOBS), dest='jobs', default=JOBS,
+        type=int)
+    parser.add_argument('--rate',
+        help='Requests per second for all pairs (default:{})'.format(RATE), dest='rate',
+        default=RATE, type=float)
+    parser.add_argument('--api-url',
+        help='API base URL (default:{})'.format(API_URL), dest='api_url', default=API_URL)
+    parser.add_argument('--debug',
+        help='Enable debug output', dest='debug', action='store_true', required=False)
+    args = parser.parse_args(argv)
+    try:
+        sync(sync_targets(args.items), days_ago=args.days_ago, debug=args.debug, jobs=args.jobs,
+            rate=args.rate, api_url=args.api_url)
+    except HistoryError as e:
+        print('API_ERROR:', e)
+        sys.exit(1)
 
 def main():
-    generate_historical_csv(sys.argv[1], pair='BTC-USD', days_ago=522)
+    if len(sys.argv) > 1 and sys.argv[1] == 'sync':
+        sync_main(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outfile', help='CSV file (or .candles store) to create or append to')
+    parser.add_argument('--pair', help='Product (default:BTC-USD)', dest='pair', default='BTC-USD')
+    parser.add_argument('--days-ago',
+        help='Days of history (default:522)', dest='days_ago', default=522, type=int)
+    parser.add_argument('--jobs',
+        help='Concurrent requests (default:{})'.format(JOBS), dest='jobs', default=JOBS, type=int)
+    parser.add_argument('--rate',
+        help='Requests per second (default:{})'.format(RATE), dest='rate', default=RATE,
+        type=float)
+    parser.add_argument('--api-url',
+        help='API base URL (default:{})'.format(API_URL), dest='api_url', default=API_URL)
+    parser.add_argument('--repair',
+        help='Only refetch the missing minute ranges in the gap index', dest='repair',
+        action='store_true', required=False)
+    parser.add_argument('--debug',
+        help='Enable debug output', dest='debug', action='store_true', required=False)
+    args = parser.parse_args()
+    try:
+        if args.repair:
+            added = repair_gaps(
+                args.outfile, pair=args.pair, debug=args.debug, jobs=args.jobs, rate=args.rate,
+                api_url=args.api_url)
+            print('repaired: added {} rows, {} gaps left'.format(
+                added, len(find_gaps(update_gap_index(args.outfile)))))
+            return
+        generate_historical_csv(
+            args.outfile, pair=args.pair, days_ago=args.days_ago, debug=args.debug,
+            jobs=args.jobs, rate=args.rate, api_url=args.api_url)
+    except HistoryError as e:
+        print('API_ERROR:', e)
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,89 @@
+"""
+Cold start import time of the entry point modes
+
+Each mode imports the modules its code path loads in a fresh interpreter and reports the heavy
+dependencies that got loaded. A light mode fails (exit status 1) when it loads one of HEAVY;
+that is the contract tests/test_importtime.py checks. The best of --repeat import times is
+reported against a budget in milliseconds (excluding interpreter startup, --scale it on slow
+machines) for comparison only: timings depend on the machine, so they never fail a run.
+
+    python -m emabot.importtime
+    python -m emabot.importtime --mode monitor --repeat 10
+"""
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY = ('numpy', 'pandas', 'talib', 'pandas_ta', 'cbpro', 'requests', 'tqdm', 'smtplib')
+# mode -> (modules imported by the mode, heavy modules it may load, reported budget in ms or None)
+MODES = {
+    # emabot --monitor (every 30 minutes per portfolio): ticker (read with urllib, requests is
+    # only loaded by the cbpro clients), buy pickle and monitor log
+    'monitor':(('emabot.bot', 'urllib.request'), (), 75),
+    'fleet-monitor':(('emabot.bot', 'emabot.fleet', 'urllib.request'), (), 75),
+    'dumppickle':(('emabot.dumppickle',), (), 25),
+    'journal':(('emabot.journal',), (), 25),
+    'backtest-results':(('emabot.backtest', 'emabot.results'), (), 100),
+    # Deciding and backtesting need the numeric stack, reported for comparison
+    'trade':(('emabot.bot', 'emabot.fleet', 'emabot.history', 'emabot.decider', 'talib',
+        'cbpro'), HEAVY, None),
+    'backtest':(('emabot.backtest', 'emabot.backtests.ema'), HEAVY, None),
+}
+REPEAT = 5
+
+_CHILD = """
+import sys, time, json, importlib
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+print(json.dumps({'ms':(time.perf_counter() - start) * 1000.0, 'modules':sorted(sys.modules)}))
+"""
+
+
+def measure(modules: tuple, python: str = sys.executable) -> tuple:
+    """(milliseconds, loaded module names) of importing modules in a fresh interpreter"""
+    proc = subprocess.run([python, '-c', _CHILD] + list(modules), check=True,
+        stdout=subprocess.PIPE, universal_newlines=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    return (result['ms'], set(result['modules']))
+
+def check(mode: str, repeat: int = REPEAT, scale: float = 1.0) -> dict:
+    """Best import time of a mode, the heavy modules it loaded and whether it loaded only allowed
+    ones ('ok'); 'slow' reports a best time over the scaled budget
+    """
+    (modules, allowed, budget) = MODES[mode]
+    best = None
+    for _ in range(repeat):
+        (msec, loaded) = measure(modules)
+        best = msec if best is None else min(best, msec)
+    heavy = [name for name in HEAVY if name in loaded]
+    unexpected = [name for name in heavy if name not in allowed]
+    return {'mode':mode, 'ms':round(best, 1),
+        'budget_ms':None if budget is None else round(budget * scale, 1),
+        'heavy':heavy, 'unexpected':unexpected, 'ok':not unexpected,
+        'slow':budget is not None and best > budget * scale}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m emabot.importtime')
+    parser.add_argument('--mode', help='Only these modes (default: all)', dest='modes',
+        action='append', choices=list(MODES))
+    parser.add_argument('--repeat', help='Runs per mode, the best one counts (default:{})'.format(
+        REPEAT), dest='repeat', default=REPEAT, type=int)
+    parser.add_argument('--scale', help='Multiply the reported budgets, e.g. 2 on a slow machine',
+        dest='scale', default=1.0, type=float)
+    args = parser.parse_args(argv)
+    failed = []
+    for mode in args.modes or MODES:
+        result = check(mode, repeat=args.repeat, scale=args.scale)
+        print('{:<18} {:>8.1f}ms  budget={:<8} heavy={}{}{}'.format(
+            mode, result['ms'], '-' if result['budget_ms'] is None else result['budget_ms'],
+            ','.join(result['heavy']) or '-', '  (slow)' if result['slow'] else '',
+            '' if result['ok'] else '  FAIL'))
+        if not result['ok']:
+            failed.append(mode)
+    if failed:
+        sys.exit('loading heavy modules: {}'.format(', '.join(failed)))
+
+if __name__ == '__main__':
+    main()
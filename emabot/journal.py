@@ -0,0 +1,189 @@
+"""Structured event journal of the bot (JSON lines), next to the text log.
+
+Each bot appends typed events (decisions, orders, settlements, profits) to
+<log_dir>/<name>-events.jsonl. Events are buffered and written in batches; the ones a restart
+must not lose (orders, settlements, profits) are fsynced right away.
+
+Queries go through an index (<journal>.idx) of the pairs and the byte range of each date. Like
+the history gap index it is brought up to date from the offset it has scanned to, so writers
+never touch it:
+
+    python -m emabot.journal log/*-events.jsonl --pair ETH-USD --since 2022-01-01 --event profit
+"""
+import os
+import json
+import time
+import argparse
+import datetime
+import threading
+from decimal import Decimal
+
+INDEX_VERSION = 1
+# Events buffered before a write
+BUFFER_EVENTS = 64
+
+def _decimal(value) -> str:
+    """Exact amounts are kept as strings"""
+    return str(Decimal(str(value)))
+
+# Event -> field -> type
+EVENTS = {
+    'decision':{'emaA':float, 'emaB':float, 'decision':str, 'close':float, 'price':_decimal,
+        'action':str},
+    'order':{'side':str, 'order_id':str, 'price':_decimal, 'funds':_decimal, 'size':_decimal},
+    'settled':{'side':str, 'order_id':str, 'filled_size':_decimal, 'executed_value':_decimal,
+        'fill_fees':_decimal, 'status':str},
+    'profit':{'buy_price':_decimal, 'sell_price':_decimal, 'profit':_decimal,
+        'percent_change':float},
+    'settlement_timeout':{'order_id':str, 'error':str},
+}
+
+
+class Journal:
+    """Buffered, thread safe JSON-lines event writer
+
+    context (e.g. name, pair, dryrun) is added to every event.
+    """
+    def __init__(self, path: str, buffer: int = BUFFER_EVENTS, **context):
+        self.path = path
+        self.buffer = buffer
+        self.context = context
+        self._lines = []
+        self._fd = None
+        self.lock = threading.Lock()
+
+    def record(self, event: str, sync: bool = False, **fields) -> dict:
+        """Add an event, sync=True writes and fsyncs it (with the buffered ones) right away"""
+        types = EVENTS[event]
+        unknown = set(fields) - set(types)
+        if unknown:
+            raise ValueError('unknown {} fields: {}'.format(event, ', '.join(sorted(unknown))))
+        now = time.time()
+        entry = {'time':round(now, 3),
+            'date':datetime.datetime.utcfromtimestamp(now).strftime('%Y-%m-%d'), 'event':event}
+        entry.update(self.context)
+        for (name, value) in fields.items():
+            entry[name] = None if value is None else types[name](value)
+        with self.lock:
+            self._lines.append(json.dumps(entry, separators=(',', ':')) + '\n')
+            if sync:
+                self._write(fsync=True)
+            elif len(self._lines) >= self.buffer:
+                self._write()
+        return entry
+
+    def _write(self, fsync: bool = False) -> None:
+        if self._fd is None:
+            self._fd = open(self.path, 'a')
+        if self._lines:
+            self._fd.write(''.join(self._lines))
+            self._lines = []
+        self._fd.flush()
+        if fsync:
+            os.fsync(self._fd.fileno())
+
+    def flush(self) -> None:
+        with self.lock:
+            if self._lines:
+                self._write()
+
+    def sync(self) -> None:
+        with self.lock:
+            self._write(fsync=True)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._lines:
+                self._write()
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+
+
+def index_path(path: str) -> str:
+    return path + '.idx'
+
+def update_index(path: str) -> dict:
+    """Bring the index of a journal up to date and return it
+
+    The index holds the pairs of the journal, the [start, end) byte range of each date and the
+    offset scanned up to. Dates are contiguous since events are appended in time order.
+    """
+    try:
+        with open(index_path(path)) as fd:
+            index = json.load(fd)
+        if index.get('version') != INDEX_VERSION or index['size'] > os.path.getsize(path):
+            index = None
+    except (OSError, ValueError):
+        index = None
+    if index is None:
+        index = {'version':INDEX_VERSION, 'size':0, 'pairs':[], 'dates':{}}
+    size = index['size']
+    with open(path, 'rb') as fd:
+        fd.seek(size)
+        for line in fd:
+            if not line.endswith(b'\n'):
+                # Partial last line, still being written
+                break
+            start = size
+            size += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            pair = entry.get('pair')
+            if pair is not None and pair not in index['pairs']:
+                index['pairs'].append(pair)
+            span = index['dates'].setdefault(entry['date'], [start, size])
+            span[1] = size
+    if size != index['size']:
+        index['size'] = size
+        tmp = '{}.tmp.{}'.format(index_path(path), os.getpid())
+        with open(tmp, 'w') as fd:
+            json.dump(index, fd)
+        os.replace(tmp, index_path(path))
+    return index
+
+def query(path: str, pair: str = None, since: str = None, until: str = None,
+        event: str = None):
+    """Yield the events of a journal, filtered by pair, dates (YYYY-MM-DD, inclusive) and event
+
+    Only the byte range of the selected dates is read.
+    """
+    index = update_index(path)
+    if pair is not None and pair not in index['pairs']:
+        return
+    spans = [span for (date, span) in index['dates'].items()
+        if (since is None or date >= since) and (until is None or date <= until)]
+    if not spans:
+        return
+    (start, end) = (min(i[0] for i in spans), max(i[1] for i in spans))
+    with open(path, 'rb') as fd:
+        fd.seek(start)
+        for line in fd.read(end - start).splitlines():
+            entry = json.loads(line)
+            if pair is not None and entry.get('pair') != pair:
+                continue
+            if event is not None and entry['event'] != event:
+                continue
+            if (since is not None and entry['date'] < since) or (
+                    until is not None and entry['date'] > until):
+                continue
+            yield entry
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m emabot.journal')
+    parser.add_argument('journals', nargs='+', help='Journal files (<log_dir>/<name>-events.jsonl)')
+    parser.add_argument('--pair', help='Only events of this pair', dest='pair')
+    parser.add_argument('--since', help='First date (YYYY-MM-DD)', dest='since')
+    parser.add_argument('--until', help='Last date (YYYY-MM-DD)', dest='until')
+    parser.add_argument('--event', help='Only this event ({})'.format(', '.join(EVENTS)),
+        dest='event', choices=list(EVENTS))
+    args = parser.parse_args(argv)
+    for path in args.journals:
+        for entry in query(path, pair=args.pair, since=args.since, until=args.until,
+                event=args.event):
+            print(json.dumps(entry))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Append-only binary monitor log (<buy>.monitor) of the percent change of a held position.
+
+Layout: a HEADER header caching the record count and the running max/min percent change,
+followed by RECORD records (int64 timestamp, float64 percent change), all little-endian. A monitor
+tick reads the header, writes one record and rewrites the header in place, so it costs the same
+however long the position has been held. The record is written before the header: a tick
+interrupted in between leaves the previous count, and its record is overwritten by the next.
+
+Plain struct packing keeps numpy out of `emabot --monitor` (see importtime.py).
+
+Logs from older versions (a pickled list of percent changes) are converted when first opened.
+
+Dump a log: python -m emabot.monitorlog data/emabot-eth-buy.pickle.monitor
+"""
+import os
+import math
+import pickle
+import struct
+import argparse
+
+MAGIC = b'EMAMON01'
+VERSION = 1
+# magic, version, count, max, min, first, last and two reserved int64
+HEADER = struct.Struct('<8sqqddqq16x')
+HEADER_FIELDS = ('magic', 'version', 'count', 'max', 'min', 'first', 'last')
+# timestamp, change
+RECORD = struct.Struct('<qd')
+
+
+def _empty_header() -> dict:
+    return {'magic':MAGIC, 'version':VERSION, 'count':0, 'max':math.nan, 'min':math.nan,
+        'first':0, 'last':0}
+
+def _pack_header(header: dict) -> bytes:
+    return HEADER.pack(*(header[i] for i in HEADER_FIELDS))
+
+def _unpack_header(fd):
+    data = fd.read(HEADER.size)
+    if len(data) != HEADER.size:
+        return None
+    return dict(zip(HEADER_FIELDS, HEADER.unpack(data)))
+
+def _convert(path: str) -> None:
+    """Rewrite a pickled list of percent changes (timestamps unknown: 0) as a monitor log"""
+    with open(path, 'rb') as fd:
+        changes = pickle.load(fd)
+    if not isinstance(changes, list):
+        raise ValueError('{} is not a monitor log'.format(path))
+    header = _empty_header()
+    if changes:
+        header['count'] = len(changes)
+        header['max'] = float(max(changes))
+        header['min'] = float(min(changes))
+    tmp = '{}.tmp.{}'.format(path, os.getpid())
+    with open(tmp, 'wb') as fd:
+        fd.write(_pack_header(header))
+        fd.write(b''.join(RECORD.pack(0, float(i)) for i in changes))
+    os.replace(tmp, path)
+
+def read_header(path: str) -> dict:
+    """Count and running max/min (NaN when empty) of a log, an empty header if it is missing"""
+    if not os.path.exists(path):
+        return _empty_header()
+    with open(path, 'rb') as fd:
+        header = _unpack_header(fd)
+    if header is None or header['magic'] != MAGIC:
+        _convert(path)
+        with open(path, 'rb') as fd:
+            header = _unpack_header(fd)
+    if header['version'] != VERSION:
+        raise ValueError('{}: unsupported monitor log version {}'.format(
+            path, header['version']))
+    return header
+
+def append(path: str, timestamp: int, change: float) -> dict:
+    """Add one record, return the updated header"""
+    header = read_header(path)
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as fd:
+        fd.seek(HEADER.size + header['count'] * RECORD.size)
+        fd.write(RECORD.pack(timestamp, change))
+        fd.truncate()
+        if header['count'] == 0:
+            header['first'] = timestamp
+        header['count'] += 1
+        # NaN (no records yet) never wins, like numpy's fmax/fmin
+        header['max'] = change if math.isnan(header['max']) else max(header['max'], change)
+        header['min'] = change if math.isnan(header['min']) else min(header['min'], change)
+        header['last'] = timestamp
+        fd.seek(0)
+        fd.write(_pack_header(header))
+    return header
+
+def read(path: str, last: int = None) -> list:
+    """(timestamp, change) records of the log (only the last ones when given)"""
+    header = read_header(path)
+    rows = header['count']
+    skip = 0 if last is None else max(0, rows - last)
+    if rows - skip <= 0:
+        return []
+    with open(path, 'rb') as fd:
+        fd.seek(HEADER.size + skip * RECORD.size)
+        return list(RECORD.iter_unpack(fd.read((rows - skip) * RECORD.size)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m emabot.monitorlog')
+    parser.add_argument('path', help='Monitor log (<buy pickle>.monitor)')
+    parser.add_argument('--last', help='Only the last N records', dest='last', type=int)
+    args = parser.parse_args(argv)
+    header = read_header(args.path)
+    print('count={} max={} min={}'.format(header['count'], header['max'], header['min']))
+    for (timestamp, change) in read(args.path, last=args.last):
+        print(timestamp, change)
+
+if __name__ == '__main__':
+    main()
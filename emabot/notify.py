@@ -0,0 +1,159 @@
+"""
+Background email notifications
+
+send() only queues a mail. A worker thread delivers the queue over one reused SMTP session per
+mail host, so a slow or broken relay never delays (or crashes) order handling. Mails sharing a
+digest key (e.g. MONITOR-WARNING from every bot of a fleet) that are queued within `window`
+seconds of each other are sent as one digest per recipient. Pending mails are delivered at exit.
+"""
+import time
+import queue
+import atexit
+import logging
+import smtplib
+import threading
+
+# Seconds to gather mails before sending, so bursts end up in one digest
+WINDOW = 5.0
+# Seconds close() waits for the queue to be delivered
+CLOSE_TIMEOUT = 60.0
+
+logger = logging.getLogger('emabot')
+
+
+class Notifier:
+    """Queue of mails delivered by a background thread
+
+    smtp is the SMTP class (host may be host:port), e.g. to deliver to a local sink in tests.
+    """
+    def __init__(self, window: float = WINDOW, smtp=smtplib.SMTP):
+        self.window = window
+        self.smtp = smtp
+        self.sent = 0
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._sessions = {}
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def send(self, host: str, sender: str, recipients: list, subject: str, body: str = '',
+            digest: str = None) -> None:
+        """Queue a mail to each recipient, digest groups it with others of the same key"""
+        for recipient in recipients:
+            if recipient.strip():
+                self._queue.put((host, sender, recipient.strip(), subject, body, digest))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued mail was handled, False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout: float = CLOSE_TIMEOUT) -> None:
+        """Deliver what is queued (without waiting for the digest window) and end the sessions"""
+        if not self._thread.is_alive():
+            return
+        self._closing.set()
+        self.flush(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _gather(self) -> list:
+        """Block for a mail, then gather the ones queued within the window; None to stop"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.window
+        while True:
+            wait = 0 if self._closing.is_set() else deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if item is None:
+                # Stop after this batch
+                self._queue.task_done()
+                self._queue.put(None)
+                return batch
+            batch.append(item)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._gather()
+            if batch is None:
+                self._queue.task_done()
+                break
+            try:
+                for mail in self._digest(batch):
+                    self._deliver(*mail)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+        for session in self._sessions.values():
+            try:
+                session.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+        self._sessions = {}
+
+    @staticmethod
+    def _digest(batch: list) -> list:
+        """(host, sender, recipient, subject, body) mails, digests merged in order of arrival"""
+        mails = []
+        digests = {}
+        for (host, sender, recipient, subject, body, digest) in batch:
+            if digest is None:
+                mails.append([host, sender, recipient, subject, body or subject])
+                continue
+            key = (host, sender, recipient, digest)
+            if key not in digests:
+                digests[key] = [host, sender, recipient, [], []]
+                mails.append(digests[key])
+            digests[key][3].append(subject)
+            digests[key][4].append('{}\n{}'.format(subject, body) if body else subject)
+        for key, mail in digests.items():
+            (subjects, bodies) = (mail[3], mail[4])
+            if len(subjects) == 1:
+                (mail[3], mail[4]) = (subjects[0], bodies[0])
+            else:
+                mail[3] = '{} digest: {} notifications'.format(key[3], len(subjects))
+                mail[4] = '\n\n'.join(bodies)
+        return mails
+
+    def _deliver(self, host: str, sender: str, recipient: str, subject: str, body: str) -> None:
+        msg = "From: %s\r\nTo: %s\r\nSubject: %s\r\n\r\n%s" % (sender, recipient, subject, body)
+        for _ in range(2):
+            try:
+                if host not in self._sessions:
+                    self._sessions[host] = self.smtp(host)
+                self._sessions[host].sendmail(sender, recipient, msg.encode('utf-8'))
+                self.sent += 1
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError) as err:
+                # Stale or broken session, reconnect once
+                self._sessions.pop(host, None)
+                error = err
+            except Exception as err: # pylint: disable=broad-except
+                # Rejected by the server (or not sendable), retrying will not help
+                error = err
+                break
+        self.failed += 1
+        logger.error('notify: mail to %s failed (%s): %s', recipient, error, subject)
+
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_notifier() -> Notifier:
+    """The notifier shared by every bot of the process"""
+    global _default # pylint: disable=global-statement
+    with _default_lock:
+        if _default is None:
+            _default = Notifier()
+        return _default
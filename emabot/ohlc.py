@@ -0,0 +1,384 @@
+"""OHLC history loading shared by the bot and the backtester.
+
+Parsing a multi-million row CSV dominates startup, so read_csv() keeps a columnar sidecar
+cache next to the CSV (<csv>.cache/) holding one raw, memory-mappable file per column plus a
+meta.json. The cache is reused while the CSV size and mtime match. When rows are only
+appended to the CSV, just the new tail is parsed and appended to the column files.
+
+The cache also holds a resample pyramid (resample/<rule>.npy): the close price of every resample
+bin for DEFAULT_RULES and any other rule that was asked for. Bins are extended incrementally
+when candles are appended, so strategies don't have to resample millions of 1m rows per run.
+
+Binary candle stores (*.candles, see candles.py) are read the same way. Their records are
+memory-mapped directly, the cache dir only holds meta.json and the pyramid.
+"""
+import os
+import io
+import re
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from . import candles
+
+CACHE_SUFFIX = '.cache'
+CACHE_VERSION = 2
+# Bytes of the CSV start and of the last consumed line kept to detect rewrites vs appends
+HEAD_BYTES = 256
+# Resample rules kept up to date whenever the cache is built or extended
+DEFAULT_RULES = ('1h', '4h', '12h', '1D', '2D')
+# Rows per chunk when parsing files that are not cached
+CHUNK_ROWS = 250000
+FLOAT_COLUMNS = ('low', 'high', 'open', 'close', 'volume')
+PYRAMID_DTYPE = np.dtype([('timestamp', '<i8'), ('close', '<f8')])
+
+
+def cache_dir(csv_path: str) -> str:
+    return csv_path + CACHE_SUFFIX
+
+def is_cacheable(csv_path: str) -> bool:
+    return not csv_path.endswith('.gz')
+
+@contextmanager
+def _locked(path: str):
+    """Exclusive lock on a cache dir for writers"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path: str, data: dict) -> None:
+    tmp = '{}.tmp.{}'.format(path, os.getpid())
+    with open(tmp, 'w') as fd:
+        json.dump(data, fd)
+    os.replace(tmp, path)
+
+def _read_meta(path: str) -> dict:
+    meta = _read_json(os.path.join(path, 'meta.json'))
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+def _is_fresh(meta: dict, st: os.stat_result) -> bool:
+    return meta is not None and meta['size'] == st.st_size and meta['mtime_ns'] == st.st_mtime_ns
+
+def _is_append(meta: dict, csv_path: str, st: os.stat_result) -> bool:
+    """True if the CSV only grew since the cache was written (same head, same last line)"""
+    if meta is None or st.st_size < meta['offset']:
+        return False
+    head = meta['head'].encode('latin-1')
+    tail = meta['tail'].encode('latin-1')
+    with open(csv_path, 'rb') as fd:
+        if fd.read(len(head)) != head:
+            return False
+        fd.seek(meta['offset'] - len(tail))
+        return fd.read(len(tail)) == tail
+
+def _parse(data: bytes, columns: list = None) -> pd.DataFrame:
+    """Parse complete CSV lines. Without columns the first line is the header."""
+    if columns is None:
+        df = pd.read_csv(io.BytesIO(data))
+    else:
+        df = pd.read_csv(io.BytesIO(data), header=None, names=columns)
+    df = df.dropna(subset=['timestamp'])
+    df['timestamp'] = df['timestamp'].astype(np.int64)
+    return df
+
+def _complete_lines(data: bytes) -> bytes:
+    return data[:data.rfind(b'\n') + 1]
+
+def _last_line(data: bytes) -> bytes:
+    return data[data.rfind(b'\n', 0, len(data) - 1) + 1:]
+
+def _update_candles(csv_path: str, path: str, meta: dict, st: os.stat_result) -> dict:
+    """_update() for a candle store: nothing to parse, just record what is there"""
+    append = _is_append(meta, csv_path, st)
+    rows = candles.count(csv_path)
+    size = candles.CANDLE_DTYPE.itemsize
+    offset = candles.HEADER_DTYPE.itemsize + rows * size
+    with open(csv_path, 'rb') as fd:
+        head = fd.read(min(offset, candles.HEADER_DTYPE.itemsize + size))
+        fd.seek(offset - (size if rows else 0))
+        tail = fd.read(size if rows else 0)
+    meta = {
+        'version':CACHE_VERSION,
+        'format':'candles',
+        'build':meta['build'] if append else time.time_ns(),
+        'size':st.st_size,
+        'mtime_ns':st.st_mtime_ns,
+        'offset':offset,
+        'rows':rows,
+        'columns':list(candles.COLUMNS),
+        'dtypes':{c:candles.CANDLE_DTYPE[c].str for c in candles.COLUMNS},
+        'head':head.decode('latin-1'),
+        'tail':tail.decode('latin-1'),
+    }
+    _write_json(os.path.join(path, 'meta.json'), meta)
+    pyramid = _read_json(os.path.join(path, 'resample', 'index.json')) or {}
+    _update_pyramid(path, meta, set(DEFAULT_RULES) | set(pyramid))
+    return meta
+
+def _update(csv_path: str, path: str, meta: dict, st: os.stat_result) -> dict:
+    """Rebuild or extend the cache. Caller holds the lock."""
+    if candles.is_candle_file(csv_path):
+        return _update_candles(csv_path, path, meta, st)
+    append = _is_append(meta, csv_path, st)
+    with open(csv_path, 'rb') as fd:
+        if append:
+            fd.seek(meta['offset'])
+        data = _complete_lines(fd.read())
+    if append:
+        offset = meta['offset'] + len(data)
+        columns = meta['columns']
+        df = _parse(data, columns) if data else pd.DataFrame(columns=columns)
+        rows = meta['rows']
+        head = meta['head'].encode('latin-1')
+        build = meta['build']
+    else:
+        offset = len(data)
+        df = _parse(data)
+        columns = list(df.columns)
+        rows = 0
+        head = data[:HEAD_BYTES]
+        # Identifies this build so derived data (the pyramid) knows it can't be extended
+        build = time.time_ns()
+    tail = _last_line(data) if data else meta['tail'].encode('latin-1')
+    dtypes = {c:('<i8' if c == 'timestamp' else '<f8') for c in columns}
+    for column in columns:
+        with open(os.path.join(path, column + '.bin'), 'ab') as fd:
+            # Drop anything past the last committed row (e.g. an interrupted append)
+            fd.truncate(rows * np.dtype(dtypes[column]).itemsize)
+            fd.write(np.ascontiguousarray(df[column].values, dtype=dtypes[column]).tobytes())
+    meta = {
+        'version':CACHE_VERSION,
+        'build':build,
+        'size':st.st_size,
+        'mtime_ns':st.st_mtime_ns,
+        'offset':offset,
+        'rows':rows + len(df),
+        'columns':columns,
+        'dtypes':dtypes,
+        'head':head.decode('latin-1'),
+        'tail':tail.decode('latin-1'),
+    }
+    _write_json(os.path.join(path, 'meta.json'), meta)
+    pyramid = _read_json(os.path.join(path, 'resample', 'index.json')) or {}
+    _update_pyramid(path, meta, set(DEFAULT_RULES) | set(pyramid))
+    return meta
+
+def _memmap_columns(path: str, meta: dict) -> dict:
+    if meta.get('format') == 'candles':
+        # Zero-copy field views of the store's records
+        records = candles.read(path[:-len(CACHE_SUFFIX)], meta['rows'])
+        return {column:records[column] for column in meta['columns']}
+    columns = {}
+    for column in meta['columns']:
+        dtype = np.dtype(meta['dtypes'][column])
+        if meta['rows'] == 0:
+            columns[column] = np.empty(0, dtype=dtype)
+            continue
+        columns[column] = np.memmap(
+            os.path.join(path, column + '.bin'), dtype=dtype, mode='r', shape=(meta['rows'],))
+    return columns
+
+def _valid_rows(columns: dict, start: int = 0) -> np.ndarray:
+    """Mask of rows from start on without NaNs (the rows BacktestBase keeps after dropna)"""
+    mask = np.ones(len(columns['timestamp']) - start, dtype=bool)
+    for (name, values) in columns.items():
+        if values.dtype.kind == 'f':
+            mask &= ~np.isnan(values[start:])
+    return mask
+
+def _resample(timestamps: np.ndarray, close: np.ndarray, rule: str, origin: int) -> np.ndarray:
+    """Last close per bin, same bins as df.resample(rule).ohlc()['close']['close']"""
+    # Plain writable copies: pandas < 2 can't convert read-only (memmap) buffers
+    series = pd.Series(np.array(close, dtype=np.float64),
+        index=pd.to_datetime(np.array(timestamps, dtype=np.int64), unit='s'))
+    bins = series.resample(rule, origin=pd.Timestamp(origin, unit='s')).last()
+    result = np.empty(len(bins), dtype=PYRAMID_DTYPE)
+    result['timestamp'] = bins.index.values.astype('datetime64[s]').astype(np.int64)
+    result['close'] = bins.values
+    return result
+
+def _left_closed(rule: str) -> bool:
+    """Bins are closed (and labelled) on the left, i.e. a bin is labelled by its first minute
+
+    Rules pandas closes on the right (W, M, Q, A...) are labelled by their end and (above daily)
+    have their edges moved to the end of that day, so they are always rebuilt instead of
+    extended.
+    """
+    return pd.Grouper(freq=rule).closed != 'right'
+
+def _pyramid_path(path: str, rule: str) -> str:
+    return os.path.join(path, 'resample', re.sub(r'[^A-Za-z0-9]', '_', rule) + '.npy')
+
+def _update_pyramid(path: str, meta: dict, rules: set) -> dict:
+    """Build or extend the resample bins for rules. Caller holds the lock."""
+    os.makedirs(os.path.join(path, 'resample'), exist_ok=True)
+    index_path = os.path.join(path, 'resample', 'index.json')
+    index = _read_json(index_path) or {}
+    columns = _memmap_columns(path, meta)
+    timestamps = columns['timestamp']
+    for rule in rules:
+        entry = index.get(rule)
+        if entry and entry['build'] == meta['build'] and entry['rows'] == meta['rows']:
+            continue
+        bins = None
+        if (entry and entry['build'] == meta['build'] and entry['rows'] < meta['rows']
+                and _left_closed(rule)):
+            bins = np.load(_pyramid_path(path, rule))
+        if bins is not None and len(bins):
+            # Only the last stored bin can still change, recompute from its start on
+            start = int(np.searchsorted(timestamps, bins['timestamp'][-1]))
+            origin = entry['origin']
+            mask = _valid_rows(columns, start)
+            tail = _resample(
+                timestamps[start:][mask], columns['close'][start:][mask], rule, origin)
+            bins = np.concatenate([bins[:-1], tail])
+        else:
+            mask = _valid_rows(columns)
+            valid = timestamps[mask]
+            # Same as pandas' default origin='start_day'
+            origin = int(valid[0]) // 86400 * 86400 if len(valid) else 0
+            bins = _resample(valid, columns['close'][mask], rule, origin)
+        tmp = '{}.tmp.{}.npy'.format(_pyramid_path(path, rule), os.getpid())
+        np.save(tmp, bins)
+        os.replace(tmp, _pyramid_path(path, rule))
+        index[rule] = {'rows':meta['rows'], 'build':meta['build'], 'origin':origin}
+    _write_json(index_path, index)
+    return index
+
+def _refresh(csv_path: str) -> tuple:
+    """Return (cache dir, meta), rebuilding or extending the cache if the CSV changed"""
+    path = cache_dir(csv_path)
+    st = os.stat(csv_path)
+    meta = _read_meta(path)
+    if not _is_fresh(meta, st):
+        with _locked(path):
+            # Another process may have refreshed the cache while we waited
+            meta = _read_meta(path)
+            st = os.stat(csv_path)
+            if not _is_fresh(meta, st):
+                meta = _update(csv_path, path, meta, st)
+    return (path, meta)
+
+def read_columns(csv_path: str) -> dict:
+    """Return {column: read-only memmap array} for the CSV, refreshing the cache if needed"""
+    (path, meta) = _refresh(csv_path)
+    return _memmap_columns(path, meta)
+
+def row_count(csv_path: str) -> int:
+    """Rows in the cache (records for a candle store, including NaN ones)"""
+    (path, meta) = _refresh(csv_path)
+    return meta['rows']
+
+def read_rows(csv_path: str, start: int, stop: int, usecols: list = None,
+        float_dtype=None) -> pd.DataFrame:
+    """Cache rows start:stop as read_csv() would return them, only that slice is loaded"""
+    columns = {name:values[start:stop] for (name, values) in read_columns(csv_path).items()}
+    return _select(columns, usecols, float_dtype, valid=candles.is_candle_file(csv_path))
+
+def build_id(csv_path: str) -> int:
+    """Changes whenever the cache had to be rebuilt instead of extended"""
+    (path, meta) = _refresh(csv_path)
+    return meta['build']
+
+def fingerprint(csv_path: str) -> str:
+    """Identifies the cached dataset contents (changes on rebuild and on every append)"""
+    (path, meta) = _refresh(csv_path)
+    return '{}-{}'.format(meta['build'], meta['rows'])
+
+def resample_bins(csv_path: str, rule: str) -> np.ndarray:
+    """Memory-mapped (timestamp, close) records of the resample pyramid for rule"""
+    (path, meta) = _refresh(csv_path)
+    entry = (_read_json(os.path.join(path, 'resample', 'index.json')) or {}).get(rule)
+    if not entry or entry['build'] != meta['build'] or entry['rows'] != meta['rows']:
+        with _locked(path):
+            _update_pyramid(path, meta, {rule})
+    return np.load(_pyramid_path(path, rule), mmap_mode='r')
+
+def resample_close(csv_path: str, rule: str) -> pd.Series:
+    """Close price per resample bin, equal to
+    df.resample(rule).ohlc()['close']['close'] on the NaN-free 1m rows of the CSV
+    """
+    bins = resample_bins(csv_path, rule)
+    return pd.Series(
+        np.array(bins['close'], dtype=np.float64),
+        index=pd.to_datetime(np.array(bins['timestamp'], dtype=np.int64), unit='s'), name='close')
+
+def _select(columns: dict, usecols, float_dtype, valid: bool = False) -> pd.DataFrame:
+    """Frame of usecols, without the rows _valid_rows() masks if valid or columns are left out"""
+    mask = None
+    if valid or usecols is not None:
+        mask = _valid_rows(columns)
+    if usecols is not None:
+        columns = {name:values for (name, values) in columns.items() if name in usecols}
+    df = pd.DataFrame(columns)
+    if mask is not None:
+        df = df[mask].reset_index(drop=True)
+    if float_dtype is not None:
+        df = df.astype({name:float_dtype for name in df.columns if name != 'timestamp'})
+    return df
+
+def _read_chunked(csv_path: str, usecols, float_dtype, chunksize: int) -> pd.DataFrame:
+    """pd.read_csv() in chunks (also for .gz) keeping only usecols, as float_dtype"""
+    dtype = None
+    if float_dtype is not None:
+        dtype = {name:float_dtype for name in FLOAT_COLUMNS}
+    parse = usecols
+    if usecols is not None:
+        # The price/volume columns are parsed too for the NaN mask, see _select()
+        parse = lambda name: name in usecols or name in FLOAT_COLUMNS
+    parts = {}
+    for chunk in pd.read_csv(csv_path, usecols=parse, dtype=dtype, chunksize=chunksize):
+        if usecols is not None:
+            chunk = chunk.loc[chunk.notna().all(axis=1).values, list(usecols)]
+        for name in chunk.columns:
+            parts.setdefault(name, []).append(chunk[name].values)
+    if not parts:
+        return pd.read_csv(csv_path, usecols=usecols, dtype=dtype)
+    return pd.DataFrame({name:np.concatenate(values) for (name, values) in parts.items()})
+
+def read_csv(csv_path: str, cache: bool = True, usecols: list = None, float_dtype=None,
+        chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+    """Drop-in replacement for pd.read_csv(csv_path) on an OHLC history file
+
+    Expects form:
+        "timestamp","low","high","open","close","volume"
+
+    usecols limits the columns that are loaded and float_dtype (e.g. np.float32) sets the dtype
+    of the price/volume columns. Files that can't be cached (.gz) are parsed in chunks of
+    chunksize rows so only the selected columns are ever held in memory.
+
+    When columns are left out, rows with a NaN in any price/volume column are still dropped, so
+    dropna() on the result keeps the same rows as on the full frame (and as the resample pyramid).
+
+    For a candle store the NaN records of minutes without a candle are left out, giving the
+    rows the CSV would have.
+    """
+    if candles.is_candle_file(csv_path):
+        try:
+            columns = read_columns(csv_path) if cache else None
+        except OSError:
+            columns = None
+        if columns is None:
+            records = candles.read(csv_path)
+            columns = {column:records[column] for column in candles.COLUMNS}
+        return _select(columns, usecols, float_dtype, valid=True)
+    if not cache or not is_cacheable(csv_path):
+        return _read_chunked(csv_path, usecols, float_dtype, chunksize)
+    try:
+        columns = read_columns(csv_path)
+    except OSError:
+        # e.g. read-only directory, just parse the CSV
+        return _read_chunked(csv_path, usecols, float_dtype, chunksize)
+    return _select(columns, usecols, float_dtype)
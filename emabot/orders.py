@@ -0,0 +1,152 @@
+"""
+Order settlement watcher
+
+Placed market orders are polled on one background thread until they settle, fast at first and
+then slower, up to a deadline. Each watched order gets a Future, so several bots (see fleet.py)
+can wait on their own orders while a single thread does the polling. Push input (e.g. websocket
+"done" messages) can be passed to feed() to poll an order right away.
+"""
+import time
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+# Seconds between the polls of an order (the last one repeats)
+DELAYS = (0.5, 0.5, 1, 1, 2, 3, 5)
+# Seconds an order gets to settle
+DEADLINE = 600
+
+
+class SettlementTimeout(Exception):
+    """An order did not settle before its deadline"""
+
+
+class _Order:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('order_id', 'get_order', 'deadline', 'future', 'polls', 'due', 'error')
+
+    def __init__(self, order_id, get_order, deadline, future):
+        self.order_id = order_id
+        self.get_order = get_order
+        self.deadline = deadline
+        self.future = future
+        self.polls = 0
+        self.due = None
+        self.error = None
+
+
+class SettlementWatcher:
+    """Tracks outstanding orders and resolves their futures with the settled order"""
+    def __init__(self, delays: tuple = DELAYS, clock=time.monotonic):
+        self.delays = delays
+        self.clock = clock
+        self._orders = {}
+        # (when, seq, order_id), entries that no longer match the order's due time are skipped
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def watch(self, order_id: str, get_order, deadline: float = DEADLINE,
+            callback=None) -> Future:
+        """Poll get_order(order_id) until the order settles, at most deadline seconds
+
+        The future's result is the settled order, SettlementTimeout when the deadline passes.
+        callback(future) is called once it is done.
+        """
+        with self._cond:
+            order = self._orders.get(order_id)
+            if order is None:
+                order = _Order(order_id, get_order, self.clock() + deadline, Future())
+                self._orders[order_id] = order
+                self._schedule(order, self.delays[0])
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='settlement-watcher', daemon=True)
+                    self._thread.start()
+                self._cond.notify()
+        if callback is not None:
+            order.future.add_done_callback(callback)
+        return order.future
+
+    def cancel(self, order_id: str) -> bool:
+        """Stop watching order_id (its future is cancelled)"""
+        with self._cond:
+            order = self._orders.pop(order_id, None)
+        return order is not None and order.future.cancel()
+
+    def feed(self, message: dict) -> None:
+        """Push input: poll the message's order (order_id or id) now instead of at its next turn"""
+        order_id = message.get('order_id') or message.get('id')
+        with self._cond:
+            order = self._orders.get(order_id)
+            if order is not None:
+                self._schedule(order, 0)
+                self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._orders)
+
+    def _schedule(self, order: _Order, delay: float) -> None:
+        order.due = self.clock() + delay
+        heapq.heappush(self._queue, (order.due, next(self._seq), order.order_id))
+
+    def _next(self):
+        """Wait for the next due order, None (and the thread ends) once nothing is watched"""
+        with self._cond:
+            while True:
+                if not self._orders:
+                    self._thread = None
+                    return None
+                (when, _, order_id) = self._queue[0]
+                order = self._orders.get(order_id)
+                if order is None or order.due != when or order.future.cancelled():
+                    heapq.heappop(self._queue)
+                    if order is not None and order.future.cancelled():
+                        del self._orders[order_id]
+                    continue
+                wait = when - self.clock()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+                return order
+
+    def _run(self) -> None:
+        while True:
+            order = self._next()
+            if order is None:
+                return
+            self._poll(order)
+
+    def _poll(self, order: _Order) -> None:
+        try:
+            result = order.get_order(order.order_id)
+        except Exception as err: # pylint: disable=broad-except
+            # e.g. the order is not visible yet, keep polling until the deadline
+            (result, order.error) = (None, err)
+        (value, error) = (None, None)
+        with self._cond:
+            if self._orders.get(order.order_id) is not order:
+                # Cancelled while polling
+                return
+            if result and result.get('settled'):
+                value = result
+            elif self.clock() >= order.deadline:
+                error = SettlementTimeout('order {} did not settle in time (polls={} error={})'.format(
+                    order.order_id, order.polls + 1, order.error))
+            else:
+                order.polls += 1
+                delay = self.delays[min(order.polls, len(self.delays) - 1)]
+                self._schedule(order, max(0, min(delay, order.deadline - self.clock())))
+                return
+            del self._orders[order.order_id]
+        # Outside the lock, done callbacks may watch other orders
+        if order.future.cancelled():
+            return
+        if error is not None:
+            order.future.set_exception(error)
+        else:
+            order.future.set_result(value)
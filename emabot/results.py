@@ -0,0 +1,206 @@
+"""SQLite store for backtest results (replaces the TinyDB backtests/db.json).
+
+One row per backtest run with indexed parameter columns, so results can be recorded by many
+concurrent processes (WAL mode, short transactions) and ranked without loading everything.
+`backtest results` queries it.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from tabulate import tabulate
+from .util import huf
+
+DEFAULT_DB = 'backtests/results.sqlite3'
+
+COLUMNS = (
+    ('created', 'REAL'),
+    ('csv_file', 'TEXT'),
+    ('pair', 'TEXT'),
+    ('strategy', 'TEXT'),
+    ('ema_a', 'INTEGER'),
+    ('ema_b', 'INTEGER'),
+    ('resample', 'TEXT'),
+    ('ledger', 'TEXT'),
+    ('dataset', 'TEXT'),
+    ('fee_total', 'REAL'),
+    ('net_profit_total', 'REAL'),
+    ('net_profit_mean', 'REAL'),
+    ('net_profit_median', 'REAL'),
+    ('percent_total', 'REAL'),
+    ('percent_mean', 'REAL'),
+    ('percent_median', 'REAL'),
+    ('wins', 'INTEGER'),
+    ('losses', 'INTEGER'),
+    ('wallet', 'REAL'),
+    ('day_results', 'TEXT'),
+)
+COLUMN_NAMES = tuple(name for (name, _) in COLUMNS)
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, {})'.format(
+        ', '.join('{} {}'.format(name, kind) for (name, kind) in COLUMNS)),
+    'CREATE INDEX IF NOT EXISTS results_params ON results '
+        '(pair, strategy, ema_a, ema_b, resample)',
+    'CREATE INDEX IF NOT EXISTS results_dataset ON results (dataset)',
+    'CREATE INDEX IF NOT EXISTS results_net_profit ON results (net_profit_total)',
+]
+SORT_COLUMNS = ('net_profit_total', 'percent_mean', 'percent_median', 'wins', 'losses', 'created')
+
+
+def dataset_fingerprint(csv_file: str) -> str:
+    """Identifies the exact dataset a result was computed on"""
+    # Recording a backtest has loaded pandas already, `backtest results` doesn't need it
+    from . import ohlc
+    if ohlc.is_cacheable(csv_file):
+        try:
+            return ohlc.fingerprint(csv_file)
+        except OSError:
+            pass
+    st = os.stat(csv_file)
+    return '{}-{}'.format(st.st_size, st.st_mtime_ns)
+
+def default_pair(csv_file: str) -> str:
+    """e.g. csv/btc-history-1m-ohlc.csv -> btc-history-1m-ohlc"""
+    return os.path.basename(csv_file).split('.csv')[0]
+
+
+class ResultsStore:
+    def __init__(self, path: str = DEFAULT_DB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets readers and one writer work concurrently, writers wait on busy_timeout
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def insert_many(self, records: list) -> None:
+        """Insert result dicts (keys from COLUMN_NAMES) in one transaction"""
+        rows = []
+        for record in records:
+            record = dict(record)
+            record.setdefault('created', time.time())
+            if not isinstance(record.get('day_results'), (str, type(None))):
+                record['day_results'] = json.dumps(record['day_results'])
+            rows.append(tuple(_sql_value(record.get(name)) for name in COLUMN_NAMES))
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.executemany('INSERT INTO results ({}) VALUES ({})'.format(
+                ', '.join(COLUMN_NAMES), ', '.join('?' * len(COLUMN_NAMES))), rows)
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def insert(self, record: dict) -> None:
+        self.insert_many([record])
+
+    def query(self,
+            pair: str = None,
+            strategy: str = None,
+            ema_a: int = None,
+            ema_b: int = None,
+            resample: str = None,
+            dataset: str = None,
+            sort: str = 'net_profit_total',
+            limit: int = None) -> list:
+        """Matching results as dicts, best first by sort"""
+        if sort not in SORT_COLUMNS:
+            raise ValueError('Cannot sort by {}'.format(sort))
+        where = []
+        params = []
+        for (column, value) in (('pair', pair), ('ema_a', ema_a), ('ema_b', ema_b),
+                ('resample', resample), ('dataset', dataset)):
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                params.append(value)
+        if strategy is not None:
+            # Full class path or just the class name
+            where.append("(strategy = ? OR strategy LIKE ?)")
+            params.extend([strategy, '%.' + strategy])
+        sql = 'SELECT * FROM results'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY {} DESC'.format(sort)
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def import_tinydb(self, path: str) -> int:
+        """Import the old backtests/db.json, tables are named emaA-emaB-resample-Strategy-csv"""
+        with open(path) as fd:
+            tables = json.load(fd)
+        records = []
+        for (table_name, table) in tables.items():
+            (ema_a, ema_b, resample, strategy, csv_prefix) = table_name.split('-', 4)
+            for result in table.values():
+                record = {name:result.get(name) for name in COLUMN_NAMES}
+                record.update({
+                    'csv_file':csv_prefix + '.csv',
+                    'pair':default_pair(csv_prefix + '.csv'),
+                    'strategy':strategy,
+                    'ema_a':int(ema_a),
+                    'ema_b':int(ema_b),
+                    'resample':resample,
+                    'ledger':'decimal',
+                })
+                records.append(record)
+        self.insert_many(records)
+        return len(records)
+
+def _sql_value(value):
+    """Decimal/numpy numbers to plain Python numbers"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if hasattr(value, 'item'):
+        return value.item()
+    return float(value)
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(prog='backtest results')
+    parser.add_argument('--db',
+        help='Results database (default:{})'.format(DEFAULT_DB), dest='db', default=DEFAULT_DB)
+    parser.add_argument('--pair', help='Filter by pair/dataset name', dest='pair', default=None)
+    parser.add_argument('--strategy',
+        help='Filter by strategy class or class name', dest='strategy', default=None)
+    parser.add_argument('--ema-a', help='Filter by emaA', dest='ema_a', default=None, type=int)
+    parser.add_argument('--ema-b', help='Filter by emaB', dest='ema_b', default=None, type=int)
+    parser.add_argument('--resample', help='Filter by resample', dest='resample', default=None)
+    parser.add_argument('--dataset',
+        help='Filter by dataset fingerprint', dest='dataset', default=None)
+    parser.add_argument('--sort',
+        help='Sort column, best first (default:net_profit_total)', dest='sort',
+        default='net_profit_total', choices=SORT_COLUMNS)
+    parser.add_argument('--top', help='Show the N best results (default:20)', dest='top',
+        default=20, type=int)
+    parser.add_argument('--import-tinydb',
+        help='Import results from an old TinyDB backtests/db.json', dest='import_tinydb',
+        default=None)
+    args = parser.parse_args(argv)
+    store = ResultsStore(args.db)
+    if args.import_tinydb:
+        count = store.import_tinydb(args.import_tinydb)
+        print('Imported {} results from {}'.format(count, args.import_tinydb))
+        return
+    results = store.query(
+        pair=args.pair, strategy=args.strategy, ema_a=args.ema_a, ema_b=args.ema_b,
+        resample=args.resample, dataset=args.dataset, sort=args.sort, limit=args.top)
+    rows = []
+    for (rank, r) in enumerate(results, 1):
+        rows.append((
+            rank, r['pair'], r['strategy'].split('.')[-1], r['ema_a'], r['ema_b'],
+            r['resample'], r['wins'], r['losses'], huf(r['net_profit_total']),
+            huf(r['percent_mean']), huf(r['percent_median']),
+        ))
+    print(tabulate(rows, tablefmt='fancy_grid', headers=[
+        'Rank', 'Pair', 'Strategy', 'emaA', 'emaB', 'Resample', 'Wins', 'Losses', 'Net Profit',
+        'Monthly Mean Percent', 'Monthly Median Percent']))
+    sys.stdout.flush()
@@ -0,0 +1,166 @@
+"""Parameter sweep entry point: backtest sweep --csv-file ... --ema-a 1-5 --ema-b 2-8 ...
+Fans every (strategy, emaA, emaB, resample) combination out over a process pool. Each worker
+reads the CSV once and reuses the dataframe for all of its combinations; indicators and resampled
+closes come from the dataset's cache (see backtests/indicators.py), so a repeated sweep mostly
+reports cache hits.
+"""
+import os
+import sys
+import argparse
+import itertools
+from multiprocessing import Pool
+from tabulate import tabulate
+from tqdm import tqdm
+from .util import huf, import_class
+from .backtests.base import load_dataframe
+from .backtests import indicators
+from .backtests.ledger import LEDGERS
+from .results import ResultsStore, DEFAULT_DB, dataset_fingerprint, default_pair
+
+# Per-worker dataframe and backtest() options, set by _init_worker()
+_DF = None
+_OPTIONS = {}
+# Indicator cache counts of a combination, (memory, disk, computed)
+CACHE_KEYS = ('memory', 'disk', 'computed')
+
+
+def parse_int_list(value: str) -> list:
+    """Parse "2", "2,3,5" or an inclusive range "2-6" (ranges and lists can be mixed)"""
+    result = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            result.extend(range(int(start), int(end) + 1))
+        else:
+            result.append(int(part))
+    return result
+
+def parse_str_list(value: str) -> list:
+    """Parse a comma separated list"""
+    return [i.strip() for i in value.split(',') if i.strip()]
+
+def _init_worker(csv_file: str, options: dict, columns: tuple) -> None:
+    global _DF, _OPTIONS
+    _DF = load_dataframe(csv_file, columns)
+    # csv_file lets the strategies use the indicator store and the resample pyramid
+    _OPTIONS = dict(options, csv_file=csv_file)
+
+def _columns(strategy: list) -> tuple:
+    """Columns every strategy needs, None if one of them wants them all"""
+    columns = set()
+    for name in strategy:
+        needed = import_class(name).COLUMNS
+        if needed is None:
+            return None
+        columns.update(needed)
+    return tuple(sorted(columns))
+
+def _run_combination(combination: tuple) -> dict:
+    from .backtest import backtest, summarize
+    (strategy, emaA, emaB, resample) = combination
+    before = [indicators.counts[i] for i in CACHE_KEYS]
+    stats = backtest(
+        emaA=emaA, emaB=emaB, resample=resample, df=_DF, progress_bar=False, strategy=strategy,
+        **_OPTIONS)
+    cache = tuple(indicators.counts[i] - j for (i, j) in zip(CACHE_KEYS, before))
+    return dict(summarize(stats), strategy=strategy, emaA=emaA, emaB=emaB, resample=resample,
+        wallet=stats.wallet, cache=cache)
+
+def cache_summary(results: list) -> dict:
+    """Indicator lookups of a sweep served from memory, from disk and computed"""
+    return {key:sum(r['cache'][i] for r in results) for (i, key) in enumerate(CACHE_KEYS)}
+
+def sweep(
+        csv_file: str,
+        ema_a: list,
+        ema_b: list,
+        resample: list,
+        strategy: list,
+        jobs: int = None,
+        progress_bar: bool = True,
+        ledger: str = 'decimal',
+        c2c: bool = False) -> list:
+    """Backtest every combination and return the summaries sorted by net profit (best first)"""
+    combinations = list(itertools.product(strategy, ema_a, ema_b, resample))
+    results = []
+    options = {'ledger':ledger, 'c2c':c2c}
+    with Pool(processes=jobs, initializer=_init_worker, initargs=(csv_file, options, _columns(strategy))) as pool:
+        iterator = pool.imap_unordered(_run_combination, combinations)
+        if progress_bar:
+            iterator = tqdm(iterator, total=len(combinations))
+        for result in iterator:
+            results.append(result)
+    results.sort(key=lambda r: r['net_profit_total'], reverse=True)
+    return results
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(prog='backtest sweep')
+    parser.add_argument('--csv-file',
+        help='Path to OHLC CSV file', dest='csv_file', required=True)
+    parser.add_argument('--resample',
+        help='Comma separated resample sizes (default:1D)', dest='resample', required=False,
+        default='1D')
+    parser.add_argument('--ema-a',
+        help='emaA values as a list and/or range, e.g. 1-4,6 (default:2)', dest='ema_a',
+        required=False, default='2')
+    parser.add_argument('--ema-b',
+        help='emaB values as a list and/or range, e.g. 2-8 (default:3)', dest='ema_b',
+        required=False, default='3')
+    parser.add_argument('--strategy',
+        help='Comma separated strategy classes (see emabot/backtests/)', dest='strategy',
+        required=False, default='emabot.backtests.ema.Ema')
+    parser.add_argument('--jobs',
+        help='Number of worker processes (default:cpu count)', dest='jobs', required=False,
+        default=os.cpu_count(), type=int)
+    parser.add_argument('--top',
+        help='Only show the N best results', dest='top', required=False, default=None, type=int)
+    parser.add_argument('--ledger',
+        help='Wallet arithmetic: decimal (reference), float or fixed (default:decimal)',
+        dest='ledger', required=False, default='decimal', choices=LEDGERS)
+    parser.add_argument('--c2c',
+        help='Coin-to-coin (higher precision)', dest='c2c', action='store_true', required=False)
+    parser.add_argument('--no-progress-bar',
+        help='Disable progress bar', dest='no_progress_bar', action='store_true', required=False)
+    parser.add_argument('--db',
+        help='Results database (default:{})'.format(DEFAULT_DB), dest='db', required=False,
+        default=DEFAULT_DB)
+    parser.add_argument('--pair',
+        help='Name results are stored under (default:CSV file name)', dest='pair',
+        required=False, default=None)
+    args = parser.parse_args(argv)
+    strategies = parse_str_list(args.strategy)
+    ema_a = parse_int_list(args.ema_a)
+    ema_b = parse_int_list(args.ema_b)
+    resamples = parse_str_list(args.resample)
+    print('SWEEP: strategies={} emaA={} emaB={} resample={} jobs={}'.format(
+        len(strategies), ema_a, ema_b, resamples, args.jobs))
+    sys.stdout.flush() # make sure SWEEP outputs before tqdm
+    results = sweep(
+        args.csv_file, ema_a, ema_b, resamples, strategies,
+        jobs=args.jobs, progress_bar=not args.no_progress_bar, ledger=args.ledger, c2c=args.c2c)
+    # All combinations go in with a single transaction
+    dataset = dataset_fingerprint(args.csv_file)
+    pair = args.pair or default_pair(args.csv_file)
+    print('INDICATOR CACHE: {}'.format(' '.join(
+        '{}={}'.format(k, v) for (k, v) in cache_summary(results).items())))
+    store = ResultsStore(args.db)
+    store.insert_many([dict(
+        {k:v for (k, v) in r.items() if k not in ('emaA', 'emaB', 'cache')},
+        csv_file=args.csv_file, pair=pair, ema_a=r['emaA'], ema_b=r['emaB'],
+        ledger=args.ledger, dataset=dataset) for r in results])
+    store.close()
+    if args.top:
+        results = results[:args.top]
+    rows = []
+    for (rank, r) in enumerate(results, 1):
+        rows.append((
+            rank, r['strategy'].split('.')[-1], r['emaA'], r['emaB'], r['resample'],
+            r['wins'], r['losses'], huf(r['net_profit_total']),
+            huf(r['percent_mean']), huf(r['percent_median']), huf(r['wallet']),
+        ))
+    print(tabulate(rows, tablefmt='fancy_grid', headers=[
+        'Rank', 'Strategy', 'emaA', 'emaB', 'Resample', 'Wins', 'Losses', 'Net Profit',
+        'Monthly Mean Percent', 'Monthly Median Percent', 'Wallet']))
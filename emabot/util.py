@@ -1,4 +1,7 @@
+import time
+import threading
 from decimal import Decimal
+import yaml
 
 def huf(f: Decimal):
     return '{:,.2f}'.format(f)
@@ -12,3 +15,41 @@ def import_class(cl: str):
     classname = cl[d+1:len(cl)]
     m = __import__(cl[0:d], globals(), locals(), [classname])
     return getattr(m, classname)
+
+def load_config(path: str) -> dict:
+    """Load a bot yaml config, merging all of its documents"""
+    with open(path) as config_stream:
+        tmp = list(yaml.safe_load_all(config_stream))
+    config = {}
+    for i in tmp:
+        for k,v in i.items():
+            config[k] = v
+    return config
+
+
+class TtlCache:
+    """Thread-safe cache of values for ttl seconds
+
+    Concurrent get() calls for a missing key wait for one load() instead of all loading.
+    """
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._items = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            item = self._items.get(key)
+            if item is not None and self.clock() - item[0] < self.ttl:
+                return item[1]
+            value = load()
+            self._items[key] = (self.clock(), value)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
@@ -28,6 +28,7 @@ setup(
         'console_scripts': [
             'emabot=emabot.bot:main',
             'backtest=emabot.backtest:main',
+            'history=emabot.history:main',
             'dumppickle=emabot.dumppickle:main',
         ],
     },
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+# Midnight UTC, rows on whole minutes like the exchange history
+START = 1599955200
+
+
+def random_walk(count: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return 500.0 * np.exp(np.cumsum(rng.normal(0.0, 0.002, count)))
+
+def write_history(path, closes: np.ndarray, timestamps: np.ndarray = None) -> str:
+    """1m OHLC history CSV (open/high/low/close all close) at path"""
+    if timestamps is None:
+        timestamps = START + np.arange(len(closes)) * 60
+    with open(str(path), 'w') as fd:
+        fd.write('timestamp,low,high,open,close,volume\n')
+        for (timestamp, close) in zip(timestamps.tolist(), closes.tolist()):
+            fd.write('{},{},{},{},{},1.0\n'.format(timestamp, close, close, close, close))
+    return str(path)
+
+
+@pytest.fixture
+def history(tmp_path):
+    """Factory writing a random walk of count minutes to tmp_path/history.csv
+
+    drop removes row positions, e.g. to leave gaps in the history.
+    """
+    def make(count: int, seed: int = 0, drop=None) -> str:
+        closes = random_walk(count, seed=seed)
+        timestamps = START + np.arange(count) * 60
+        if drop is not None:
+            keep = np.ones(count, dtype=bool)
+            keep[drop] = False
+            (closes, timestamps) = (closes[keep], timestamps[keep])
+        return write_history(tmp_path / 'history.csv', closes, timestamps)
+    return make
+
+@pytest.fixture
+def bot_config(tmp_path):
+    """Factory writing a dry-run friendly bot config to tmp_path/etc/<name>.yml"""
+    def make(name: str = 'mkr', pair: str = 'MKR-USD', resample: str = '1h', ema_a: int = 2,
+            ema_b: int = 3, hist_file: str = None) -> str:
+        for i in ('etc', 'log', 'data'):
+            (tmp_path / i).mkdir(exist_ok=True)
+        path = tmp_path / 'etc' / '{}.yml'.format(name)
+        path.write_text('\n'.join([
+            'general:',
+            '  debug: False',
+            '  name: {}'.format(name),
+            '  hist_file: {}'.format(hist_file or tmp_path / '{}.csv'.format(pair)),
+            '  log_dir: {}'.format(tmp_path / 'log'),
+            '  data_dir: {}'.format(tmp_path / 'data'),
+            '  key: key',
+            '  passphrase: passphrase',
+            '  b64secret: c2VjcmV0',
+            '  currency: USD',
+            '  pair: {}'.format(pair),
+            '  send_email: False',
+            '  monitor_alert_change: -1.0',
+            '  ema_a: {}'.format(ema_a),
+            '  ema_b: {}'.format(ema_b),
+            '  resample: {}'.format(resample),
+            '']))
+        return str(path)
+    return make
@@ -0,0 +1,93 @@
+"""Daemon scheduling with a fake clock and a stub fleet"""
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from emabot.daemon import Daemon, next_boundary, resample_seconds
+
+DAY = 86400
+# 2020-09-13 00:00 UTC
+MIDNIGHT = 1599955200
+
+
+class FakeClock:
+    """time() and sleep(); sleep advances by a fraction of the delay (1.0 sleeps it fully)"""
+    def __init__(self, now: float, fraction: float = 1.0):
+        self.now = now
+        self.fraction = fraction
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay * self.fraction if delay > 1 else delay
+
+
+class StubFleet:
+    def __init__(self, clock, *resamples):
+        self.clock = clock
+        self.bots = [SimpleNamespace(name=rule, resample=rule, hist_file='unused.csv')
+            for rule in resamples]
+        self.ticks = []
+
+    def run(self, bots):
+        self.ticks.append((self.clock.time(), [bot.name for bot in bots]))
+
+
+def pandas_boundary(now: float, rule: str, first: float) -> float:
+    """First bin label after now of a 1m history starting at first, as resample() labels it"""
+    index = pd.to_datetime(np.arange(first, now + 3 * DAY, 60), unit='s')
+    labels = pd.Series(1.0, index=index).resample(rule).count().index
+    labels = labels.values.astype('datetime64[s]').astype(np.int64)
+    return float(labels[np.searchsorted(labels, now, side='right')])
+
+
+@pytest.mark.parametrize('rule', ['1h', '4h', '12h', '1D'])
+def test_next_boundary_of_day_dividing_rules(rule):
+    step = resample_seconds(rule)
+    for now in (MIDNIGHT, MIDNIGHT + 1, MIDNIGHT + step - 1, MIDNIGHT + 5 * step + 30):
+        boundary = next_boundary(now, rule)
+        assert boundary > now and boundary % step == 0
+        assert boundary == pandas_boundary(now, rule, MIDNIGHT - 3 * DAY + 120)
+
+@pytest.mark.parametrize('rule', ['7h', '2D', '5h'])
+def test_next_boundary_counts_from_the_history_origin(rule):
+    # pandas counts these bins from midnight of the first row (origin='start_day')
+    first = MIDNIGHT - 5 * DAY + 3600 * 13
+    origin = first // DAY * DAY
+    for now in (MIDNIGHT, MIDNIGHT + 3600 * 7 + 1, MIDNIGHT + DAY + 59):
+        assert next_boundary(now, rule, origin) == pandas_boundary(now, rule, first)
+
+def test_resample_seconds_rejects_calendar_rules():
+    assert resample_seconds('4h') == 4 * 3600
+    with pytest.raises(ValueError, match='not a fixed period'):
+        resample_seconds('M')
+
+def test_ticks_settle_after_each_boundary():
+    clock = FakeClock(MIDNIGHT + 30)
+    fleet = StubFleet(clock, '1h', '4h')
+    daemon = Daemon(fleet, settle=120, clock=clock.time, sleep=clock.sleep)
+    daemon.run(ticks=5)
+    assert fleet.ticks == [
+        (MIDNIGHT + 120, ['1h', '4h']),
+        (MIDNIGHT + 3600 + 120, ['1h']),
+        (MIDNIGHT + 7200 + 120, ['1h']),
+        (MIDNIGHT + 10800 + 120, ['1h']),
+        (MIDNIGHT + 14400 + 120, ['1h', '4h']),
+    ]
+
+def test_tick_waits_out_a_sleep_that_returns_early():
+    clock = FakeClock(MIDNIGHT + 200, fraction=0.25)
+    fleet = StubFleet(clock, '1h')
+    daemon = Daemon(fleet, settle=120, clock=clock.time, sleep=clock.sleep)
+    daemon.run(ticks=2)
+    assert fleet.ticks == [(MIDNIGHT + 3600 + 120, ['1h']), (MIDNIGHT + 7200 + 120, ['1h'])]
+    assert len(clock.sleeps) > 2
+
+def test_tick_at_the_boundary_does_not_repeat():
+    clock = FakeClock(MIDNIGHT + 120)
+    fleet = StubFleet(clock, '1h')
+    daemon = Daemon(fleet, settle=120, clock=clock.time, sleep=clock.sleep)
+    assert daemon.due(clock.time()) == (MIDNIGHT + 3600 + 120, fleet.bots)
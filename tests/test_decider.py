@@ -0,0 +1,50 @@
+"""IncrementalDecider/EmaState against the talib recompute of backtest_decider()"""
+import numpy as np
+import pytest
+from emabot.decider import EmaState, IncrementalDecider, cross_decision
+from conftest import random_walk, write_history
+
+talib = pytest.importorskip('talib')
+
+# EmaState and talib.EMA may round the EMA step differently (see EmaState)
+RTOL = 1e-13
+
+
+@pytest.mark.parametrize('period', [2, 3, 5, 13, 26])
+def test_ema_state_matches_talib(period):
+    closes = random_walk(5000)
+    expected = talib.EMA(closes, period)
+    state = EmaState(period)
+    values = np.array([state.update(i) for i in closes.tolist()])
+    assert np.isnan(values[:period - 1]).all()
+    assert values[period - 1] == expected[period - 1]
+    np.testing.assert_allclose(values[period:], expected[period:], rtol=RTOL, atol=0)
+
+def test_ema_state_round_trip():
+    state = EmaState(5)
+    for i in random_walk(7).tolist():
+        state.update(i)
+    restored = EmaState.from_dict(state.to_dict())
+    assert restored.update(501.0) == state.update(501.0)
+
+def test_cross_decision():
+    assert cross_decision(1.0, 2.0, 3.0, 2.0) == 'buy'
+    assert cross_decision(3.0, 2.0, 3.0, 2.0) == 'noop'
+    assert cross_decision(3.0, 2.0, 1.0, 2.0) == 'sell'
+    assert cross_decision(1.0, 2.0, 2.0, 2.0) == 'noop'
+
+@pytest.mark.parametrize('emaA, emaB, resample', [(2, 3, '1h'), (5, 13, '4h')])
+def test_incremental_decider_matches_backtest_decider(tmp_path, emaA, emaB, resample):
+    from emabot.bot import backtest_decider
+    closes = random_walk(60 * 24 * 20, seed=emaA)
+    state_path = str(tmp_path / 'decider.json')
+    # First run on a prefix, then fold in the appended rows from the saved state
+    csv_path = write_history(tmp_path / 'history.csv', closes[:60 * 24 * 15])
+    IncrementalDecider(csv_path, state_path, emaA, emaB, resample).decide()
+    write_history(csv_path, closes)
+    result = IncrementalDecider(csv_path, state_path, emaA, emaB, resample).decide()
+    expected = backtest_decider(emaA=emaA, emaB=emaB, resample=resample, csv_path=csv_path)
+    assert result['decision'] == expected['decision']
+    assert result['close'] == expected['close']
+    assert result['emaA'] == pytest.approx(expected['emaA'], rel=RTOL)
+    assert result['emaB'] == pytest.approx(expected['emaB'], rel=RTOL)
@@ -0,0 +1,47 @@
+"""Fleet and bot CLI error handling"""
+import os
+import sys
+import pytest
+from emabot import bot, history
+from emabot.exchange import HistoryError
+from emabot.fleet import Fleet, FleetError
+
+
+def failing_sync(*args, **kwargs):
+    raise HistoryError('candles: 503 Service Unavailable')
+
+
+def test_history_error_becomes_fleet_error(bot_config, monkeypatch):
+    monkeypatch.setattr(history, 'sync', failing_sync)
+    config = bot_config()
+    fleet = Fleet(os.path.dirname(config), dryrun=True)
+    with pytest.raises(FleetError, match='history sync failed: candles: 503'):
+        fleet.run()
+
+def test_fleet_cli_exits_cleanly_on_history_error(bot_config, monkeypatch):
+    monkeypatch.setattr(history, 'sync', failing_sync)
+    config_dir = os.path.dirname(bot_config())
+    monkeypatch.setattr(sys, 'argv', ['emabot', '--dryrun', '--configs', config_dir])
+    with pytest.raises(SystemExit, match='history sync failed'):
+        bot.main()
+
+def test_daemon_cli_exits_cleanly_on_fleet_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['emabot', '--daemon', '--configs', str(tmp_path)])
+    with pytest.raises(SystemExit, match='No \\*.yml configs'):
+        bot.main()
+
+def test_daemon_tick_survives_history_error(bot_config, monkeypatch, capsys):
+    from emabot.daemon import Daemon
+    monkeypatch.setattr(history, 'sync', failing_sync)
+    fleet = Fleet(os.path.dirname(bot_config()), dryrun=True)
+    Daemon(fleet).tick(fleet.bots)
+    assert 'history sync failed' in capsys.readouterr().err
+
+def test_bot_cli_exits_cleanly_on_history_error(bot_config, monkeypatch):
+    monkeypatch.setattr(history, 'generate_historical_csv', failing_sync)
+    monkeypatch.setattr(bot.EmaBot, 'get_wallet', lambda self: None)
+    monkeypatch.setattr(bot.EmaBot, 'get_fees', lambda self: None)
+    monkeypatch.setattr(bot.EmaBot, 'get_price', lambda self: None)
+    monkeypatch.setattr(sys, 'argv', ['emabot', '--dryrun', '--config', bot_config()])
+    with pytest.raises(SystemExit, match='API_ERROR: candles: 503'):
+        bot.main()
@@ -0,0 +1,161 @@
+"""Concurrent, rate limited history download against stub clients and a stub candles server"""
+import calendar
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from emabot import history
+from emabot.exchange import Exchange, HistoryError
+
+WINDOW = 240 * 60
+
+
+def epoch(text: str) -> int:
+    return calendar.timegm(time.strptime(text, '%Y-%m-%dT%H:%M:%SZ'))
+
+def stub_candles(start: int, end: int, missing=()) -> list:
+    """Candles of [start, end] newest first, like the candles endpoint"""
+    return [[t, 1.0, 2.0, 1.5, float(t % 1000), 0.5] for t in range(end, start - 1, -60)
+        if t not in missing]
+
+def make_windows(count: int, start: int = 1600000000 // WINDOW * WINDOW) -> list:
+    return [(history.date2str(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(i))),
+        history.date2str(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(i + WINDOW - 60))))
+        for i in range(start, start + count * WINDOW, WINDOW)]
+
+
+class StubClient:
+    """get_product_historic_rates() of cbpro.PublicClient, slower for the earlier windows"""
+    def __init__(self, stub):
+        self.stub = stub
+
+    def get_product_historic_rates(self, pair, granularity=None, start=None, end=None):
+        return self.stub.fetch(epoch(start), epoch(end))
+
+
+class StubExchange(Exchange):
+    def __init__(self, windows, missing=(), errors=(), **kwargs):
+        super().__init__(api_url='http://stub.invalid', **kwargs)
+        self.first = epoch(windows[0][0])
+        self.count = len(windows)
+        self.missing = set(missing)
+        self.errors = set(errors)
+        self.active = 0
+        self.max_active = 0
+        self.completed = []
+        self.stub_lock = threading.Lock()
+
+    def public_client(self):
+        return StubClient(self)
+
+    def fetch(self, start, end):
+        window = (start - self.first) // WINDOW
+        with self.stub_lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        # Later windows answer first
+        time.sleep(0.002 * (self.count - window))
+        with self.stub_lock:
+            self.active -= 1
+            self.completed.append(window)
+        if window in self.errors:
+            return {'message':'NotFound'}
+        return stub_candles(start, end, self.missing)
+
+
+def test_fetch_windows_yields_in_window_order():
+    windows = make_windows(16)
+    exchange = StubExchange(windows, rate=1000.0, burst=100)
+    results = list(history.fetch_windows('MKR-USD', windows, exchange, jobs=4))
+    assert results == [stub_candles(epoch(a), epoch(b)) for (a, b) in windows]
+    # Responses did arrive out of order, from up to jobs threads at a time
+    assert exchange.completed != sorted(exchange.completed)
+    assert 1 < exchange.max_active <= 4
+
+def test_fetch_windows_keeps_gaps_and_empty_windows():
+    windows = make_windows(4)
+    first = epoch(windows[0][0])
+    missing = set(range(first, first + WINDOW, 60)) | {first + WINDOW + 600, first + WINDOW + 660}
+    exchange = StubExchange(windows, missing=missing, rate=1000.0, burst=100)
+    results = list(history.fetch_windows('MKR-USD', windows, exchange, jobs=3))
+    assert [len(i) for i in results] == [0, 238, 240, 240]
+    assert not missing & {candle[0] for candle in results[1]}
+
+def test_fetch_windows_shares_the_rate_limit():
+    windows = make_windows(9)
+    exchange = StubExchange(windows, rate=40.0, burst=1)
+    start = time.monotonic()
+    list(history.fetch_windows('MKR-USD', windows, exchange, jobs=8))
+    # The first request uses the burst, the others wait for a token
+    assert time.monotonic() - start >= 8 / 40.0 * 0.9
+    assert exchange.histogram('candles').count == 9
+
+def test_fetch_windows_raises_history_error():
+    windows = make_windows(6)
+    exchange = StubExchange(windows, errors={3}, rate=1000.0, burst=100)
+    fetched = []
+    with pytest.raises(HistoryError, match='NotFound'):
+        for stats in history.fetch_windows('MKR-USD', windows, exchange, jobs=2):
+            fetched.append(stats)
+    assert len(fetched) == 3
+
+
+class CandlesHandler(BaseHTTPRequestHandler):
+    """/products/<pair>/candles of the exchange: rate limited once, then candles newest first"""
+    missing = set()
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.requests.append(self.path)
+        if len(self.requests) == 1:
+            (code, body) = (429, {'message':'Public rate limit exceeded'})
+        else:
+            start = epoch(query['start'][0])
+            end = epoch(query['end'][0])
+            now = int(time.time())
+            (code, body) = (200, [candle for candle in stub_candles(start // 60 * 60,
+                end // 60 * 60, self.missing) if candle[0] <= now])
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def candles_server():
+    pytest.importorskip('cbpro')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CandlesHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+def test_generate_historical_csv_from_stub_server(tmp_path, candles_server, monkeypatch):
+    monkeypatch.setattr(Exchange, 'backoff', lambda self, attempt: None)
+    now = int(time.time()) // 60 * 60
+    gap = set(range(now - 7200, now - 6600, 60))
+    monkeypatch.setattr(CandlesHandler, 'missing', gap)
+    monkeypatch.setattr(CandlesHandler, 'requests', [])
+    outfile = str(tmp_path / 'MKR-USD.csv')
+    history.generate_historical_csv(outfile, pair='MKR-USD', days_ago=1, jobs=4, rate=1000.0,
+        burst=100, api_url=candles_server)
+    with open(outfile) as fd:
+        header = fd.readline()
+        stamps = [history.parse_timestamp(line) for line in fd]
+    assert header.startswith('"timestamp"')
+    # In timestamp order, once each, with the missing minutes left out
+    assert stamps == sorted(set(stamps))
+    assert not gap & set(stamps)
+    assert stamps[-1] >= now - 60
+    assert (now - 7200, now - 6660) in history.find_gaps(history.update_gap_index(outfile))
+    # The rate limited first request was retried
+    assert len(CandlesHandler.requests) == len(set(CandlesHandler.requests)) + 1
@@ -0,0 +1,29 @@
+"""The light entry point modes must not import the numeric stack, cbpro or requests"""
+import pytest
+from emabot import importtime
+
+LIGHT = [mode for (mode, (_, allowed, _)) in importtime.MODES.items() if not allowed]
+
+
+@pytest.mark.parametrize('mode', LIGHT)
+def test_light_mode_loads_no_heavy_module(mode):
+    result = importtime.check(mode, repeat=1)
+    assert result['unexpected'] == []
+    assert result['ok']
+
+def test_monitor_contract():
+    (_, loaded) = importtime.measure(('emabot.bot', 'urllib.request'))
+    for name in ('pandas', 'numpy', 'talib', 'pandas_ta', 'cbpro', 'requests'):
+        assert name not in loaded
+
+def test_slow_does_not_fail(monkeypatch):
+    monkeypatch.setitem(importtime.MODES, 'monitor', (('emabot.journal',), (), 0.0001))
+    result = importtime.check('monitor', repeat=1)
+    assert result['slow']
+    assert result['ok']
+
+def test_heavy_module_fails(monkeypatch):
+    monkeypatch.setitem(importtime.MODES, 'journal', (('emabot.journal', 'numpy'), (), None))
+    result = importtime.check('journal', repeat=1)
+    assert result['unexpected'] == ['numpy']
+    assert not result['ok']
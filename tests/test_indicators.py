@@ -0,0 +1,52 @@
+"""Disk store of the memoized indicators: size limit and how often it is scanned"""
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('talib')
+
+from emabot.backtests import indicators
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    scans = []
+    evict = indicators.evict
+
+    def counting_evict(store, max_bytes=None):
+        scans.append(store)
+        return evict(store, max_bytes)
+    monkeypatch.setattr(indicators, 'evict', counting_evict)
+    monkeypatch.setattr(indicators, '_store_bytes', {})
+    # Room for fifty 1000 float entries
+    monkeypatch.setattr(indicators, 'DISK_BYTES', 50 * 8200)
+    store = str(tmp_path / 'indicators')
+    store_bytes = lambda: sum(i.stat().st_size for i in os.scandir(store))
+    return (store, scans, store_bytes)
+
+def test_store_is_scanned_once_below_the_limit(store):
+    (path, scans, store_bytes) = store
+    for i in range(8):
+        indicators._save(path, 'key{}'.format(i), np.zeros(1000))
+    assert scans == [path]
+    assert len(os.listdir(path)) == 8
+
+def test_store_stays_within_the_limit(store):
+    (path, scans, store_bytes) = store
+    for i in range(200):
+        indicators._save(path, 'key{}'.format(i), np.zeros(1000))
+        assert store_bytes() <= indicators.DISK_BYTES
+    # Evicting to below the limit leaves room for a few writes before the next scan
+    assert len(scans) <= 200 // 4
+    # The newest entries are kept
+    assert 'key199.npy' in os.listdir(path)
+    assert 'key0.npy' not in os.listdir(path)
+
+def test_first_write_trims_an_oversized_store(store):
+    (path, scans, store_bytes) = store
+    os.makedirs(path)
+    for i in range(60):
+        np.save(os.path.join(path, 'old{}.npy'.format(i)), np.zeros(1000))
+    indicators._save(path, 'new', np.zeros(1000))
+    assert scans == [path]
+    assert store_bytes() <= indicators.DISK_BYTES
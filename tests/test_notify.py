@@ -0,0 +1,164 @@
+"""Notifier batching and delivery against an in-process SMTP sink"""
+import email
+import socketserver
+import threading
+import time
+import pytest
+from emabot.notify import Notifier
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: one session per connection, messages kept by the server"""
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 sink')
+        (sender, recipients) = (None, [])
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 sink')
+            elif command == 'MAIL':
+                (sender, recipients) = (line.split(':', 1)[1].strip('<> '), [])
+                self.reply('250 ok')
+            elif command == 'RCPT':
+                recipient = line.split(':', 1)[1].strip('<> ')
+                if recipient in server.rejected:
+                    self.reply('550 no such user')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 ok')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if chunk in (b'.\r\n', b''):
+                        break
+                    data.append(chunk)
+                time.sleep(server.delay)
+                with server.lock:
+                    server.messages.append((sender, recipients,
+                        email.message_from_bytes(b''.join(data))))
+                    hangup = server.hangup_after == len(server.messages)
+                self.reply('250 queued')
+                if hangup:
+                    return
+            elif command in ('RSET', 'NOOP'):
+                self.reply('250 ok')
+            else:
+                self.reply('502 not implemented')
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpHandler)
+        self.lock = threading.Lock()
+        self.messages = []
+        self.connections = 0
+        self.rejected = set()
+        self.delay = 0.0
+        self.hangup_after = None
+
+    @property
+    def host(self) -> str:
+        return '127.0.0.1:{}'.format(self.server_address[1])
+
+    def subjects(self, recipient: str = None) -> list:
+        return [message['Subject'] for (_, recipients, message) in self.messages
+            if recipient is None or recipient in recipients]
+
+
+@pytest.fixture
+def sink():
+    server = SmtpSink()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def notifier():
+    notifiers = []
+
+    def make(window: float = 0.2) -> Notifier:
+        notifiers.append(Notifier(window=window))
+        return notifiers[-1]
+    yield make
+    for i in notifiers:
+        i.close(timeout=5)
+
+
+def test_burst_becomes_one_digest_per_recipient(sink, notifier):
+    mailer = notifier(window=0.3)
+    for name in ('eth', 'btc', 'mkr'):
+        mailer.send(sink.host, 'bot@example.com', ['a@example.com', 'b@example.com'],
+            'MONITOR-WARNING: {}'.format(name), 'change -5%', digest='MONITOR-WARNING')
+    assert mailer.flush(timeout=5)
+    assert sink.subjects('a@example.com') == ['MONITOR-WARNING digest: 3 notifications']
+    assert sink.subjects('b@example.com') == ['MONITOR-WARNING digest: 3 notifications']
+    body = sink.messages[0][2].get_payload()
+    assert body.index('MONITOR-WARNING: eth') < body.index('MONITOR-WARNING: btc') < \
+        body.index('MONITOR-WARNING: mkr')
+    assert (mailer.sent, mailer.failed) == (2, 0)
+
+def test_mails_without_digest_keep_their_order_on_one_session(sink, notifier):
+    mailer = notifier(window=0.05)
+    mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'BUY', 'bought')
+    mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'MONITOR-WARNING: eth',
+        digest='MONITOR-WARNING')
+    assert mailer.flush(timeout=5)
+    mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'SELL', 'sold')
+    assert mailer.flush(timeout=5)
+    # A lone digest mail keeps its own subject
+    assert sink.subjects() == ['BUY', 'MONITOR-WARNING: eth', 'SELL']
+    assert sink.connections == 1
+
+def test_send_does_not_wait_for_a_slow_relay(sink, notifier):
+    sink.delay = 0.2
+    mailer = notifier(window=0.0)
+    start = time.monotonic()
+    for i in range(3):
+        mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'SELL {}'.format(i))
+    assert time.monotonic() - start < 0.1
+    assert mailer.flush(timeout=10)
+    assert mailer.sent == 3
+
+def test_reconnects_after_the_relay_hangs_up(sink, notifier):
+    sink.hangup_after = 1
+    mailer = notifier(window=0.0)
+    mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'BUY')
+    assert mailer.flush(timeout=5)
+    mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'SELL')
+    assert mailer.flush(timeout=5)
+    assert sink.subjects() == ['BUY', 'SELL']
+    assert (mailer.sent, mailer.failed, sink.connections) == (2, 0, 2)
+
+def test_rejected_recipient_is_logged_not_raised(sink, notifier, caplog):
+    sink.rejected.add('gone@example.com')
+    mailer = notifier(window=0.05)
+    mailer.send(sink.host, 'bot@example.com', ['gone@example.com', 'a@example.com'], 'BUY')
+    assert mailer.flush(timeout=5)
+    assert sink.subjects() == ['BUY']
+    assert (mailer.sent, mailer.failed) == (1, 1)
+    assert 'gone@example.com' in caplog.text
+
+def test_close_delivers_without_waiting_for_the_window(sink, notifier):
+    mailer = notifier(window=30.0)
+    mailer.send(sink.host, 'bot@example.com', ['a@example.com'], 'PROFIT', digest='PROFIT')
+    start = time.monotonic()
+    mailer.close(timeout=5)
+    assert time.monotonic() - start < 5
+    assert sink.subjects() == ['PROFIT']
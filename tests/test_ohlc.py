@@ -0,0 +1,46 @@
+"""ohlc.read_csv() with only some columns loaded against pandas on the full CSV"""
+import gzip
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import random_walk, write_history
+from emabot import ohlc
+
+COLUMNS = ['timestamp', 'close']
+
+
+@pytest.fixture
+def nan_history(tmp_path):
+    """History CSV with NaN open and volume values on some rows that have a close"""
+    csv_file = write_history(tmp_path / 'history.csv', random_walk(60 * 24 * 3, seed=7))
+    df = pd.read_csv(csv_file)
+    df.loc[[5, 700, 701, 1500], 'volume'] = np.nan
+    df.loc[[60, 2000], 'open'] = np.nan
+    df.to_csv(csv_file, index=False)
+    return csv_file
+
+def expected(csv_file: str) -> pd.DataFrame:
+    return pd.read_csv(csv_file).dropna(how='any')[COLUMNS].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('cache', [True, False])
+def test_pruned_columns_drop_the_same_rows(nan_history, cache):
+    df = ohlc.read_csv(nan_history, cache=cache, usecols=COLUMNS, chunksize=1000)
+    pd.testing.assert_frame_equal(df, expected(nan_history))
+
+def test_pruned_columns_of_gzip_drop_the_same_rows(nan_history):
+    with open(nan_history, 'rb') as src, gzip.open(nan_history + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    df = ohlc.read_csv(nan_history + '.gz', usecols=COLUMNS, chunksize=1000)
+    pd.testing.assert_frame_equal(df, expected(nan_history))
+
+def test_pruned_rows_match_the_resample_pyramid(nan_history):
+    df = ohlc.read_csv(nan_history, usecols=COLUMNS)
+    df = df.set_index(pd.to_datetime(df.timestamp, unit='s'))
+    bins = df.resample('1h').ohlc()['close']['close']
+    np.testing.assert_array_equal(ohlc.resample_close(nan_history, '1h').values, bins.values)
+
+def test_all_columns_keep_nan_rows(nan_history):
+    # Without usecols it stays a drop-in for pd.read_csv()
+    pd.testing.assert_frame_equal(ohlc.read_csv(nan_history), pd.read_csv(nan_history))